@@ -150,13 +150,19 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'core.renderers.FastJSONRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'core.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ],
     'DEFAULT_THROTTLE_CLASSES': [
         'rest_framework.throttling.AnonRateThrottle',
     ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '20/minute',
+        'geocode': '60/minute',
     },
 }
 
@@ -170,32 +176,32 @@ CORS_ALLOWED_ORIGINS = [
 ASGI_APPLICATION = 'EmmergencyAmbulanceSystem.asgi.application'
 
 # Channels layer
-# Use in-memory layer for development if Redis is not available
-def test_redis_connection():
-    """Test if Redis server is actually running"""
-    try:
-        import redis
-        r = redis.Redis(host='127.0.0.1', port=6379, socket_connect_timeout=1)
-        r.ping()
-        return True
-    except Exception:
-        return False
-
-if test_redis_connection():
-    CHANNEL_LAYERS = {
-        'default': {
-            'BACKEND': 'channels_redis.core.RedisChannelLayer',
-            'CONFIG': {
-                'hosts': [('127.0.0.1', 6379)],
+# Redis when it is reachable, otherwise a bounded in-process layer: the
+# failover layer connects lazily, health-checks Redis in the background and
+# switches between the two at runtime. On overflow the in-process layer
+# merges an update into a queued one for the same entity, otherwise it
+# drops the oldest message.
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'core.layers.FailoverChannelLayer',
+        'CONFIG': {
+            'primary': {
+                'BACKEND': 'channels_redis.core.RedisChannelLayer',
+                'CONFIG': {
+                    'hosts': [('127.0.0.1', 6379)],
+                },
             },
+            'fallback': {
+                'BACKEND': 'core.layers.LocalChannelLayer',
+                'CONFIG': {
+                    'capacity': 500,
+                    'overflow': 'merge',
+                },
+            },
+            'check_interval': 5,
         },
-    }
-else:
-    CHANNEL_LAYERS = {
-        'default': {
-            'BACKEND': 'channels.layers.InMemoryChannelLayer',
-        },
-    }
+    },
+}
 
 # Static files
 STATICFILES_DIRS = [
@@ -209,6 +215,52 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Dispatch
+# Seconds between batched writes of live ambulance GPS fixes to the database
+LIVE_POSITION_FLUSH_INTERVAL = 5
+# Upper bound on calls and units considered by one batch assignment solve
+ASSIGNMENT_MAX_SIZE = 300
+# Optional GeoJSON road network for travel-time estimates (straight line when unset)
+ROAD_NETWORK_PATH = None
+# Road searches give up past this many seconds (the target counts as unreachable)
+ROAD_ROUTE_MAX_SECONDS = 3 * 3600
+# Coverage grid: (south, west, north, east) in degrees; derived from the data when None
+COVERAGE_BOUNDS = None
+COVERAGE_CELL_DEGREES = 0.01
+# Populated cells slower than this from the nearest available unit raise COVERAGE_GAP
+COVERAGE_TARGET_MINUTES = 8
+# Hour-of-week demand grids (see `manage.py build_demand_model`)
+DEMAND_CELL_DEGREES = 0.01
+DEMAND_BANDWIDTH_KM = 1.0
+
+# Emergencies
+# Local gazetteer for reverse geocoding: GeoNames dump (.txt) or CSV with name,latitude,longitude[,region,country]
+GAZETTEER_PATH = None
+GEOCODER_MAX_DISTANCE_KM = 25
+
+# Real-time notifications
+# Send dispatchers only the changed fields of calls/units (see core/deltas.py)
+NOTIFICATION_DELTAS = True
+# Seconds between batched LOCATIONS_TICK frames (0 sends every LOCATION_UPDATE immediately)
+LOCATION_TICK_INTERVAL = 1.0
+# Dispatcher events kept for replay to reconnecting clients
+EVENT_REPLAY_BUFFER = 1000
+# Seconds before the shared dispatcher board snapshot is reloaded from the database
+DISPATCH_SNAPSHOT_MAX_AGE = 300
+# Tile size (degrees) of the region groups dispatchers can subscribe to (0 disables them)
+DISPATCH_REGION_TILE_DEGREES = 0.1
+# Wire formats dispatcher events are encoded in once per event (json, msgpack, msgpack+deflate);
+# sockets using another format encode each event themselves
+WS_PREENCODED_FORMATS = ['json']
+# Unacknowledged frames before a dispatcher socket is switched to periodic snapshots
+DISPATCH_FLOW_WATERMARK = 200
+# Seconds between snapshots sent to a lagging dispatcher socket
+DISPATCH_FLOW_SNAPSHOT_INTERVAL = 2.0
+# Seconds without a heartbeat before a connection counts as gone (clients ping every 20 s)
+PRESENCE_TTL = 60
+# Cache holding presence; must be shared (Redis, Memcached) when running several nodes
+PRESENCE_CACHE = 'default'
+
 # Logging configuration for debugging WebSocket connections
 LOGGING = {
     'version': 1,
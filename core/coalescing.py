@@ -0,0 +1,167 @@
+"""
+Coalescing of ambulance LOCATION_UPDATE broadcasts.
+
+GPS fixes arrive far more often than a dashboard needs to redraw. Instead of
+one ``group_send`` per fix, the latest payload per unit is held here and a
+task on the server's event loop queues them together as a single
+``LOCATIONS_TICK`` frame every ``LOCATION_TICK_INTERVAL`` seconds. Any other
+event for a unit (for example ``UNIT_DISPATCHED``) is sent immediately and
+drops that unit's pending position, since the immediate payload is newer.
+
+Fixes can also be offered by unit id alone (``offer_unit``); the payloads of
+all units moved that way are then read with one ``loader`` call per tick
+instead of one database read per fix.
+
+Outside an ASGI server (management commands, the shell) there is no loop to
+run the ticker on and every fix is sent straight away, as it is when
+``LOCATION_TICK_INTERVAL = 0``.
+"""
+import asyncio
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TICK_INTERVAL = 1.0
+
+
+class LocationCoalescer:
+    """Latest pending LOCATION_UPDATE payload per ambulance, flushed on a timer."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: Dict[Any, Dict[str, Any]] = {}
+        # Units offered by id whose payload is loaded at the next tick
+        self._moved: Set[Any] = set()
+        self._loader: Optional[Callable[[Iterable], List[Dict[str, Any]]]] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def interval(self) -> float:
+        return float(getattr(settings, 'LOCATION_TICK_INTERVAL', DEFAULT_TICK_INTERVAL))
+
+    def offer(self, ambulance_data: Dict[str, Any]) -> bool:
+        """
+        Hold a LOCATION_UPDATE payload for the next tick.
+
+        Returns False when coalescing is disabled or no server loop is
+        available, and the caller should send the event itself.
+        """
+        from .utils import get_main_event_loop
+
+        pk = ambulance_data.get('id')
+        if self.interval <= 0 or pk is None:
+            return False
+        loop = get_main_event_loop()
+        if loop is None:
+            return False
+        with self._lock:
+            self._pending[pk] = ambulance_data
+            self._schedule(loop)
+        return True
+
+    def set_loader(self, loader: Callable[[Iterable], List[Dict[str, Any]]]):
+        """Set ``loader(ids)``, returning the current payloads of those units."""
+        self._loader = loader
+
+    def offer_unit(self, pk) -> bool:
+        """
+        Hold a LOCATION_UPDATE for a unit known only by id; its payload is
+        loaded with the other moved units at the next tick.
+
+        Returns False like ``offer``, or when no loader is set.
+        """
+        from .utils import get_main_event_loop
+
+        if self._loader is None or self.interval <= 0:
+            return False
+        loop = get_main_event_loop()
+        if loop is None:
+            return False
+        with self._lock:
+            self._moved.add(pk)
+            self._schedule(loop)
+        return True
+
+    def _schedule(self, loop):
+        """Make sure the ticker runs on ``loop`` (lock held)."""
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._task = None
+            loop.call_soon_threadsafe(self._start)
+
+    def discard(self, pk):
+        """Drop a unit's pending position because a newer payload is being sent."""
+        with self._lock:
+            self._pending.pop(pk, None)
+            self._moved.discard(pk)
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._moved.union(self._pending))
+
+    def _start(self):
+        with self._lock:
+            if self._task is None or self._task.done():
+                self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def build_tick(self) -> Optional[Dict[str, Any]]:
+        """Take all pending positions as one LOCATIONS_TICK message."""
+        from .regions import route_for
+        from .utils import versioned_payload
+
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            moved, self._moved = self._moved, set()
+        if moved:
+            for ambulance_data in self._loader(moved):
+                pending[ambulance_data['id']] = ambulance_data
+        batch = list(pending.values())
+        if not batch:
+            return None
+
+        units, routes, tiles = [], [], []
+        for ambulance_data in batch:
+            full, data, is_delta = versioned_payload('ambulance_update', ambulance_data)
+            units.append({'delta': is_delta, 'data': data})
+            unit_tiles = route_for('ambulance', full)['tiles']
+            routes.append(unit_tiles)
+            tiles.extend(t for t in unit_tiles if t not in tiles)
+        return {
+            'type': 'ambulance_update',
+            'event': 'LOCATIONS_TICK',
+            'data': {'units': units},
+            'delta': False,
+            'route': {'tiles': tiles, 'units': routes}
+        }
+
+    def flush(self):
+        """Queue all pending positions as one LOCATIONS_TICK frame (may read the database)."""
+        from .outbox import outbox
+        from .regions import publish
+
+        tick = self.build_tick()
+        if tick is None:
+            return
+        publish(outbox, tick)
+
+    async def _run(self):
+        from channels.db import database_sync_to_async
+
+        while True:
+            await asyncio.sleep(max(self.interval, 0.05))
+            try:
+                if self._moved:
+                    # The loader reads the database; keep it off the loop
+                    await database_sync_to_async(self.flush, thread_sensitive=False)()
+                else:
+                    self.flush()
+            except Exception as e:
+                logger.warning(f"Failed to send location tick: {e}", exc_info=True)
+
+
+location_coalescer = LocationCoalescer()
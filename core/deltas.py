@@ -0,0 +1,86 @@
+"""
+Per-entity versions and field-level deltas for dispatcher notifications.
+
+Every emergency call and ambulance pushed to the dispatchers group gets a
+version number. The first payload seen for an entity goes out in full; after
+that only the fields that differ from the previously sent payload go out,
+together with ``base_version`` (the version the delta applies on top of).
+Clients that don't hold ``base_version`` ask for the entity again with a
+``{"type": "resync"}`` frame instead of applying the delta.
+
+Versions live in process memory and are qualified by a per-process
+``epoch``, so a restart (or a second worker) can never be mistaken for a
+continuation of another process's version sequence.
+"""
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+# Channel message types whose payloads are versioned, and their entity kind
+DELTA_MESSAGE_TYPES = {
+    'emergency_update': 'emergency',
+    'ambulance_update': 'ambulance',
+}
+
+MAX_ENTITIES = 50000
+
+_MISSING = object()
+
+
+class EntityVersionStore:
+    """Last sent payload and version per (kind, id), LRU-bounded."""
+
+    def __init__(self, max_entities: int = MAX_ENTITIES):
+        self.epoch = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[Tuple[str, Any], Tuple[int, Dict[str, Any]]]' = OrderedDict()
+        self._max_entities = max_entities
+
+    def stamp(self, kind: str, pk, data: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+        """
+        Record ``data`` as the next version of an entity.
+
+        Returns ``(full, delta)``: the versioned full payload, and the delta
+        against the previous version (None when there is no previous one).
+        """
+        key = (kind, pk)
+        with self._lock:
+            previous = self._entries.get(key)
+            version = previous[0] + 1 if previous else 1
+            self._entries[key] = (version, dict(data))
+            self._entries.move_to_end(key)
+            if len(self._entries) > self._max_entities:
+                self._entries.popitem(last=False)
+
+        full = {**data, 'version': version, 'epoch': self.epoch}
+        if previous is None:
+            return full, None
+
+        base_version, base = previous
+        changes = {k: v for k, v in data.items() if base.get(k, _MISSING) != v}
+        delta = {**changes, 'id': pk, 'version': version, 'base_version': base_version, 'epoch': self.epoch}
+        return full, delta
+
+    def version(self, kind: str, pk) -> int:
+        with self._lock:
+            entry = self._entries.get((kind, pk))
+            return entry[0] if entry else 0
+
+    def versions(self, kind: str) -> Dict[Any, int]:
+        """Snapshot of current versions for one kind of entity."""
+        with self._lock:
+            return {pk: entry[0] for (k, pk), entry in self._entries.items() if k == kind}
+
+    def label(self, kind: str, data: Dict[str, Any], versions: Optional[Dict[Any, int]] = None) -> Dict[str, Any]:
+        """Attach version and epoch to a freshly serialized entity."""
+        if versions is None:
+            version = self.version(kind, data.get('id'))
+        else:
+            version = versions.get(data.get('id'), 0)
+        data['version'] = version
+        data['epoch'] = self.epoch
+        return data
+
+
+entity_versions = EntityVersionStore()
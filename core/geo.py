@@ -0,0 +1,49 @@
+"""
+Geographic helper functions shared by the dispatch and emergencies apps.
+"""
+import math
+from typing import Optional, Tuple
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Average urban ambulance speed used for straight-line ETA estimates
+DEFAULT_SPEED_KMH = 40.0
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Great-circle distance between two points in kilometres.
+
+    Args:
+        lat1, lon1: First point in decimal degrees
+        lat2, lon2: Second point in decimal degrees
+    """
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def eta_minutes(distance_km: float, speed_kmh: float = DEFAULT_SPEED_KMH) -> float:
+    """Straight-line travel time in minutes for a given distance."""
+    return distance_km / speed_kmh * 60.0
+
+
+def coerce_point(latitude, longitude) -> Optional[Tuple[float, float]]:
+    """
+    Convert a latitude/longitude pair (Decimal, str or float) to floats.
+
+    Returns None when either value is missing or out of range.
+    """
+    if latitude is None or longitude is None:
+        return None
+    try:
+        lat = float(latitude)
+        lng = float(longitude)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
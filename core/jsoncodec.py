@@ -0,0 +1,44 @@
+"""
+Fast JSON encoding and decoding shared by the API and the WebSocket consumers.
+
+Uses orjson when it is installed and falls back to the standard library
+otherwise. Both paths accept the same inputs as DRF's ``JSONRenderer``:
+datetimes, UUIDs and dataclasses are handled natively by orjson, and
+anything else (Decimal, lazy translation strings, querysets, numpy scalars,
+...) goes through DRF's own encoder so the output matches.
+"""
+import json
+from typing import Any, Union
+
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+_encoder = JSONEncoder()
+
+if orjson is not None:
+    OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z | orjson.OPT_SERIALIZE_NUMPY
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """Encode ``obj`` as compact UTF-8 JSON."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_encoder.default, option=OPTIONS)
+    return json.dumps(obj, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def dumps(obj: Any) -> str:
+    """Encode ``obj`` as a JSON string (for WebSocket text frames)."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_encoder.default, option=OPTIONS).decode('utf-8')
+    return json.dumps(obj, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':'))
+
+
+def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+    """Decode JSON; raises ``ValueError`` on malformed input."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -0,0 +1,602 @@
+"""
+Channel layers: a bounded in-process layer and a Redis failover wrapper.
+
+``LocalChannelLayer`` replaces ``channels.layers.InMemoryChannelLayer``
+(used when Redis isn't available) and is safe to run in production on
+one node:
+
+* every channel has a bounded queue, and a full queue is handled by an
+  overflow policy instead of silently rejecting new messages:
+  ``drop_oldest`` discards the oldest queued message, ``merge`` first folds
+  the new message into a queued one about the same entity (same message
+  type and ``data['id']``), composing deltas so no field change is lost;
+* ``group_send`` appends a shallow copy of the message to each member's
+  queue; there is no deep copy of the payload or task per recipient, so the
+  cost per recipient does not depend on the message size;
+* queues are guarded by a thread lock and waiting receivers are woken on
+  their own event loop, so sends from sync code (``async_to_sync``) and
+  other threads are delivered;
+* ``stats()`` reports counters (sent, dropped, merged, expired) and queue
+  depths.
+
+As with the in-memory layer, a channel whose oldest message has been
+waiting longer than ``expiry`` seconds is treated as gone and removed from
+its groups. Dispatcher dashboards recover from dropped or merged events the
+usual way: the ``seq`` gap makes them ask for a resume.
+
+``FailoverChannelLayer`` wraps a Redis layer and an in-process one and
+switches between them at runtime as Redis goes away and comes back.
+"""
+import asyncio
+import logging
+import random
+import string
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional, Set
+
+from channels.layers import BaseChannelLayer
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ('drop_oldest', 'merge')
+
+
+def merge_key(message: Dict[str, Any]):
+    """Entity a message is about, or None if it can't be merged."""
+    data = message.get('data')
+    if isinstance(data, dict) and data.get('id') is not None:
+        return (message.get('type'), data['id'])
+    return None
+
+
+def merge_messages(older: Dict[str, Any], newer: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    One message equivalent to delivering ``older`` then ``newer``.
+
+    A delta following a full payload gives the new full payload; two deltas
+    give one delta from the older one's ``base_version``. Pre-encoded frames
+    are dropped since they no longer match the data.
+    """
+    merged = {k: v for k, v in newer.items() if k != 'frames'}
+    if newer.get('delta'):
+        data = {**older['data'], **newer['data']}
+        if older.get('delta'):
+            data['base_version'] = older['data'].get('base_version')
+        else:
+            data.pop('base_version', None)
+            merged['delta'] = False
+        merged['data'] = data
+    old_route, new_route = older.get('route'), newer.get('route')
+    if old_route and new_route and 'tiles' in old_route and 'tiles' in new_route:
+        tiles = list(new_route['tiles'])
+        tiles += [t for t in old_route['tiles'] if t not in tiles]
+        merged['route'] = {**new_route, 'tiles': tiles}
+    return merged
+
+
+class _Channel:
+    __slots__ = ('queue', 'capacity', 'waiters')
+
+    def __init__(self, capacity: int):
+        self.queue: 'deque[tuple]' = deque()
+        self.capacity = capacity
+        self.waiters: 'deque[tuple]' = deque()
+
+
+class LocalChannelLayer(BaseChannelLayer):
+    """Bounded, thread-safe in-process channel layer."""
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None,
+                 overflow='drop_oldest', **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {', '.join(OVERFLOW_POLICIES)}")
+        self.overflow = overflow
+        self.group_expiry = group_expiry
+        self._lock = threading.Lock()
+        self._channels: Dict[str, _Channel] = {}
+        self._groups: Dict[str, Dict[str, float]] = {}
+        self._memberships: Dict[str, Set[str]] = {}
+        self._next_sweep = time.time() + expiry
+        self.sent = 0
+        self.dropped = 0
+        self.merged = 0
+        self.expired = 0
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        """Queue a message on a channel (never blocks; overflow is handled by policy)."""
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+        assert "__asgi_channel__" not in message
+        with self._lock:
+            self._put(channel, dict(message), time.time())
+
+    async def receive(self, channel):
+        """Wait for and return the next message on a channel."""
+        self.require_valid_channel_name(channel)
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                ch = self._channels.get(channel)
+                if ch is not None:
+                    self._purge_expired(channel, ch, time.time())
+                    if ch.queue:
+                        message = ch.queue.popleft()[1]
+                        if not ch.queue and not ch.waiters:
+                            self._channels.pop(channel, None)
+                        return message
+                else:
+                    ch = self._channels[channel] = _Channel(self.get_capacity(channel))
+                waiter = (loop, loop.create_future())
+                ch.waiters.append(waiter)
+            try:
+                await waiter[1]
+            finally:
+                with self._lock:
+                    try:
+                        ch.waiters.remove(waiter)
+                    except ValueError:
+                        pass
+
+    def receive_nowait(self, channel) -> Optional[Dict[str, Any]]:
+        """The next queued message on a channel, or None without waiting."""
+        with self._lock:
+            ch = self._channels.get(channel)
+            if ch is None:
+                return None
+            self._purge_expired(channel, ch, time.time())
+            return ch.queue.popleft()[1] if ch.queue else None
+
+    async def new_channel(self, prefix="specific."):
+        return "%s.local!%s" % (
+            prefix,
+            "".join(random.choice(string.ascii_letters) for i in range(12)),
+        )
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        with self._lock:
+            self._groups.setdefault(group, {})[channel] = time.time()
+            self._memberships.setdefault(channel, set()).add(group)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_channel_name(channel)
+        self.require_valid_group_name(group)
+        with self._lock:
+            self._discard(group, channel)
+
+    async def group_send(self, group, message):
+        """Queue a shallow copy of the message for every channel in the group."""
+        assert isinstance(message, dict), "Message is not a dict"
+        self.require_valid_group_name(group)
+        now = time.time()
+        with self._lock:
+            members = self._groups.get(group)
+            if not members:
+                return
+            joined_before = now - self.group_expiry
+            for channel, joined in list(members.items()):
+                if joined < joined_before:
+                    self._discard(group, channel)
+                    continue
+                self._put(channel, dict(message), now)
+
+    # Flush extension
+
+    async def flush(self):
+        with self._lock:
+            self._channels = {}
+            self._groups = {}
+            self._memberships = {}
+
+    async def close(self):
+        pass
+
+    # Internals (called with the lock held)
+
+    def _put(self, name: str, message: Dict[str, Any], now: float):
+        if now >= self._next_sweep:
+            self._sweep(now)
+        ch = self._channels.get(name)
+        if ch is None:
+            ch = self._channels[name] = _Channel(self.get_capacity(name))
+        else:
+            self._purge_expired(name, ch, now)
+        if len(ch.queue) >= ch.capacity and not self._merge(ch, message, now):
+            ch.queue.popleft()
+            self.dropped += 1
+        if len(ch.queue) < ch.capacity:
+            ch.queue.append((now + self.expiry, message))
+        self.sent += 1
+        self._wake(ch)
+
+    def _merge(self, ch: _Channel, message: Dict[str, Any], now: float) -> bool:
+        """Fold ``message`` into a queued one about the same entity; True if it was."""
+        if self.overflow != 'merge':
+            return False
+        key = merge_key(message)
+        if key is None:
+            return False
+        for entry in reversed(ch.queue):
+            if merge_key(entry[1]) == key:
+                ch.queue.remove(entry)
+                ch.queue.append((now + self.expiry, merge_messages(entry[1], message)))
+                self.merged += 1
+                return True
+        return False
+
+    def _purge_expired(self, name: str, ch: _Channel, now: float):
+        expired = False
+        while ch.queue and ch.queue[0][0] < now:
+            ch.queue.popleft()
+            self.expired += 1
+            expired = True
+        if expired:
+            # Nobody has read this channel for ``expiry`` seconds
+            for group in list(self._memberships.get(name, ())):
+                self._discard(group, name)
+
+    def _sweep(self, now: float):
+        """Expire messages on every channel and forget idle ones (once per ``expiry``)."""
+        self._next_sweep = now + self.expiry
+        for name, ch in list(self._channels.items()):
+            self._purge_expired(name, ch, now)
+            if not ch.queue and not ch.waiters:
+                del self._channels[name]
+
+    def _discard(self, group: str, channel: str):
+        members = self._groups.get(group)
+        if members is not None:
+            members.pop(channel, None)
+            if not members:
+                self._groups.pop(group, None)
+        groups = self._memberships.get(channel)
+        if groups is not None:
+            groups.discard(group)
+            if not groups:
+                self._memberships.pop(channel, None)
+
+    @staticmethod
+    def _wake(ch: _Channel):
+        """Wake one waiting receiver on its own event loop."""
+        while ch.waiters:
+            loop, future = ch.waiters.popleft()
+            if future.done() or loop.is_closed():
+                continue
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is loop:
+                future.set_result(None)
+            else:
+                loop.call_soon_threadsafe(_resolve, future)
+            return
+
+    # Metrics
+
+    def stats(self, top: int = 10) -> Dict[str, Any]:
+        """Counters and queue depths (the ``top`` deepest channels)."""
+        with self._lock:
+            depths = {name: len(ch.queue) for name, ch in self._channels.items() if ch.queue}
+            stats = {
+                'backend': 'local',
+                'overflow': self.overflow,
+                'capacity': self.capacity,
+                'channels': len(self._channels),
+                'groups': len(self._groups),
+                'queued': sum(depths.values()),
+                'max_depth': max(depths.values(), default=0),
+                'sent': self.sent,
+                'dropped': self.dropped,
+                'merged': self.merged,
+                'expired': self.expired,
+            }
+        stats['deepest'] = dict(sorted(depths.items(), key=lambda item: -item[1])[:top])
+        return stats
+
+
+def _resolve(future: 'asyncio.Future'):
+    if not future.done():
+        future.set_result(None)
+
+
+PRIMARY = 'primary'
+FALLBACK = 'fallback'
+
+
+def _connection_errors():
+    """Exceptions that mean the primary layer's server is unreachable."""
+    errors = (OSError, asyncio.TimeoutError)
+    try:
+        from redis import exceptions
+    except ImportError:
+        return errors
+    return errors + (exceptions.ConnectionError, exceptions.TimeoutError)
+
+
+class FailoverChannelLayer(BaseChannelLayer):
+    """
+    Uses the ``primary`` layer (Redis) while it is reachable and the
+    ``fallback`` layer (in-process) while it isn't.
+
+    Nothing connects when the layer is created: the layers are built on
+    first use, and a daemon thread then pings Redis every
+    ``check_interval`` seconds. A failed operation on the primary switches
+    to the fallback at once (and is retried there); the layer switches back
+    after ``recover_checks`` consecutive successful pings. On every switch,
+    group memberships made through this process are replayed onto the new
+    layer and blocked receivers move over, so consumers keep working;
+    dispatchers recover messages lost in the switch by resuming.
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, primary, fallback=None, check_interval=5, recover_checks=2, timeout=2, **kwargs):
+        super().__init__(**kwargs)
+        self.primary_config = primary
+        self.fallback_config = fallback or {'BACKEND': 'core.layers.LocalChannelLayer'}
+        self.check_interval = check_interval
+        self.recover_checks = recover_checks
+        self.timeout = timeout
+        self.mode = FALLBACK
+        self.healthy = False
+        self.failovers = 0
+        self.failbacks = 0
+        self.last_check: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._errors = _connection_errors()
+        self._lock = threading.Lock()
+        self._primary = None
+        self._fallback = None
+        self._started = False
+        self._checked = threading.Event()
+        self._stop = threading.Event()
+        self._successes = 0
+        self._generation = 0
+        self._synced: Dict[str, int] = {}
+        self._memberships: Dict[str, Set[str]] = {}
+        self._watchers: Set[tuple] = set()
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        await self._call('send', channel, message)
+
+    async def receive(self, channel):
+        """Receive from the active layer, moving to the other one if the layer switches meanwhile."""
+        loop = asyncio.get_running_loop()
+        while True:
+            layer = await self._layer()
+            if self._primary is None:
+                return await layer.receive(channel)
+            if layer is self._primary and hasattr(self._fallback, 'receive_nowait'):
+                # Left on the fallback when it switched back
+                message = self._fallback.receive_nowait(channel)
+                if message is not None:
+                    return message
+            watcher = (loop, loop.create_future())
+            with self._lock:
+                if layer is not self._active():
+                    continue
+                self._watchers.add(watcher)
+            task = loop.create_task(layer.receive(channel))
+            try:
+                await asyncio.wait((task, watcher[1]), return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                with self._lock:
+                    self._watchers.discard(watcher)
+                if not task.done():
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+            if task.cancelled():
+                continue
+            error = task.exception()
+            if error is None:
+                return task.result()
+            if layer is self._primary and isinstance(error, self._errors):
+                self._fail(error)
+                continue
+            raise error
+
+    async def new_channel(self, prefix="specific."):
+        # Names come from the primary so they stay valid on both layers
+        self._start()
+        return await (self._primary or self._fallback).new_channel(prefix)
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        with self._lock:
+            self._memberships.setdefault(group, set()).add(channel)
+        await self._call('group_add', group, channel)
+
+    async def group_discard(self, group, channel):
+        with self._lock:
+            channels = self._memberships.get(group)
+            if channels is not None:
+                channels.discard(channel)
+                if not channels:
+                    del self._memberships[group]
+        await self._call('group_discard', group, channel)
+
+    async def group_send(self, group, message):
+        await self._call('group_send', group, message)
+
+    # Flush extension
+
+    async def flush(self):
+        with self._lock:
+            self._memberships = {}
+        await self._call('flush')
+
+    async def close(self):
+        self._stop.set()
+        for layer in (self._primary, self._fallback):
+            close = getattr(layer, 'close', None) or getattr(layer, 'close_pools', None)
+            if close is not None:
+                await close()
+
+    # Metrics
+
+    def stats(self) -> Dict[str, Any]:
+        """Current mode, health-check state, and the fallback layer's counters."""
+        self._start()
+        with self._lock:
+            active = self._active()
+            stats = {
+                'backend': 'failover',
+                'mode': self.mode,
+                'active': type(active).__name__ if active is not None else None,
+                'primary_healthy': self.healthy,
+                'failovers': self.failovers,
+                'failbacks': self.failbacks,
+                'last_check': self.last_check,
+                'last_error': self.last_error,
+            }
+        if hasattr(self._fallback, 'stats'):
+            stats['fallback'] = self._fallback.stats()
+        return stats
+
+    # Internals
+
+    def _active(self):
+        return self._primary if self.mode == PRIMARY else self._fallback
+
+    def _start(self):
+        """Build the layers and start the health checks (once, on first use)."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            self._fallback = _make_layer(self.fallback_config)
+            try:
+                self._primary = _make_layer(self.primary_config)
+            except Exception as e:
+                # e.g. channels_redis isn't installed: stay on the fallback for good
+                logger.warning("Channel layer %s unavailable, using the fallback: %s",
+                             self.primary_config.get('BACKEND'), e)
+                self.last_error = str(e)
+                self._checked.set()
+                return
+        threading.Thread(target=self._run, name='channel-layer-health', daemon=True).start()
+
+    async def _layer(self):
+        """The active layer, with this process's group memberships replayed onto it."""
+        self._start()
+        if not self._checked.is_set():
+            await asyncio.get_running_loop().run_in_executor(None, self._checked.wait, self.timeout + 1)
+        while True:
+            with self._lock:
+                mode, generation = self.mode, self._generation
+                layer = self._active()
+                if self._synced.get(mode) == generation:
+                    return layer
+                self._synced[mode] = generation
+                memberships = [(g, c) for g, channels in self._memberships.items() for c in channels]
+            try:
+                for group, channel in memberships:
+                    await asyncio.wait_for(layer.group_add(group, channel), self.timeout)
+            except self._errors as e:
+                if layer is not self._primary:
+                    raise
+                self._fail(e)
+                continue
+            if self._generation == generation:
+                return layer
+
+    async def _call(self, method, *args):
+        layer = await self._layer()
+        if layer is self._primary:
+            try:
+                return await asyncio.wait_for(getattr(layer, method)(*args), self.timeout)
+            except self._errors as e:
+                self._fail(e)
+                layer = await self._layer()
+        return await getattr(layer, method)(*args)
+
+    def _fail(self, error):
+        with self._lock:
+            self.healthy = False
+            self._successes = 0
+            self.last_error = str(error) or type(error).__name__
+        self._switch(FALLBACK)
+
+    def _switch(self, mode):
+        with self._lock:
+            if self.mode == mode:
+                return
+            self.mode = mode
+            self._generation += 1
+            if mode == FALLBACK:
+                self.failovers += 1
+            elif self._checked.is_set():
+                self.failbacks += 1
+            watchers, self._watchers = self._watchers, set()
+        if mode == FALLBACK:
+            logger.warning("Channel layer: %s unreachable (%s), switched to the fallback layer",
+                           self.primary_config.get('BACKEND'), self.last_error)
+        else:
+            logger.info("Channel layer: using %s", self.primary_config.get('BACKEND'))
+        for loop, future in watchers:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(_resolve, future)
+
+    def _run(self):
+        """Health-check loop (daemon thread)."""
+        while True:
+            try:
+                self._probe()
+            except Exception as e:
+                with self._lock:
+                    self.healthy = False
+                    self._successes = 0
+                    self.last_error = str(e) or type(e).__name__
+                    self.last_check = time.time()
+                self._switch(FALLBACK)
+            else:
+                with self._lock:
+                    self.healthy = True
+                    self._successes += 1
+                    self.last_check = time.time()
+                    recovered = self._successes >= self.recover_checks or not self._checked.is_set()
+                if recovered:
+                    self._switch(PRIMARY)
+            self._checked.set()
+            if self._stop.wait(self.check_interval):
+                return
+
+    def _probe(self):
+        """Ping the primary layer's first Redis host; raises if it doesn't answer."""
+        import redis
+
+        hosts = (self.primary_config.get('CONFIG') or {}).get('hosts') or [('localhost', 6379)]
+        host = hosts[0]
+        options = {'socket_connect_timeout': self.timeout, 'socket_timeout': self.timeout}
+        if isinstance(host, str):
+            client = redis.Redis.from_url(host, **options)
+        elif isinstance(host, dict):
+            host = dict(host)
+            address = host.pop('address', None)
+            options.update(host)
+            client = redis.Redis.from_url(address, **options) if address else redis.Redis(**options)
+        else:
+            client = redis.Redis(host=host[0], port=host[1], **options)
+        try:
+            client.ping()
+        finally:
+            client.close()
+
+
+def _make_layer(config):
+    return import_string(config['BACKEND'])(**config.get('CONFIG', {}))
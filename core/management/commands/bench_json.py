@@ -0,0 +1,86 @@
+import io
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from core import jsoncodec
+from core.parsers import FastJSONParser
+from core.renderers import FastJSONRenderer
+
+
+def _best_of(func, repeat):
+    """Fastest of ``repeat`` runs, in milliseconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+class Command(BaseCommand):
+    help = 'Compare the stock DRF/stdlib JSON codec with core.jsoncodec on payloads built from the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per measurement (best is reported)')
+
+    def payloads(self):
+        from dispatch.models import Ambulance, Hospital
+        from dispatch.serializers import AmbulanceSerializer, HospitalSerializer
+        from emergencies.models import EmergencyCall
+        from emergencies.serializers import EmergencyCallSerializer
+
+        emergencies = EmergencyCallSerializer(
+            EmergencyCall.objects.filter(
+                status__in=['RECEIVED', 'DISPATCHED', 'EN_ROUTE', 'ON_SCENE', 'TRANSPORTING']
+            ).order_by('-received_at'),
+            many=True
+        ).data
+        fleet = AmbulanceSerializer(Ambulance.objects.all(), many=True).data
+        hospitals = HospitalSerializer(Hospital.objects.all(), many=True).data
+        event = {
+            'type': 'emergency_update',
+            'event': 'STATUS_UPDATE',
+            'data': emergencies[0] if emergencies else {},
+            'delta': False,
+            'seq': 1
+        }
+        return [
+            ('active emergencies', emergencies),
+            ('ambulance fleet', fleet),
+            ('hospitals', hospitals),
+            ('dispatcher board', {'emergencies': emergencies, 'ambulances': fleet, 'hospitals': hospitals}),
+            ('single event', event),
+        ]
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        backend = 'orjson' if jsoncodec.orjson is not None else 'stdlib (orjson not installed)'
+        self.stdout.write(f'Fast codec backend: {backend}')
+        self.stdout.write(
+            f"{'payload':<20}{'items':>7}{'KiB':>9}"
+            f"{'render ms':>11}{'fast ms':>9}{'x':>6}"
+            f"{'parse ms':>10}{'fast ms':>9}{'x':>6}"
+        )
+
+        stock_renderer, fast_renderer = JSONRenderer(), FastJSONRenderer()
+        stock_parser, fast_parser = JSONParser(), FastJSONParser()
+        for name, payload in self.payloads():
+            body = stock_renderer.render(payload)
+            fast_body = fast_renderer.render(payload)
+            if json.loads(body) != json.loads(fast_body):
+                self.stdout.write(self.style.WARNING(f'{name}: fast output differs from JSONRenderer'))
+
+            render = _best_of(lambda: stock_renderer.render(payload), repeat)
+            fast_render = _best_of(lambda: fast_renderer.render(payload), repeat)
+            parse = _best_of(lambda: stock_parser.parse(io.BytesIO(body)), repeat)
+            fast_parse = _best_of(lambda: fast_parser.parse(io.BytesIO(body)), repeat)
+            items = len(payload) if isinstance(payload, list) else 1
+            self.stdout.write(
+                f'{name:<20}{items:>7}{len(body) / 1024:>9.1f}'
+                f'{render:>11.3f}{fast_render:>9.3f}{render / fast_render:>6.1f}'
+                f'{parse:>10.3f}{fast_parse:>9.3f}{parse / fast_parse:>6.1f}'
+            )
@@ -0,0 +1,150 @@
+"""
+Non-blocking outbox for channel-layer notifications.
+
+Sync views used to call ``async_to_sync(channel_layer.group_send)`` inline,
+paying the channel-layer round trip (and, on Redis, message serialization)
+inside the request. Instead, events are appended to an in-process queue and
+the view returns; a task on the ASGI server's event loop drains the queue,
+sending to different groups concurrently while keeping each group's events
+in order.
+
+``core.utils.send_channel_notification`` only enqueues once the surrounding
+database transaction commits, so clients never see events for rolled-back
+writes. Messages for streamed groups get their sequence number here (see
+``core.streams``). Without a running server loop (management commands, the shell)
+events are sent synchronously as before.
+"""
+import asyncio
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Dict, Optional, Tuple
+
+from .streams import get_stream
+
+logger = logging.getLogger(__name__)
+
+MAX_PENDING = 10000
+
+
+class NotificationOutbox:
+    """Bounded FIFO of (group, message) drained by a task on the server loop."""
+
+    def __init__(self, max_pending: int = MAX_PENDING):
+        self._lock = threading.Lock()
+        self._queue: 'deque[Tuple[str, Dict[str, Any]]]' = deque()
+        self._max_pending = max_pending
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self.sent = 0
+        self.dropped = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._queue)
+
+    def enqueue(self, group: str, message: Dict[str, Any], encode: bool = False):
+        """
+        Queue a message for ``group``; returns without waiting for delivery.
+
+        With ``encode``, the consumer frames are encoded once here (after the
+        sequence number is stamped) and sent along in ``message['frames']``,
+        so consumers forward them instead of each encoding the event.
+        """
+        from .utils import get_main_event_loop
+
+        stream = get_stream(group)
+        loop = get_main_event_loop()
+        if loop is None:
+            with self._lock:
+                self._prepare(stream, message, encode)
+            self._send_now(group, message)
+            return
+
+        with self._lock:
+            # Stamped under the lock so sequence order matches queue order
+            self._prepare(stream, message, encode)
+            if len(self._queue) >= self._max_pending:
+                self._queue.popleft()
+                self.dropped += 1
+                logger.warning("Notification outbox full; dropped the oldest event")
+            self._queue.append((group, message))
+            self._loop = loop
+
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._kick()
+        else:
+            loop.call_soon_threadsafe(self._kick)
+
+    @staticmethod
+    def _prepare(stream, message: Dict[str, Any], encode: bool):
+        if stream is not None:
+            stream.append(message)
+        if encode and 'frames' not in message:
+            from .protocol import encode_frames
+            message['frames'] = encode_frames(message)
+
+    def _send_now(self, group: str, message: Dict[str, Any]):
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+
+        channel_layer = get_channel_layer()
+        if not channel_layer:
+            logger.warning("Channel layer not configured. Notification not sent.")
+            return
+        async_to_sync(channel_layer.group_send)(group, message)
+        self.sent += 1
+
+    def _kick(self):
+        """Wake the drain task, starting it on first use (runs on the loop)."""
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                await self.drain()
+            except Exception as e:
+                logger.warning(f"Failed to drain notification outbox: {e}", exc_info=True)
+
+    async def drain(self):
+        """Send everything queued so far: groups in parallel, each group in order."""
+        from channels.layers import get_channel_layer
+
+        with self._lock:
+            batch, self._queue = self._queue, deque()
+        if not batch:
+            return
+
+        channel_layer = get_channel_layer()
+        if not channel_layer:
+            logger.warning("Channel layer not configured. Notifications not sent.")
+            return
+
+        by_group: 'OrderedDict[str, list]' = OrderedDict()
+        for group, message in batch:
+            by_group.setdefault(group, []).append(message)
+        await asyncio.gather(*(
+            self._send_group(channel_layer, group, messages) for group, messages in by_group.items()
+        ))
+
+    async def _send_group(self, channel_layer, group: str, messages):
+        for message in messages:
+            try:
+                await channel_layer.group_send(group, message)
+                self.sent += 1
+            except Exception as e:
+                logger.warning(f"Failed to send channel notification to {group}: {e}", exc_info=True)
+
+
+outbox = NotificationOutbox()
@@ -0,0 +1,218 @@
+"""
+Who is connected: a presence registry for dispatcher and paramedic sockets.
+
+Consumers report connect, disconnect and heartbeats (any frame from the
+client). Each process keeps its own connections in memory and mirrors them
+into the Django cache named by ``PRESENCE_CACHE`` under per-node keys that
+expire ``PRESENCE_TTL`` seconds after the last heartbeat:
+
+* ``presence:<role>:<user id>:<node>`` while the user has a connection on
+  that node;
+* ``presence:<role>:count:<node>``: how many users of the role the node has;
+* ``presence:nodes``: the ids of the nodes that wrote keys.
+
+Only the node owning a key writes it, so nodes never overwrite each other's
+state and a crashed node's entries simply expire. Answering "is paramedic X
+online" or "how many dispatchers are live" is one ``get_many`` however many
+users are connected. The default cache is per process; a multi-node
+deployment needs a shared backend (Redis, Memcached) for ``PRESENCE_CACHE``.
+
+Messages for users who are offline can be held (``hold``) and handed to
+their next connection (``take_held``). Each held message has its own key,
+numbered by an atomic ``incr``, so concurrent holds never overwrite each
+other.
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Dict, List
+
+from django.conf import settings
+from django.core.cache import caches
+
+DISPATCHER = 'dispatcher'
+PARAMEDIC = 'paramedic'
+
+DEFAULT_TTL = 60
+# Held messages per user, and how long they are kept
+MAX_HELD = 20
+HELD_TTL = 3600
+
+NODES_KEY = 'presence:nodes'
+
+
+class PresenceRegistry:
+    """Live connections per (role, user), mirrored into a shared cache."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # role -> user id -> channel name -> last heartbeat
+        self._local: Dict[str, Dict[Any, Dict[str, float]]] = {}
+        # cache key -> when it was last written
+        self._written: Dict[str, float] = {}
+        self._node = None
+        self._pid = None
+        self._swept = 0.0
+
+    @property
+    def ttl(self) -> int:
+        return int(getattr(settings, 'PRESENCE_TTL', DEFAULT_TTL))
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'PRESENCE_CACHE', 'default')]
+
+    @property
+    def node(self) -> str:
+        # A new id after a fork, so worker processes don't share keys
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._node = f'{socket.gethostname()}:{self._pid}:{uuid.uuid4().hex[:6]}'
+            self._written = {}
+        return self._node
+
+    def _user_key(self, role: str, user_id, node: str) -> str:
+        return f'presence:{role}:{user_id}:{node}'
+
+    def _count_key(self, role: str, node: str) -> str:
+        return f'presence:{role}:count:{node}'
+
+    # Updates from consumers (sync: run off the event loop)
+
+    def connect(self, role: str, user_id, channel: str):
+        with self._lock:
+            self._local.setdefault(role, {}).setdefault(user_id, {})[channel] = time.time()
+        self.refresh(role, user_id, force=True)
+
+    def disconnect(self, role: str, user_id, channel: str):
+        with self._lock:
+            users = self._local.get(role, {})
+            channels = users.get(user_id)
+            if channels is not None:
+                channels.pop(channel, None)
+            gone = not channels
+            if gone:
+                users.pop(user_id, None)
+        if gone:
+            key = self._user_key(role, user_id, self.node)
+            self.cache.delete(key)
+            self._written.pop(key, None)
+            self._write_count(role)
+
+    def heartbeat(self, role: str, user_id, channel: str) -> bool:
+        """
+        Record a heartbeat; returns True when the cache entries are due for
+        a refresh (then call ``refresh``). Cheap enough to call on every frame.
+        """
+        now = time.time()
+        with self._lock:
+            # Re-added if it was swept after going quiet for a while
+            channels = self._local.setdefault(role, {}).setdefault(user_id, {})
+            channels[channel] = now
+        written = self._written.get(self._user_key(role, user_id, self.node), 0)
+        return now - written > self.ttl / 3
+
+    def refresh(self, role: str, user_id, force: bool = False):
+        """Write the user's key (and the node's count) unless written recently."""
+        now = time.time()
+        key = self._user_key(role, user_id, self.node)
+        if force or now - self._written.get(key, 0) > self.ttl / 3:
+            self.cache.set(key, 1, self.ttl)
+            self._written[key] = now
+        if force or now - self._written.get(self._count_key(role, self.node), 0) > self.ttl / 3:
+            self._write_count(role)
+
+    def _write_count(self, role: str):
+        now = time.time()
+        ttl = self.ttl
+        with self._lock:
+            if now - self._swept > ttl / 3:
+                self._sweep(now - ttl)
+                self._swept = now
+            count = len(self._local.get(role, {}))
+        node = self.node
+        key = self._count_key(role, node)
+        self.cache.set(key, count, ttl)
+        self._written[key] = now
+        nodes = self.cache.get(NODES_KEY) or []
+        if node not in nodes:
+            self._update_nodes(nodes + [node])
+
+    def _sweep(self, cutoff: float):
+        """Forget connections without a heartbeat since ``cutoff`` (lock held)."""
+        for users in self._local.values():
+            for user_id, channels in list(users.items()):
+                for channel, seen in list(channels.items()):
+                    if seen < cutoff:
+                        del channels[channel]
+                if not channels:
+                    del users[user_id]
+
+    def _update_nodes(self, nodes: List[str]):
+        """Store the node list, dropping nodes whose keys have all expired."""
+        counts = self.cache.get_many(
+            [self._count_key(role, n) for n in nodes for role in (DISPATCHER, PARAMEDIC)]
+        )
+        live = [n for n in nodes if n == self.node or any(
+            self._count_key(role, n) in counts for role in (DISPATCHER, PARAMEDIC)
+        )]
+        self.cache.set(NODES_KEY, live, None)
+
+    # Queries
+
+    def _nodes(self) -> List[str]:
+        nodes = self.cache.get(NODES_KEY) or []
+        return nodes if self.node in nodes else nodes + [self.node]
+
+    def is_online(self, role: str, user_id) -> bool:
+        """Whether the user has a live connection on any node."""
+        keys = [self._user_key(role, user_id, node) for node in self._nodes()]
+        return bool(self.cache.get_many(keys))
+
+    def count(self, role: str) -> int:
+        """Users of ``role`` with a live connection, summed over nodes."""
+        keys = [self._count_key(role, node) for node in self._nodes()]
+        return sum(self.cache.get_many(keys).values())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            local = {role: len(users) for role, users in self._local.items()}
+        return {
+            'node': self.node,
+            'nodes': len(self._nodes()),
+            'local': local,
+            'live': {role: self.count(role) for role in (DISPATCHER, PARAMEDIC)},
+        }
+
+    # Held messages
+
+    def _held_seq(self, role: str, user_id) -> str:
+        return f'presence:held:{role}:{user_id}:seq'
+
+    def hold(self, role: str, user_id, message: Dict[str, Any]):
+        """Keep a message for the user's next connection (the latest ``MAX_HELD``)."""
+        seq_key = self._held_seq(role, user_id)
+        self.cache.add(seq_key, 0, None)
+        try:
+            n = self.cache.incr(seq_key)
+        except ValueError:
+            # Evicted between add and incr
+            self.cache.add(seq_key, 0, None)
+            n = self.cache.incr(seq_key)
+        self.cache.set(f'presence:held:{role}:{user_id}:{n}', message, HELD_TTL)
+
+    def take_held(self, role: str, user_id) -> List[Dict[str, Any]]:
+        """Messages held for the user, oldest first; they are removed."""
+        n = self.cache.get(self._held_seq(role, user_id))
+        if not n:
+            return []
+        keys = [f'presence:held:{role}:{user_id}:{i}' for i in range(max(1, n - MAX_HELD + 1), n + 1)]
+        found = self.cache.get_many(keys)
+        if found:
+            self.cache.delete_many(list(found))
+        return [found[key] for key in keys if key in found]
+
+
+presence = PresenceRegistry()
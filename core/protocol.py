@@ -0,0 +1,213 @@
+"""
+WebSocket wire formats.
+
+JSON text frames are the default (``ems.v1.json`` when a client offers
+subprotocols). A client can instead offer one of the MessagePack
+``SUBPROTOCOLS`` in the WebSocket handshake (``Sec-WebSocket-Protocol``)
+to receive compact binary frames:
+
+* the payload is MessagePack, and dict keys that appear in the schema's
+  ``FIELDS`` table are replaced by their index in it (a one-byte integer
+  instead of a repeated field name; other keys stay strings);
+* each frame starts with two header bytes: the schema version and a flags
+  byte (``FLAG_DEFLATE``: the rest is raw-deflate compressed,
+  ``FLAG_PLAIN_KEYS``: keys are not coded);
+* with the ``.deflate`` variant, frames larger than ``COMPRESS_MIN_BYTES``
+  are compressed.
+
+The first binary frame of a connection is ``{"type": "protocol", ...}``
+with plain keys, carrying the schema version and the ``FIELDS`` table so
+clients never have to hard-code it. Clients send frames in the same format
+(keys may be coded or plain). ``FIELDS`` is append-only within a schema
+version.
+"""
+import zlib
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from django.conf import settings
+
+from . import jsoncodec
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+SCHEMA_VERSION = 1
+
+FLAG_DEFLATE = 0x01
+FLAG_PLAIN_KEYS = 0x02
+
+COMPRESS_MIN_BYTES = 512
+# Wire formats group events are encoded in once at publish time
+DEFAULT_PREENCODED_FORMATS = ('json',)
+
+# Largest client frame accepted after decompression
+MAX_DECODED_BYTES = 1024 * 1024
+
+FIELDS = (
+    # Envelope
+    'type', 'event', 'data', 'delta', 'seq', 'stream', 'version', 'epoch', 'base_version',
+    'message', 'units', 'emergencies', 'ambulances', 'hospitals', 'replayed', 'kind',
+    'last_seq', 'bbox', 'priorities', 'schema', 'fields', 'timestamp',
+    # Emergency calls
+    'id', 'call_id', 'caller_name', 'caller_phone', 'emergency_type', 'emergency_type_display',
+    'description', 'location_address', 'latitude', 'longitude', 'status', 'status_display',
+    'priority', 'priority_display', 'assigned_ambulance', 'assigned_ambulance_unit',
+    'assigned_paramedic', 'assigned_paramedic_name', 'dispatcher', 'dispatcher_name',
+    'patient_name', 'patient_age', 'patient_condition', 'hospital_destination',
+    'received_at', 'dispatched_at', 'en_route_at', 'on_scene_at', 'transporting_at',
+    'at_hospital_at', 'closed_at', 'created_at', 'updated_at',
+    # Ambulances
+    'unit_number', 'unit_type', 'unit_type_display', 'current_latitude', 'current_longitude',
+    'last_location_update', 'current_emergency', 'current_emergency_id', 'equipment_list',
+    'max_patients', 'ambulance_id',
+    # Hospitals
+    'name', 'address', 'phone_number', 'total_beds', 'available_beds', 'emergency_capacity',
+    'emergency_capacity_display', 'specialties',
+)
+
+_CODES = {name: code for code, name in enumerate(FIELDS)}
+
+
+def _code_keys(value):
+    """Replace known dict keys with their field codes (other keys become strings, as in JSON)."""
+    if isinstance(value, dict):
+        return {
+            _CODES.get(k, k) if isinstance(k, str) else str(k): _code_keys(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [_code_keys(v) for v in value]
+    return value
+
+
+def _name_keys(value):
+    """Inverse of ``_code_keys``."""
+    if isinstance(value, dict):
+        return {
+            (FIELDS[k] if 0 <= k < len(FIELDS) else k) if isinstance(k, int) else k: _name_keys(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, list):
+        return [_name_keys(v) for v in value]
+    return value
+
+
+class JsonCodec:
+    """The default: JSON text frames."""
+    name = 'json'
+    binary = False
+
+    def encode(self, message: Dict[str, Any]) -> str:
+        return jsoncodec.dumps(message)
+
+    def decode(self, frame) -> Dict[str, Any]:
+        return jsoncodec.loads(frame)
+
+
+class MsgpackCodec:
+    """MessagePack frames with coded keys, optionally deflated."""
+    binary = True
+
+    def __init__(self, compress: bool = False):
+        self.compress = compress
+        self.name = 'msgpack+deflate' if compress else 'msgpack'
+
+    def encode(self, message: Dict[str, Any], plain_keys: bool = False) -> bytes:
+        flags = FLAG_PLAIN_KEYS if plain_keys else 0
+        return self.frame(msgpack.packb(message if plain_keys else _code_keys(message)), flags)
+
+    def frame(self, body: bytes, flags: int = 0) -> bytes:
+        """Add the header to a packed body, compressing it if this variant does."""
+        if self.compress and len(body) > COMPRESS_MIN_BYTES:
+            compressor = zlib.compressobj(wbits=-15)
+            body = compressor.compress(body) + compressor.flush()
+            flags |= FLAG_DEFLATE
+        return bytes((SCHEMA_VERSION, flags)) + body
+
+    def decode(self, frame: bytes) -> Dict[str, Any]:
+        if len(frame) < 2 or frame[0] != SCHEMA_VERSION:
+            raise ValueError("Unsupported frame schema")
+        flags, body = frame[1], frame[2:]
+        if flags & FLAG_DEFLATE:
+            decompressor = zlib.decompressobj(wbits=-15)
+            try:
+                body = decompressor.decompress(body, MAX_DECODED_BYTES)
+            except zlib.error as e:
+                raise ValueError(f"Invalid compressed frame: {e}")
+            if decompressor.unconsumed_tail:
+                raise ValueError("Frame too large")
+        try:
+            message = msgpack.unpackb(body, strict_map_key=False)
+        except Exception as e:
+            raise ValueError(f"Invalid MessagePack frame: {e}")
+        if not isinstance(message, dict):
+            raise ValueError("Frame must be a map")
+        return message if flags & FLAG_PLAIN_KEYS else _name_keys(message)
+
+    def hello(self) -> bytes:
+        """The first frame of a connection: schema version and field table."""
+        return self.encode({
+            'type': 'protocol',
+            'schema': SCHEMA_VERSION,
+            'format': self.name,
+            'fields': list(FIELDS),
+        }, plain_keys=True)
+
+
+json_codec = JsonCodec()
+
+SUBPROTOCOLS = {
+    f'ems.v{SCHEMA_VERSION}.json': json_codec,
+    f'ems.v{SCHEMA_VERSION}.msgpack': MsgpackCodec(compress=False),
+    f'ems.v{SCHEMA_VERSION}.msgpack.deflate': MsgpackCodec(compress=True),
+}
+
+
+def negotiate(offered: List[str]) -> Tuple[Optional[str], Any]:
+    """
+    Pick the wire format from the subprotocols offered by the client, in
+    the client's order of preference.
+
+    Returns ``(subprotocol, codec)``. Without a supported offer (or when
+    MessagePack isn't installed) the connection uses JSON; the subprotocol
+    is then None, which is what a client that offered nothing expects.
+    """
+    for subprotocol in offered or ():
+        codec = SUBPROTOCOLS.get(subprotocol)
+        if codec is not None and (not codec.binary or msgpack is not None):
+            return subprotocol, codec
+    return None, json_codec
+
+
+def wire_message(message: Dict[str, Any], data=None) -> Dict[str, Any]:
+    """The frame a consumer sends for a channel-layer event (``data`` overrides its data)."""
+    wire = {
+        'type': message['type'],
+        'event': message.get('event'),
+        'data': message['data'] if data is None else data,
+    }
+    if 'delta' in message:
+        wire['delta'] = message['delta']
+    wire['seq'] = message.get('seq')
+    return wire
+
+
+def encode_frames(message: Dict[str, Any]) -> Dict[str, Union[str, bytes]]:
+    """
+    A channel-layer event's frame in each format of ``WS_PREENCODED_FORMATS``,
+    keyed by codec name, so consumers can forward it without encoding it
+    again. Consumers using another format encode the event themselves.
+    """
+    formats = getattr(settings, 'WS_PREENCODED_FORMATS', DEFAULT_PREENCODED_FORMATS)
+    wire = wire_message(message)
+    frames = {}
+    if json_codec.name in formats:
+        frames[json_codec.name] = json_codec.encode(wire)
+    binary = [c for c in SUBPROTOCOLS.values() if c.binary and c.name in formats]
+    if binary and msgpack is not None:
+        body = msgpack.packb(_code_keys(wire))
+        for codec in binary:
+            frames[codec.name] = codec.frame(body)
+    return frames
@@ -0,0 +1,191 @@
+"""
+Region-scoped routing of dispatcher events.
+
+The service area is divided into square tiles of ``DISPATCH_REGION_TILE_DEGREES``
+and every call/unit event is sent, besides the area-wide ``dispatchers``
+group, to the group of the tile the entity is in. A dispatcher who subscribes
+to a bounding box joins only the groups of the tiles it overlaps, so an event
+is delivered to the dispatchers watching that part of the map rather than to
+everyone. When an entity moves to another tile the event goes to both tiles,
+so the old region sees it leave.
+
+Each routed message carries ``route`` (its tiles, and the priority of a
+call) so consumers can apply priority filters and filter events replayed
+from the ``dispatchers`` stream, whose ``seq`` the tile copies share.
+Events that aren't about a located call or unit (hospitals, coverage) go to
+``AREA_GROUP`` as well, which every region subscriber also joins.
+"""
+import math
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from django.conf import settings
+
+from .geo import coerce_point
+
+Tile = Tuple[int, int]
+
+DISPATCH_GROUP = 'dispatchers'
+AREA_GROUP = 'dispatchers.area'
+TILE_GROUP_PREFIX = 'dispatchers.tile'
+
+DEFAULT_TILE_DEGREES = 0.1
+MAX_SUBSCRIPTION_TILES = 400
+MAX_TRACKED_ENTITIES = 50000
+
+# Where each kind of entity keeps its position
+LOCATION_FIELDS = {
+    'emergency': ('latitude', 'longitude'),
+    'ambulance': ('current_latitude', 'current_longitude'),
+}
+
+
+def tile_degrees() -> float:
+    """Tile size in degrees; 0 disables region routing."""
+    return float(getattr(settings, 'DISPATCH_REGION_TILE_DEGREES', DEFAULT_TILE_DEGREES) or 0)
+
+
+def tile_for(latitude: float, longitude: float) -> Tile:
+    size = tile_degrees()
+    return (math.floor(latitude / size), math.floor(longitude / size))
+
+
+def tile_group(tile) -> str:
+    return f"{TILE_GROUP_PREFIX}.{tile[0]}.{tile[1]}"
+
+
+def entity_tile(kind: str, data: Dict[str, Any]) -> Optional[Tile]:
+    """Tile of a serialized call or unit, or None if it has no position."""
+    fields = LOCATION_FIELDS.get(kind)
+    if fields is None or tile_degrees() <= 0:
+        return None
+    point = coerce_point(data.get(fields[0]), data.get(fields[1]))
+    if point is None:
+        return None
+    return tile_for(*point)
+
+
+def tiles_in_bbox(south: float, west: float, north: float, east: float) -> List[Tile]:
+    """
+    Tiles overlapping a bounding box.
+
+    Raises ValueError for an invalid box or one spanning more than
+    ``MAX_SUBSCRIPTION_TILES`` tiles (subscribe to the whole area instead).
+    """
+    if tile_degrees() <= 0:
+        raise ValueError("Region subscriptions are disabled")
+    if coerce_point(south, west) is None or coerce_point(north, east) is None:
+        raise ValueError("Bounding box coordinates are out of range")
+    if south > north or west > east:
+        raise ValueError("Bounding box must be [south, west, north, east]")
+    (i0, j0), (i1, j1) = tile_for(south, west), tile_for(north, east)
+    if (i1 - i0 + 1) * (j1 - j0 + 1) > MAX_SUBSCRIPTION_TILES:
+        raise ValueError("Bounding box is too large; subscribe to the whole area instead")
+    return [(i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)]
+
+
+class RegionRouter:
+    """Last known tile per entity, so events follow calls and units across tiles."""
+
+    def __init__(self, max_entities: int = MAX_TRACKED_ENTITIES):
+        self._lock = threading.Lock()
+        self._tiles: 'OrderedDict[Tuple[str, Any], Tile]' = OrderedDict()
+        self._max_entities = max_entities
+
+    def route(self, kind: str, data: Dict[str, Any]) -> List[Tile]:
+        """Tiles an event about this (full) payload should be sent to."""
+        key = (kind, data.get('id'))
+        tile = entity_tile(kind, data)
+        with self._lock:
+            previous = self._tiles.get(key)
+            if tile is not None:
+                self._tiles[key] = tile
+                self._tiles.move_to_end(key)
+                if len(self._tiles) > self._max_entities:
+                    self._tiles.popitem(last=False)
+        tiles = [tile] if tile is not None else []
+        if previous is not None and previous != tile:
+            tiles.append(previous)
+        return tiles
+
+
+region_router = RegionRouter()
+
+
+def route_for(kind: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """``route`` metadata for an event about a call or unit."""
+    route = {'tiles': [list(t) for t in region_router.route(kind, data)]}
+    if kind == 'emergency':
+        route['priority'] = data.get('priority')
+    return route
+
+
+def publish(outbox, message: Dict[str, Any]):
+    """
+    Queue a dispatcher message for the area-wide group and its region groups.
+
+    The area-wide copy is queued first so the tile copies carry its ``seq``.
+    A ``LOCATIONS_TICK`` is split so each tile gets only its own units.
+    """
+    outbox.enqueue(DISPATCH_GROUP, message, encode=True)
+    if tile_degrees() <= 0:
+        return
+    route = message.get('route')
+    if route is None:
+        outbox.enqueue(AREA_GROUP, message, encode=True)
+        return
+
+    if 'units' not in route:
+        for tile in route['tiles']:
+            outbox.enqueue(tile_group(tile), message, encode=True)
+        return
+
+    by_tile: Dict[Tile, Tuple[list, list]] = {}
+    for unit, tiles in zip(message['data']['units'], route['units']):
+        for tile in tiles:
+            units, routes = by_tile.setdefault(tuple(tile), ([], []))
+            units.append(unit)
+            routes.append(tiles)
+    envelope = {k: v for k, v in message.items() if k not in ('data', 'route', 'frames')}
+    for tile, (units, routes) in by_tile.items():
+        outbox.enqueue(tile_group(tile), {
+            **envelope,
+            'data': {'units': units},
+            'route': {'tiles': [list(tile)], 'units': routes},
+        }, encode=True)
+
+
+@dataclass(frozen=True)
+class Subscription:
+    """What a region-scoped dispatcher wants: tiles (None = all) and call priorities."""
+    tiles: Optional[FrozenSet[Tile]] = None
+    priorities: Optional[FrozenSet[str]] = None
+
+    @property
+    def groups(self) -> List[str]:
+        if self.tiles is None:
+            return [DISPATCH_GROUP]
+        return [AREA_GROUP] + [tile_group(t) for t in sorted(self.tiles)]
+
+    def in_tiles(self, tiles) -> bool:
+        return self.tiles is None or any(tuple(t) in self.tiles for t in tiles)
+
+    def matches(self, message: Dict[str, Any]) -> bool:
+        """Whether a routed message (not a tick) is in scope."""
+        route = message.get('route')
+        if route is None:
+            return True
+        if self.priorities is not None and 'priority' in route and route['priority'] not in self.priorities:
+            return False
+        return self.in_tiles(route['tiles'])
+
+    def covers(self, kind: str, data: Dict[str, Any]) -> bool:
+        """Whether a serialized call or unit is in scope (for snapshots)."""
+        if kind == 'emergency' and self.priorities is not None and data.get('priority') not in self.priorities:
+            return False
+        if self.tiles is None:
+            return True
+        tile = entity_tile(kind, data)
+        return tile is not None and tile in self.tiles
@@ -0,0 +1,27 @@
+"""
+DRF renderers.
+"""
+from rest_framework.renderers import JSONRenderer
+
+from .jsoncodec import dumps_bytes
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    ``JSONRenderer`` backed by ``core.jsoncodec`` (orjson when installed).
+
+    Indented output (``Accept: application/json; indent=4``) is left to the
+    stock renderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = dumps_bytes(data)
+        # Escaped like JSONRenderer so the output is safe inside <script>
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
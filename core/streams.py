@@ -0,0 +1,100 @@
+"""
+Sequenced, replayable event streams for channel groups.
+
+Every message queued for a streamed group (``STREAM_GROUPS``) is stamped with
+a monotonically increasing ``seq`` and kept in a bounded replay buffer. A
+dispatcher that reconnects sends the stream ``epoch`` and the last ``seq`` it
+saw and receives only the events it missed; only when those have already
+fallen out of the buffer (or the stream is not the one it was following,
+e.g. after a restart) does it need a full snapshot.
+
+Streams are per process, like the outbox that stamps them.
+"""
+import logging
+import threading
+import uuid
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+STREAM_GROUPS = {'dispatchers'}
+
+DEFAULT_BUFFER_SIZE = 1000
+
+
+class EventStream:
+    """Sequence counter plus a ring buffer of the most recent messages."""
+
+    def __init__(self, name: str, size: int = DEFAULT_BUFFER_SIZE):
+        self.name = name
+        self.epoch = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._buffer: 'deque[Dict[str, Any]]' = deque(maxlen=size)
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+    @property
+    def last_seq(self) -> int:
+        with self._lock:
+            return self._seq
+
+    def add_listener(self, callback: Callable[[Dict[str, Any]], None]):
+        """Call ``callback(message)`` for every message appended, in order."""
+        self._listeners.append(callback)
+
+    def append(self, message: Dict[str, Any]) -> int:
+        """Stamp ``message`` with the next sequence number and buffer it."""
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            message['seq'] = seq
+            message['stream'] = self.epoch
+            # A copy, so what the sender attaches afterwards (encoded frames)
+            # isn't kept alive by the buffer
+            self._buffer.append(dict(message))
+        # Outside the lock: listeners may read ``last_seq``. Callers that need
+        # listeners to see messages in sequence order serialize appends.
+        for callback in self._listeners:
+            try:
+                callback(message)
+            except Exception as e:
+                logger.warning(f"Event stream listener failed: {e}", exc_info=True)
+        return seq
+
+    def since(self, epoch: str, last_seq: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        Messages after ``last_seq``, oldest first.
+
+        Returns None when they can't all be replayed: a different (or
+        restarted) stream, or a gap larger than the buffer.
+        """
+        with self._lock:
+            if epoch != self.epoch or last_seq > self._seq or last_seq < 0:
+                return None
+            if last_seq == self._seq:
+                return []
+            oldest = self._buffer[0]['seq'] if self._buffer else self._seq + 1
+            if last_seq + 1 < oldest:
+                return None
+            return [m for m in self._buffer if m['seq'] > last_seq]
+
+
+_streams: Dict[str, EventStream] = {}
+_streams_lock = threading.Lock()
+
+
+def get_stream(group: str) -> Optional[EventStream]:
+    """The stream for ``group``, or None if the group is not streamed."""
+    if group not in STREAM_GROUPS:
+        return None
+    stream = _streams.get(group)
+    if stream is None:
+        with _streams_lock:
+            stream = _streams.get(group)
+            if stream is None:
+                size = int(getattr(settings, 'EVENT_REPLAY_BUFFER', DEFAULT_BUFFER_SIZE))
+                stream = _streams[group] = EventStream(group, size)
+    return stream
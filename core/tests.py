@@ -1,3 +1,46 @@
-from django.test import TestCase
+from django.test import SimpleTestCase
 
-# Create your tests here.
+from .deltas import EntityVersionStore
+from .streams import EventStream
+
+
+class EntityVersionStoreTests(SimpleTestCase):
+    def test_first_payload_is_full_then_deltas(self):
+        store = EntityVersionStore()
+        full, delta = store.stamp('ambulance', 1, {'id': 1, 'status': 'AVAILABLE', 'unit_number': 'A1'})
+        self.assertIsNone(delta)
+        self.assertEqual(full['version'], 1)
+        self.assertEqual(full['epoch'], store.epoch)
+
+        full, delta = store.stamp('ambulance', 1, {'id': 1, 'status': 'EN_ROUTE', 'unit_number': 'A1'})
+        self.assertEqual(full['version'], 2)
+        self.assertEqual(delta, {
+            'id': 1, 'status': 'EN_ROUTE', 'version': 2, 'base_version': 1, 'epoch': store.epoch,
+        })
+        self.assertEqual(store.version('ambulance', 1), 2)
+        self.assertEqual(store.version('emergency', 1), 0)
+
+    def test_entities_are_evicted_lru(self):
+        store = EntityVersionStore(max_entities=2)
+        for pk in (1, 2, 3):
+            store.stamp('ambulance', pk, {'id': pk})
+        _, delta = store.stamp('ambulance', 1, {'id': 1})
+        self.assertIsNone(delta)
+
+
+class EventStreamTests(SimpleTestCase):
+    def test_replays_missed_messages(self):
+        stream = EventStream('dispatchers', size=5)
+        for n in range(3):
+            stream.append({'n': n})
+        self.assertEqual([m['n'] for m in stream.since(stream.epoch, 1)], [1, 2])
+        self.assertEqual(stream.since(stream.epoch, 3), [])
+
+    def test_snapshot_needed_for_other_epoch_or_overflow(self):
+        stream = EventStream('dispatchers', size=5)
+        for n in range(8):
+            stream.append({'n': n})
+        self.assertIsNone(stream.since('other', 7))
+        self.assertIsNone(stream.since(stream.epoch, 2))
+        self.assertEqual([m['seq'] for m in stream.since(stream.epoch, 3)], [4, 5, 6, 7, 8])
+        self.assertIsNone(stream.since(stream.epoch, 9))
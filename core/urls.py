@@ -16,4 +16,5 @@ urlpatterns = [
     # Utility API
     path('api/paramedics/', views.ParamedicListView.as_view(), name='paramedic_list'),
     path('api/paramedics/toggle-availability/', views.ToggleAvailabilityView.as_view(), name='paramedic_toggle_availability'),
+    path('api/realtime/status/', views.RealtimeStatusView.as_view(), name='realtime_status'),
 ]
@@ -2,12 +2,61 @@
 Utility functions for channel layer notifications and async operations.
 Optimized for ASGI applications.
 """
+import asyncio
 import logging
-from typing import Optional, Dict, Any
+import os
+from typing import Optional, Dict, Any, Tuple
+
+from django.conf import settings
+from django.db import transaction
+
+from .coalescing import location_coalescer
+from .deltas import DELTA_MESSAGE_TYPES, entity_versions
+from .regions import DISPATCH_GROUP, publish, route_for
 
 logger = logging.getLogger(__name__)
 
 
+def get_main_event_loop() -> Optional[asyncio.AbstractEventLoop]:
+    """
+    Return the ASGI server's running event loop, if there is one.
+    
+    Works both on the loop itself and from sync code that asgiref's
+    ``sync_to_async`` is running in a worker thread (views, DB helpers).
+    Returns None in plain sync contexts such as management commands.
+    """
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    from asgiref.sync import SyncToAsync
+    
+    threadlocal = SyncToAsync.threadlocal
+    if getattr(threadlocal, 'main_event_loop_pid', None) != os.getpid():
+        return None
+    loop = getattr(threadlocal, 'main_event_loop', None)
+    if loop is None or loop.is_closed() or not loop.is_running():
+        return None
+    return loop
+
+
+def versioned_payload(message_type: str, data: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any], bool]:
+    """
+    Stamp an entity payload with its next version.
+    
+    Returns ``(full, group_data, is_delta)``: the versioned full payload, what
+    to send to dispatchers (the delta when enabled and available) and whether
+    it is a delta. Payloads that aren't versioned entities pass through.
+    """
+    kind = DELTA_MESSAGE_TYPES.get(message_type)
+    if kind is None or data.get('id') is None:
+        return data, data, False
+    full, delta = entity_versions.stamp(kind, data['id'], data)
+    if delta is not None and getattr(settings, 'NOTIFICATION_DELTAS', True):
+        return full, delta, True
+    return full, full, False
+
+
 def send_channel_notification(
     group_name: str,
     message_type: str,
@@ -18,8 +67,11 @@ def send_channel_notification(
     """
     Send a notification to a channel group (optimized for ASGI).
     
-    This function handles channel layer notifications from sync views.
-    It uses async_to_sync to bridge sync/async boundaries.
+    This function handles channel layer notifications from sync views. The
+    event is handed to the notification outbox once the current database
+    transaction commits (immediately outside a transaction), so the caller
+    never waits on the channel layer and rolled-back writes are never
+    announced.
     
     Args:
         group_name: The channel group name (e.g., 'dispatchers')
@@ -29,40 +81,53 @@ def send_channel_notification(
         paramedic_id: Optional paramedic ID to also notify their personal channel
     """
     try:
-        from channels.layers import get_channel_layer
-        from asgiref.sync import async_to_sync
-        
-        channel_layer = get_channel_layer()
-        if not channel_layer:
-            logger.warning("Channel layer not configured. Notification not sent.")
-            return
-        
-        # Send notification to the main group
-        async_to_sync(channel_layer.group_send)(
-            group_name,
-            {
-                'type': message_type,
-                'event': event,
-                'data': data
-            }
+        transaction.on_commit(
+            lambda: _deliver_notification(group_name, message_type, event, data, paramedic_id),
+            robust=True
         )
-        
-        # Also notify paramedic's personal channel if provided
-        if paramedic_id is not None:
-            async_to_sync(channel_layer.group_send)(
-                f'paramedic_{paramedic_id}',
-                {
-                    'type': message_type,
-                    'event': event,
-                    'data': data
-                }
-            )
-            
     except Exception as e:
         # Log the error but don't fail the request
         logger.warning(f"Failed to send channel notification to {group_name}: {e}", exc_info=True)
 
 
+def _deliver_notification(
+    group_name: str,
+    message_type: str,
+    event: str,
+    data: Dict[str, Any],
+    paramedic_id: Optional[int] = None
+) -> None:
+    """Version the payload and queue it for the group (and paramedic channel)."""
+    from .outbox import outbox
+    
+    # Version the entity; the group gets only the changed fields
+    data, group_data, is_delta = versioned_payload(message_type, data)
+    
+    message = {
+        'type': message_type,
+        'event': event,
+        'data': group_data,
+        'delta': is_delta
+    }
+    
+    # Dispatcher events also go to the region groups of the entity's tiles
+    if group_name == DISPATCH_GROUP:
+        kind = DELTA_MESSAGE_TYPES.get(message_type)
+        if kind is not None and data.get('id') is not None:
+            message['route'] = route_for(kind, data)
+        publish(outbox, message)
+    else:
+        outbox.enqueue(group_name, message)
+    
+    # Also notify paramedic's personal channel if provided (always in full)
+    if paramedic_id is not None:
+        outbox.enqueue(f'paramedic_{paramedic_id}', {
+            'type': message_type,
+            'event': event,
+            'data': data
+        })
+
+
 def send_emergency_notification(
     event: str,
     emergency_data: Dict[str, Any],
@@ -92,10 +157,19 @@ def send_ambulance_notification(
     """
     Send an ambulance-related notification to dispatchers.
     
+    LOCATION_UPDATE events are coalesced into periodic LOCATIONS_TICK
+    frames; every other event is sent immediately.
+    
     Args:
         event: The event type (e.g., 'LOCATION_UPDATE', 'UNIT_DISPATCHED')
         ambulance_data: Serialized ambulance data
     """
+    if event == 'LOCATION_UPDATE':
+        if location_coalescer.offer(ambulance_data):
+            return
+    else:
+        location_coalescer.discard(ambulance_data.get('id'))
+    
     send_channel_notification(
         group_name='dispatchers',
         message_type='ambulance_update',
@@ -122,3 +196,22 @@ def send_hospital_notification(
         data=hospital_data
     )
 
+
+
+def send_coverage_notification(
+    event: str,
+    coverage_data: Dict[str, Any]
+) -> None:
+    """
+    Send a fleet coverage notification to dispatchers.
+    
+    Args:
+        event: The event type (e.g., 'COVERAGE_GAP', 'COVERAGE_RESTORED')
+        coverage_data: Threshold and affected grid cells
+    """
+    send_channel_notification(
+        group_name='dispatchers',
+        message_type='coverage_update',
+        event=event,
+        data=coverage_data
+    )
@@ -138,3 +138,26 @@ class ToggleAvailabilityView(generics.UpdateAPIView):
         request.user.is_available_for_dispatch = bool(val) if isinstance(val, bool) else str(val).lower() in ('1','true','yes','on')
         request.user.save(update_fields=['is_available_for_dispatch'])
         return Response(UserSerializer(request.user).data)
+
+
+class RealtimeStatusView(generics.GenericAPIView):
+    """Channel layer, notification outbox and presence counters (staff only)"""
+    permission_classes = [IsStaffOrAdmin]
+
+    def get(self, request):
+        from channels.layers import get_channel_layer
+        from .outbox import outbox
+        from .presence import presence
+
+        layer = get_channel_layer()
+        if layer is None:
+            layer_stats = None
+        elif hasattr(layer, 'stats'):
+            layer_stats = layer.stats()
+        else:
+            layer_stats = {'backend': type(layer).__name__}
+        return Response({
+            'channel_layer': layer_stats,
+            'outbox': {'pending': len(outbox), 'sent': outbox.sent, 'dropped': outbox.dropped},
+            'presence': presence.stats(),
+        })
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Ambulance, Hospital
+from .models import Ambulance, AmbulanceLocationBlock, DemandGrid, DemandModel, Hospital
 
 
 @admin.register(Ambulance)
@@ -41,3 +41,28 @@ class HospitalAdmin(admin.ModelAdmin):
             'fields': ('total_beds', 'available_beds', 'emergency_capacity')
         }),
     )
+
+
+@admin.register(AmbulanceLocationBlock)
+class AmbulanceLocationBlockAdmin(admin.ModelAdmin):
+    list_display = ('ambulance', 'hour_start', 'point_count')
+    list_filter = ('hour_start',)
+    search_fields = ('ambulance__unit_number',)
+    readonly_fields = ('ambulance', 'hour_start', 'point_count')
+    exclude = ('data',)
+    ordering = ('-hour_start',)
+
+
+@admin.register(DemandModel)
+class DemandModelAdmin(admin.ModelAdmin):
+    list_display = ('id', 'rows', 'cols', 'cell_degrees', 'last_call_id', 'updated_at')
+    readonly_fields = ('south', 'west', 'north', 'east', 'cell_degrees', 'rows', 'cols',
+                       'last_call_id', 'first_call_at', 'last_call_at', 'updated_at')
+
+
+@admin.register(DemandGrid)
+class DemandGridAdmin(admin.ModelAdmin):
+    list_display = ('hour_of_week', 'call_count', 'model')
+    readonly_fields = ('model', 'hour_of_week', 'call_count')
+    exclude = ('counts', 'density')
+    ordering = ('hour_of_week',)
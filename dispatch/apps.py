@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class DispatchConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'dispatch'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .routing import routing_engine
+
+        # Parse the road network off the request path; straight-line ETAs until then
+        routing_engine.warm()
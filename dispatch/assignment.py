@@ -0,0 +1,162 @@
+"""
+Global assignment of available ambulances to pending calls.
+
+Builds a cost matrix from the cached call x unit distance matrix
+(``dispatch.matrix``), weighting each call's ETA by its priority, and solves
+it as a linear assignment problem with the Hungarian algorithm. Calls that
+cannot be served (more calls than units) are left unassigned, and the
+solver prefers to leave the lowest-priority calls waiting.
+
+The solver is O(n^3) with the inner loop vectorized in NumPy (SciPy's
+implementation is used when installed); the problem size is capped by
+``ASSIGNMENT_MAX_SIZE`` so a solve is always bounded.
+"""
+import time
+from typing import Any, Dict, List, Tuple
+
+from django.conf import settings
+
+from core.geo import eta_minutes
+
+from .matrix import fleet_matrix, np
+
+try:
+    from scipy.optimize import linear_sum_assignment as _scipy_linear_sum_assignment
+except ImportError:  # pragma: no cover - optional dependency
+    _scipy_linear_sum_assignment = None
+
+PRIORITY_WEIGHTS = {
+    'CRITICAL': 8.0,
+    'HIGH': 4.0,
+    'MEDIUM': 2.0,
+    'LOW': 1.0,
+}
+
+# Cost, in weighted minutes, of leaving a call unassigned in this plan
+UNASSIGNED_PENALTY_MINUTES = 240.0
+
+DEFAULT_MAX_SIZE = 300
+
+
+def linear_sum_assignment(cost) -> Tuple[List[int], List[int]]:
+    """
+    Minimum-cost assignment for a rectangular cost matrix.
+
+    Returns (row_indices, col_indices) of the chosen pairs, one per row when
+    rows <= columns (and one per column otherwise).
+    """
+    cost = np.asarray(cost, dtype=float)
+    if cost.size == 0:
+        return [], []
+    if _scipy_linear_sum_assignment is not None:
+        rows, cols = _scipy_linear_sum_assignment(cost)
+        return rows.tolist(), cols.tolist()
+    if cost.shape[0] > cost.shape[1]:
+        cols, rows = linear_sum_assignment(cost.T)
+        order = np.argsort(rows)
+        return [rows[k] for k in order], [cols[k] for k in order]
+
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=int)    # p[j]: row (1-based) assigned to column j
+    way = np.zeros(m + 1, dtype=int)
+
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used[1:]
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            better = free & (reduced < minv[1:])
+            minv[1:][better] = reduced[better]
+            way[1:][better] = j0
+            candidates = np.where(free, minv[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[1:][free] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    rows, cols = [], []
+    for j in range(1, m + 1):
+        if p[j]:
+            rows.append(int(p[j]) - 1)
+            cols.append(j - 1)
+    order = sorted(range(len(rows)), key=rows.__getitem__)
+    return [rows[k] for k in order], [cols[k] for k in order]
+
+
+def build_assignment_plan(max_size: int = None) -> Dict[str, Any]:
+    """
+    Propose an assignment of AVAILABLE units to RECEIVED calls.
+
+    Returns a dict with ``assignments`` (call, unit, distance, ETA),
+    ``unassigned_call_ids`` and ``solve_ms``.
+    """
+    if max_size is None:
+        max_size = int(getattr(settings, 'ASSIGNMENT_MAX_SIZE', DEFAULT_MAX_SIZE))
+
+    snap = fleet_matrix.snapshot()
+    call_ids = snap['call_ids']
+    unit_ids = snap['ambulance_ids']
+    priorities = snap['call_priorities']
+    distances = snap['distances']
+
+    started = time.perf_counter()
+
+    # Bound the problem: most urgent calls first, then the units closest to them
+    call_rows = sorted(
+        range(len(call_ids)),
+        key=lambda r: (-PRIORITY_WEIGHTS.get(priorities[r], 1.0), call_ids[r]),
+    )[:max_size]
+    unit_cols = list(range(len(unit_ids)))
+    if call_rows and len(unit_cols) > max_size:
+        nearest = distances[call_rows].min(axis=0)
+        unit_cols = sorted(np.argsort(nearest, kind='stable')[:max_size].tolist())
+
+    assignments = []
+    assigned_calls = set()
+    if call_rows and unit_cols:
+        sub = distances[np.ix_(call_rows, unit_cols)]
+        weights = np.array([PRIORITY_WEIGHTS.get(priorities[r], 1.0) for r in call_rows])
+        cost = eta_minutes(sub) * weights[:, None]
+        if len(call_rows) > len(unit_cols):
+            # Dummy "no unit" columns let the solver choose which calls wait
+            dummy = np.repeat((weights * UNASSIGNED_PENALTY_MINUTES)[:, None], len(call_rows) - len(unit_cols), axis=1)
+            cost = np.hstack([cost, dummy])
+
+        rows, cols = linear_sum_assignment(cost)
+        for r, c in zip(rows, cols):
+            if c >= len(unit_cols):
+                continue
+            call_row = call_rows[r]
+            unit_col = unit_cols[c]
+            distance_km = float(distances[call_row, unit_col])
+            assigned_calls.add(call_ids[call_row])
+            assignments.append({
+                'emergency_call_id': call_ids[call_row],
+                'ambulance_id': unit_ids[unit_col],
+                'priority': priorities[call_row],
+                'distance_km': round(distance_km, 3),
+                'eta_minutes': round(eta_minutes(distance_km), 1),
+            })
+
+    solve_ms = (time.perf_counter() - started) * 1000.0
+    assignments.sort(key=lambda a: (-PRIORITY_WEIGHTS.get(a['priority'], 1.0), a['eta_minutes']))
+    return {
+        'assignments': assignments,
+        'unassigned_call_ids': [pk for pk in call_ids if pk not in assigned_calls],
+        'solve_ms': round(solve_ms, 2),
+    }
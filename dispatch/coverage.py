@@ -0,0 +1,352 @@
+"""
+Fleet coverage grid and coverage-gap alerts.
+
+The service area is divided into a regular lat/lng grid. For every cell the
+estimated response time from the nearest AVAILABLE unit is kept, together
+with which unit provides it. When a unit appears or moves closer only the
+cells it improves change (one vectorized pass over the cell centres); when
+a unit leaves or moves away only the cells it was covering are recomputed
+against the remaining units.
+
+Cells that have seen emergency calls are "populated". When a populated
+cell's response time rises above ``COVERAGE_TARGET_MINUTES`` a
+``COVERAGE_GAP`` event is pushed to the ``dispatchers`` group, and
+``COVERAGE_RESTORED`` once it is covered again.
+
+The grid is loaded on a background thread started by the first change
+(``warm``); changes that arrive while it loads are queued and replayed on
+top of it, so no request waits for the rebuild.
+
+Response times are straight-line estimates. NumPy is required; without it
+``coverage_map.available`` is False.
+"""
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+
+from core.geo import DEFAULT_SPEED_KMH, coerce_point
+
+from .matrix import haversine_matrix, np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CELL_DEGREES = 0.01
+DEFAULT_TARGET_MINUTES = 8.0
+# Margin added around the data extent when no bounds are configured
+AUTO_BOUNDS_MARGIN = 0.05
+# Cells are coarsened so the grid never exceeds this many
+MAX_CELLS = 40000
+# Cells per block when recomputing coverage against all units at once
+CHUNK_CELLS = 2048
+
+
+class CoverageMap:
+    """Incrementally maintained response-time grid over the service area."""
+
+    def __init__(self, speed_kmh: float = DEFAULT_SPEED_KMH):
+        self.speed_kmh = speed_kmh
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._loading = False
+        self._load_done = threading.Event()
+        self._load_done.set()
+        # Changes received while the grid loads, replayed once it is built
+        self._pending: List[Tuple] = []
+
+    @property
+    def available(self) -> bool:
+        return np is not None
+
+    @property
+    def target_minutes(self) -> float:
+        return float(getattr(settings, 'COVERAGE_TARGET_MINUTES', DEFAULT_TARGET_MINUTES))
+
+    def _ensure_loaded(self):
+        """Load the grid, waiting for a background load already under way."""
+        if self._loaded:
+            return
+        self.warm()
+        self._load_done.wait()
+        if not self._loaded:
+            # The background load failed; let the error surface here
+            self.rebuild()
+
+    def warm(self):
+        """Start loading the grid on a background thread (once)."""
+        if not self.available:
+            return
+        with self._lock:
+            if self._loaded or self._loading:
+                return
+            self._loading = True
+            self._load_done.clear()
+        threading.Thread(target=self._load_in_background, name='coverage-loader', daemon=True).start()
+
+    def _load_in_background(self):
+        from django.db import close_old_connections
+
+        try:
+            self.rebuild()
+        except Exception as e:
+            logger.warning(f"Failed to load the coverage grid: {e}", exc_info=True)
+            with self._lock:
+                # The next load reads the current database state anyway
+                self._pending = []
+        finally:
+            self._loading = False
+            self._load_done.set()
+            close_old_connections()
+
+    def _defer(self, change: Tuple) -> bool:
+        """Queue a change while the grid is not loaded yet; True if it was queued."""
+        if self._loaded:
+            return False
+        with self._lock:
+            if self._loaded:
+                return False
+            self._pending.append(change)
+        # After the triggering transaction, so the load doesn't wait on its locks
+        transaction.on_commit(self.warm)
+        return True
+
+    def _resolve_bounds(self, points) -> Optional[Tuple[float, float, float, float]]:
+        bounds = getattr(settings, 'COVERAGE_BOUNDS', None)
+        if bounds:
+            return tuple(float(b) for b in bounds)
+        if not points:
+            return None
+        lats = [p[0] for p in points]
+        lngs = [p[1] for p in points]
+        return (
+            min(lats) - AUTO_BOUNDS_MARGIN, min(lngs) - AUTO_BOUNDS_MARGIN,
+            max(lats) + AUTO_BOUNDS_MARGIN, max(lngs) + AUTO_BOUNDS_MARGIN,
+        )
+
+    def rebuild(self):
+        """Rebuild the grid, demand weights and coverage from the database."""
+        from emergencies.models import EmergencyCall
+        from .live_positions import live_positions
+        from .models import Ambulance, Hospital
+
+        call_ids = set()
+        calls = []
+        for pk, lat, lng in EmergencyCall.objects.filter(
+            latitude__isnull=False, longitude__isnull=False,
+        ).values_list('id', 'latitude', 'longitude'):
+            call_ids.add(pk)
+            calls.append((float(lat), float(lng)))
+        units = {}
+        for pk, lat, lng in Ambulance.objects.filter(
+            status='AVAILABLE', current_latitude__isnull=False, current_longitude__isnull=False,
+        ).values_list('id', 'current_latitude', 'current_longitude'):
+            fix = live_positions.get(pk)
+            units[pk] = (fix.latitude, fix.longitude) if fix else (float(lat), float(lng))
+        hospitals = [(float(lat), float(lng)) for lat, lng in Hospital.objects.values_list('latitude', 'longitude')]
+
+        cell = float(getattr(settings, 'COVERAGE_CELL_DEGREES', DEFAULT_CELL_DEGREES))
+        bounds = self._resolve_bounds(calls + list(units.values()) + hospitals)
+
+        with self._lock:
+            self.cell_degrees = cell
+            self.bounds = bounds
+            self._units: Dict[int, Tuple[float, float]] = {}
+            if bounds is None:
+                self.rows = self.cols = 0
+                self._center_lat = self._center_lng = np.zeros(0)
+                self._demand = np.zeros(0, dtype=int)
+            else:
+                south, west, north, east = bounds
+                cell = max(cell, ((north - south) * (east - west) / MAX_CELLS) ** 0.5)
+                self.cell_degrees = cell
+                self.rows = max(1, int(np.ceil((north - south) / cell)))
+                self.cols = max(1, int(np.ceil((east - west) / cell)))
+                r, c = np.divmod(np.arange(self.rows * self.cols), self.cols)
+                self._center_lat = np.radians(south + (r + 0.5) * cell)
+                self._center_lng = np.radians(west + (c + 0.5) * cell)
+                self._demand = np.zeros(self.rows * self.cols, dtype=int)
+                for lat, lng in calls:
+                    idx = self.cell_index(lat, lng)
+                    if idx is not None:
+                        self._demand[idx] += 1
+
+            self._best_time = np.full(self.rows * self.cols, np.inf)
+            self._best_unit = np.full(self.rows * self.cols, -1, dtype=np.int64)
+            self._units.update(units)
+            self._recompute(np.arange(self.rows * self.cols))
+            self._gaps = self._gap_mask()
+            self._loaded = True
+
+            # Replay what changed while loading, in order; calls the
+            # database read already counted are skipped
+            pending, self._pending = self._pending, []
+            for change in pending:
+                if change[0] == 'unit':
+                    self.update_unit(*change[1:])
+                elif change[0] == 'move':
+                    self.move_unit(*change[1:])
+                elif change[-1] not in call_ids:
+                    self.record_call(*change[1:])
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
+
+    def cell_index(self, latitude: float, longitude: float) -> Optional[int]:
+        if self.bounds is None:
+            return None
+        south, west, _, _ = self.bounds
+        r = int((latitude - south) // self.cell_degrees)
+        c = int((longitude - west) // self.cell_degrees)
+        if 0 <= r < self.rows and 0 <= c < self.cols:
+            return r * self.cols + c
+        return None
+
+    # Incremental maintenance --------------------------------------------
+
+    def _times_from(self, lat, lng, cells=None):
+        """Response minutes from points (arrays, degrees) to cell centres."""
+        center_lat = self._center_lat if cells is None else self._center_lat[cells]
+        center_lng = self._center_lng if cells is None else self._center_lng[cells]
+        km = haversine_matrix(
+            np.radians(np.atleast_1d(lat)), np.radians(np.atleast_1d(lng)), center_lat, center_lng
+        )
+        return km / self.speed_kmh * 60.0
+
+    def _apply_unit(self, pk, lat, lng):
+        if not self._best_time.size:
+            return
+        times = self._times_from(lat, lng)[0]
+        better = times < self._best_time
+        self._best_time[better] = times[better]
+        self._best_unit[better] = pk
+
+    def _recompute(self, cells, exclude=None):
+        """Recompute the nearest unit for ``cells`` from scratch, in blocks."""
+        others = [(pk, p) for pk, p in self._units.items() if pk != exclude]
+        if not others:
+            self._best_time[cells] = np.inf
+            self._best_unit[cells] = -1
+            return
+        ids = np.array([pk for pk, _ in others])
+        lats = np.array([p[0] for _, p in others])
+        lngs = np.array([p[1] for _, p in others])
+        for start in range(0, cells.size, CHUNK_CELLS):
+            block = cells[start:start + CHUNK_CELLS]
+            times = self._times_from(lats, lngs, block)
+            best = np.argmin(times, axis=0)
+            self._best_time[block] = times[best, np.arange(block.size)]
+            self._best_unit[block] = ids[best]
+
+    def _release_unit(self, pk):
+        """Recompute the cells that ``pk`` was covering against the other units."""
+        cells = np.nonzero(self._best_unit == pk)[0]
+        if cells.size:
+            self._recompute(cells, exclude=pk)
+
+    def _gap_mask(self):
+        return (self._demand > 0) & (self._best_time > self.target_minutes)
+
+    def update_unit(self, pk: int, status: str, latitude, longitude):
+        """Apply a unit's status/position change and emit gap events if needed."""
+        if not self.available or self._defer(('unit', pk, status, latitude, longitude)):
+            return
+        point = coerce_point(latitude, longitude)
+        with self._lock:
+            if pk in self._units:
+                self._release_unit(pk)
+                del self._units[pk]
+            if status == 'AVAILABLE' and point is not None:
+                self._units[pk] = point
+                self._apply_unit(pk, point[0], point[1])
+            opened, closed = self._diff_gaps()
+        self._notify(opened, closed)
+
+    def move_unit(self, pk: int, latitude: float, longitude: float):
+        """Handle a GPS fix for a unit that is currently covering the area."""
+        if not self.available or self._defer(('move', pk, latitude, longitude)):
+            return
+        if pk not in self._units:
+            return
+        self.update_unit(pk, 'AVAILABLE', latitude, longitude)
+
+    def remove_unit(self, pk: int):
+        self.update_unit(pk, 'OUT_OF_SERVICE', None, None)
+
+    def record_call(self, latitude, longitude, pk: Optional[int] = None):
+        """Count a new call towards its cell's demand."""
+        if not self.available or self._defer(('call', latitude, longitude, pk)):
+            return
+        point = coerce_point(latitude, longitude)
+        if point is None:
+            return
+        with self._lock:
+            idx = self.cell_index(*point)
+            if idx is None:
+                return
+            self._demand[idx] += 1
+            opened, closed = self._diff_gaps()
+        self._notify(opened, closed)
+
+    def _diff_gaps(self):
+        current = self._gap_mask()
+        opened = np.nonzero(current & ~self._gaps)[0]
+        closed = np.nonzero(~current & self._gaps)[0]
+        self._gaps = current
+        return [self._cell_info(i) for i in opened], [self._cell_info(i) for i in closed]
+
+    def _cell_info(self, idx) -> Dict[str, Any]:
+        idx = int(idx)
+        minutes = self._best_time[idx]
+        return {
+            'cell': idx,
+            'row': idx // self.cols,
+            'col': idx % self.cols,
+            'latitude': round(float(np.degrees(self._center_lat[idx])), 6),
+            'longitude': round(float(np.degrees(self._center_lng[idx])), 6),
+            'demand': int(self._demand[idx]),
+            'response_minutes': None if np.isinf(minutes) else round(float(minutes), 1),
+            'nearest_ambulance_id': int(self._best_unit[idx]) if self._best_unit[idx] >= 0 else None,
+        }
+
+    def _notify(self, opened: List[Dict[str, Any]], closed: List[Dict[str, Any]]):
+        from core.utils import send_coverage_notification
+
+        threshold = self.target_minutes
+        if opened:
+            send_coverage_notification(
+                event='COVERAGE_GAP',
+                coverage_data={'threshold_minutes': threshold, 'cells': opened}
+            )
+        if closed:
+            send_coverage_notification(
+                event='COVERAGE_RESTORED',
+                coverage_data={'threshold_minutes': threshold, 'cells': closed}
+            )
+
+    # Reads --------------------------------------------------------------
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Heat-map layer: response minutes per cell (None where no unit is available)."""
+        self._ensure_loaded()
+        with self._lock:
+            minutes = np.where(np.isinf(self._best_time), np.nan, np.round(self._best_time, 1))
+            grid = [
+                [None if np.isnan(v) else float(v) for v in row]
+                for row in minutes.reshape(self.rows, self.cols)
+            ] if self.rows else []
+            return {
+                'bounds': self.bounds,
+                'cell_degrees': self.cell_degrees,
+                'rows': self.rows,
+                'cols': self.cols,
+                'threshold_minutes': self.target_minutes,
+                'response_minutes': grid,
+                'demand': self._demand.reshape(self.rows, self.cols).tolist() if self.rows else [],
+                'gaps': [self._cell_info(i) for i in np.nonzero(self._gaps)[0]],
+            }
+
+
+coverage_map = CoverageMap()
@@ -0,0 +1,306 @@
+"""
+Demand forecasting and ambulance pre-positioning.
+
+Historical calls are binned per hour of the week (0 = Monday 00:00 local
+time) into a fixed lat/lng grid. Each hour keeps its raw call counts plus a
+Gaussian kernel density of them, both stored as compact float32 grids in
+``DemandGrid``. Because the density is linear in the counts, a rebuild only
+needs the calls received since the last build (``DemandModel.last_call_id``)
+and only re-smooths the hours those calls fall into.
+
+Staging recommendations place idle units so the demand-weighted response
+time for an hour is minimized (greedy k-median over the busiest cells) and
+match current idle units to those positions with the assignment solver.
+
+NumPy is required.
+"""
+import math
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core.geo import DEFAULT_SPEED_KMH
+
+from .matrix import haversine_matrix, np
+
+DEFAULT_CELL_DEGREES = 0.01
+DEFAULT_BANDWIDTH_KM = 1.0
+# Margin added around the call extent when no bounds are configured
+AUTO_BOUNDS_MARGIN = 0.05
+MAX_CELLS = 40000
+HOURS_PER_WEEK = 168
+KM_PER_DEGREE = 111.32
+
+# Bounds on the staging search
+MAX_DEMAND_CELLS = 2000
+MAX_CANDIDATE_SITES = 300
+MAX_STAGING_POSITIONS = 100
+
+
+def hour_of_week(when=None) -> int:
+    """Hour of the week (0-167, Monday 00:00 = 0) in local time."""
+    when = when or timezone.now()
+    if timezone.is_aware(when):
+        when = timezone.localtime(when)
+    return when.weekday() * 24 + when.hour
+
+
+def encode_grid(grid) -> bytes:
+    return np.asarray(grid, dtype='<f4').tobytes()
+
+
+def decode_grid(data, rows: int, cols: int):
+    data = bytes(data or b'')
+    if not data:
+        return np.zeros((rows, cols), dtype=np.float32)
+    return np.frombuffer(data, dtype='<f4').reshape(rows, cols).astype(np.float32)
+
+
+def _kernel(sigma_cells: float):
+    radius = max(1, int(math.ceil(3 * sigma_cells)))
+    offsets = np.arange(-radius, radius + 1)
+    weights = np.exp(-0.5 * (offsets / max(sigma_cells, 1e-6)) ** 2)
+    return offsets, weights / weights.sum()
+
+
+def _smooth_axis(grid, sigma_cells: float, axis: int):
+    offsets, weights = _kernel(sigma_cells)
+    radius = offsets[-1]
+    pad = [(0, 0), (0, 0)]
+    pad[axis] = (radius, radius)
+    padded = np.pad(grid, pad)
+    out = np.zeros_like(grid)
+    size = grid.shape[axis]
+    for offset, weight in zip(offsets, weights):
+        start = radius + offset
+        window = padded[start:start + size, :] if axis == 0 else padded[:, start:start + size]
+        out += weight * window
+    return out
+
+
+def kernel_density(counts, cell_degrees: float, center_latitude: float, bandwidth_km: float):
+    """Separable Gaussian smoothing of a count grid with bandwidth in km."""
+    sigma_rows = bandwidth_km / (cell_degrees * KM_PER_DEGREE)
+    sigma_cols = bandwidth_km / (cell_degrees * KM_PER_DEGREE * max(math.cos(math.radians(center_latitude)), 0.01))
+    smoothed = _smooth_axis(counts.astype(np.float64), sigma_rows, axis=0)
+    return _smooth_axis(smoothed, sigma_cols, axis=1).astype(np.float32)
+
+
+def _grid_definition(calls):
+    bounds = getattr(settings, 'COVERAGE_BOUNDS', None)
+    if bounds:
+        south, west, north, east = (float(b) for b in bounds)
+    else:
+        lats = [lat for _, lat, _, _ in calls]
+        lngs = [lng for _, _, lng, _ in calls]
+        south, west = min(lats) - AUTO_BOUNDS_MARGIN, min(lngs) - AUTO_BOUNDS_MARGIN
+        north, east = max(lats) + AUTO_BOUNDS_MARGIN, max(lngs) + AUTO_BOUNDS_MARGIN
+    cell = float(getattr(settings, 'DEMAND_CELL_DEGREES', DEFAULT_CELL_DEGREES))
+    cell = max(cell, ((north - south) * (east - west) / MAX_CELLS) ** 0.5)
+    return {
+        'south': south, 'west': west, 'north': north, 'east': east,
+        'cell_degrees': cell,
+        'rows': max(1, int(math.ceil((north - south) / cell))),
+        'cols': max(1, int(math.ceil((east - west) / cell))),
+    }
+
+
+def build_demand_model(full: bool = False) -> Dict[str, Any]:
+    """
+    Fold calls received since the last build into the hour-of-week grids.
+
+    With ``full`` the grids are dropped and rebuilt from every call. Returns
+    counts of processed/skipped calls and the hours that were re-smoothed.
+    """
+    from emergencies.models import EmergencyCall
+    from .models import DemandGrid, DemandModel
+
+    with transaction.atomic():
+        model = DemandModel.objects.select_for_update().first()
+        if full and model is not None:
+            model.delete()
+            model = None
+
+        since = model.last_call_id if model is not None else 0
+        calls = [
+            (pk, float(lat), float(lng), received_at)
+            for pk, lat, lng, received_at in EmergencyCall.objects.filter(
+                id__gt=since, latitude__isnull=False, longitude__isnull=False,
+            ).order_by('id').values_list('id', 'latitude', 'longitude', 'received_at').iterator()
+        ]
+        if not calls:
+            return {'model': model, 'processed': 0, 'skipped': 0, 'hours_updated': []}
+
+        if model is None:
+            model = DemandModel.objects.create(**_grid_definition(calls))
+
+        lat = np.array([c[1] for c in calls])
+        lng = np.array([c[2] for c in calls])
+        hours = np.array([hour_of_week(c[3]) for c in calls])
+        r = np.floor((lat - model.south) / model.cell_degrees).astype(int)
+        c = np.floor((lng - model.west) / model.cell_degrees).astype(int)
+        inside = (r >= 0) & (r < model.rows) & (c >= 0) & (c < model.cols)
+
+        grids = {g.hour_of_week: g for g in DemandGrid.objects.filter(model=model)}
+        bandwidth = float(getattr(settings, 'DEMAND_BANDWIDTH_KM', DEFAULT_BANDWIDTH_KM))
+        center_latitude = (model.south + model.north) / 2
+        touched = sorted(set(hours[inside].tolist()))
+        for hour in touched:
+            grid = grids.get(hour) or DemandGrid(model=model, hour_of_week=hour)
+            counts = decode_grid(grid.counts, model.rows, model.cols)
+            mask = inside & (hours == hour)
+            np.add.at(counts, (r[mask], c[mask]), 1)
+            grid.counts = encode_grid(counts)
+            grid.density = encode_grid(kernel_density(counts, model.cell_degrees, center_latitude, bandwidth))
+            grid.call_count += int(mask.sum())
+            grid.save()
+
+        received = [call[3] for call in calls if call[3] is not None]
+        if received:
+            model.first_call_at = min([model.first_call_at or received[0]] + received)
+            model.last_call_at = max([model.last_call_at or received[0]] + received)
+        model.last_call_id = calls[-1][0]
+        model.save()
+
+    return {
+        'model': model,
+        'processed': int(inside.sum()),
+        'skipped': int((~inside).sum()),
+        'hours_updated': touched,
+    }
+
+
+def _weeks_observed(model) -> float:
+    if model.first_call_at is None or model.last_call_at is None:
+        return 1.0
+    return max(1.0, (model.last_call_at - model.first_call_at).total_seconds() / (7 * 86400))
+
+
+def load_forecast(hour: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Expected calls per cell for one hour of the week, or None if not built."""
+    from .models import DemandGrid, DemandModel
+
+    model = DemandModel.objects.first()
+    if model is None:
+        return None
+    hour = hour_of_week() if hour is None else hour
+    grid = DemandGrid.objects.filter(model=model, hour_of_week=hour).only('density').first()
+    density = decode_grid(grid.density if grid else b'', model.rows, model.cols) / _weeks_observed(model)
+    return {'model': model, 'hour_of_week': hour, 'expected_calls': density}
+
+
+def _cell_centres(model, cells):
+    r, c = np.divmod(cells, model.cols)
+    return (
+        model.south + (r + 0.5) * model.cell_degrees,
+        model.west + (c + 0.5) * model.cell_degrees,
+    )
+
+
+def forecast_as_dict(hour: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """JSON-ready demand heat map for one hour of the week."""
+    forecast = load_forecast(hour)
+    if forecast is None:
+        return None
+    model = forecast['model']
+    expected = forecast['expected_calls']
+    return {
+        'hour_of_week': forecast['hour_of_week'],
+        'bounds': [model.south, model.west, model.north, model.east],
+        'cell_degrees': model.cell_degrees,
+        'rows': model.rows,
+        'cols': model.cols,
+        'built_through_call_id': model.last_call_id,
+        'expected_calls_total': round(float(expected.sum()), 3),
+        'expected_calls': np.round(expected, 4).tolist(),
+    }
+
+
+def recommend_staging(hour: Optional[int] = None, count: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """
+    Recommend staging positions for idle units for one hour of the week.
+
+    ``count`` defaults to the number of AVAILABLE units. Returns None when no
+    demand model has been built.
+    """
+    from .assignment import linear_sum_assignment
+    from .live_positions import live_positions
+    from .models import Ambulance
+
+    forecast = load_forecast(hour)
+    if forecast is None:
+        return None
+    model = forecast['model']
+    expected = forecast['expected_calls'].ravel()
+
+    units = []
+    for pk, lat, lng in Ambulance.objects.filter(
+        status='AVAILABLE', current_latitude__isnull=False, current_longitude__isnull=False,
+    ).values_list('id', 'current_latitude', 'current_longitude'):
+        fix = live_positions.get(pk)
+        units.append((pk, fix.latitude, fix.longitude) if fix else (pk, float(lat), float(lng)))
+
+    count = len(units) if count is None else count
+    count = min(count, MAX_STAGING_POSITIONS)
+
+    demand_cells = np.argsort(expected)[::-1][:MAX_DEMAND_CELLS]
+    demand_cells = demand_cells[expected[demand_cells] > 0]
+    result = {
+        'hour_of_week': forecast['hour_of_week'],
+        'expected_calls': round(float(expected.sum()), 3),
+        'current_mean_response_minutes': None,
+        'staged_mean_response_minutes': None,
+        'positions': [],
+    }
+    if not demand_cells.size or count <= 0:
+        return result
+
+    weights = expected[demand_cells]
+    demand_lat, demand_lng = _cell_centres(model, demand_cells)
+    demand_lat, demand_lng = np.radians(demand_lat), np.radians(demand_lng)
+
+    def mean_minutes(distances):
+        return round(float((distances.min(axis=0) * weights).sum() / weights.sum() / DEFAULT_SPEED_KMH * 60.0), 1)
+
+    if units:
+        unit_lat = np.radians(np.array([u[1] for u in units]))
+        unit_lng = np.radians(np.array([u[2] for u in units]))
+        result['current_mean_response_minutes'] = mean_minutes(
+            haversine_matrix(unit_lat, unit_lng, demand_lat, demand_lng)
+        )
+
+    # Greedy k-median: repeatedly add the site that most reduces weighted distance
+    candidates = demand_cells[:MAX_CANDIDATE_SITES]
+    site_distances = haversine_matrix(demand_lat[:candidates.size], demand_lng[:candidates.size], demand_lat, demand_lng)
+    best = np.full(demand_cells.size, np.inf)
+    chosen: List[int] = []
+    for _ in range(min(count, candidates.size)):
+        totals = np.minimum(best[None, :], site_distances).dot(weights)
+        totals[chosen] = np.inf
+        pick = int(np.argmin(totals))
+        chosen.append(pick)
+        best = np.minimum(best, site_distances[pick])
+
+    chosen_distances = site_distances[chosen]
+    result['staged_mean_response_minutes'] = mean_minutes(chosen_distances)
+    covered = np.bincount(np.argmin(chosen_distances, axis=0), weights=weights, minlength=len(chosen))
+
+    site_lat, site_lng = _cell_centres(model, candidates[chosen])
+    positions = [{
+        'latitude': round(float(lat), 6),
+        'longitude': round(float(lng), 6),
+        'expected_calls_covered': round(float(covered[n]), 3),
+        'ambulance_id': None,
+        'move_km': None,
+    } for n, (lat, lng) in enumerate(zip(site_lat, site_lng))]
+
+    if units:
+        move = haversine_matrix(unit_lat, unit_lng, np.radians(site_lat), np.radians(site_lng))
+        for u, p in zip(*linear_sum_assignment(move)):
+            positions[p]['ambulance_id'] = units[u][0]
+            positions[p]['move_km'] = round(float(move[u, p]), 3)
+
+    result['positions'] = positions
+    return result
@@ -0,0 +1,204 @@
+"""
+Append-only GPS track history for ambulances.
+
+Fixes are buffered in memory and appended to one ``AmbulanceLocationBlock``
+row per unit per hour when the live position flusher runs. Each point is
+stored as three int32 values: seconds since the block's hour, latitude and
+longitude in microdegrees (12 bytes per point).
+
+Tracks are read back for a time window and simplified with Douglas-Peucker
+so a full shift can be drawn from a few hundred points.
+"""
+import logging
+import math
+import sys
+import threading
+from array import array
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+MICRODEGREES = 1_000_000
+
+# (timestamp, latitude, longitude)
+TrackPoint = Tuple[datetime, float, float]
+
+
+def hour_floor(ts: datetime) -> datetime:
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def pack_points(points: List[Tuple[int, int, int]]) -> bytes:
+    """Pack (offset_seconds, lat_microdeg, lng_microdeg) triples into block bytes."""
+    values = array('i')
+    for offset, lat, lng in points:
+        values.extend((offset, lat, lng))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def unpack_block(hour_start: datetime, data: bytes) -> List[TrackPoint]:
+    """Decode block bytes into (timestamp, latitude, longitude) points."""
+    values = array('i')
+    values.frombytes(bytes(data))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return [
+        (
+            hour_start + timedelta(seconds=values[i]),
+            values[i + 1] / MICRODEGREES,
+            values[i + 2] / MICRODEGREES,
+        )
+        for i in range(0, len(values) - 2, 3)
+    ]
+
+
+def simplify_track(points: List[TrackPoint], tolerance_m: float) -> List[TrackPoint]:
+    """
+    Douglas-Peucker simplification of a time-ordered track.
+
+    Distances are measured on a local equirectangular projection, which is
+    accurate enough at city scale.
+    """
+    if len(points) < 3 or tolerance_m <= 0:
+        return list(points)
+
+    lat0 = math.radians(points[0][1])
+    kx = 111_195.0 * math.cos(lat0)
+    ky = 111_195.0
+    xy = [(p[2] * kx, p[1] * ky) for p in points]
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        ax, ay = xy[first]
+        bx, by = xy[last]
+        dx, dy = bx - ax, by - ay
+        seg_len_sq = dx * dx + dy * dy
+        max_dist = -1.0
+        index = first
+        for i in range(first + 1, last):
+            px, py = xy[i]
+            if seg_len_sq == 0:
+                dist = math.hypot(px - ax, py - ay)
+            else:
+                dist = abs(dy * px - dx * py + bx * ay - by * ax) / math.sqrt(seg_len_sq)
+            if dist > max_dist:
+                max_dist = dist
+                index = i
+        if max_dist > tolerance_m:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+
+    return [p for p, k in zip(points, keep) if k]
+
+
+def downsample_track(points: List[TrackPoint], tolerance_m: float, max_points: int) -> List[TrackPoint]:
+    """Simplify a track, raising the tolerance until it fits in ``max_points``."""
+    simplified = simplify_track(points, tolerance_m)
+    tolerance = max(tolerance_m, 1.0)
+    while len(simplified) > max_points and tolerance < 100_000:
+        tolerance *= 2
+        simplified = simplify_track(points, tolerance)
+    return simplified
+
+
+class LocationHistoryBuffer:
+    """In-memory buffer of fixes awaiting append to their hourly blocks."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (ambulance_id, hour_start) -> list of packed triples
+        self._pending: Dict[Tuple[int, datetime], List[Tuple[int, int, int]]] = {}
+
+    def append(self, pk: int, latitude: float, longitude: float, timestamp: datetime):
+        hour_start = hour_floor(timestamp)
+        point = (
+            int((timestamp - hour_start).total_seconds()),
+            int(round(float(latitude) * MICRODEGREES)),
+            int(round(float(longitude) * MICRODEGREES)),
+        )
+        with self._lock:
+            self._pending.setdefault((pk, hour_start), []).append(point)
+
+    def pending_count(self) -> int:
+        return sum(len(points) for points in self._pending.values())
+
+    def flush(self) -> int:
+        """Append buffered points to their blocks; returns the point count written."""
+        from .models import Ambulance, AmbulanceLocationBlock
+
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        existing = set(Ambulance.objects.filter(
+            pk__in={pk for pk, _ in pending}
+        ).values_list('pk', flat=True))
+        dropped = [key for key in pending if key[0] not in existing]
+        for key in dropped:
+            logger.info(f"Dropping {len(pending.pop(key))} track points for deleted ambulance {key[0]}")
+
+        written = 0
+        try:
+            with transaction.atomic():
+                for (pk, hour_start), points in pending.items():
+                    block, _ = AmbulanceLocationBlock.objects.select_for_update().get_or_create(
+                        ambulance_id=pk, hour_start=hour_start
+                    )
+                    block.data = bytes(block.data) + pack_points(points)
+                    block.point_count += len(points)
+                    block.save(update_fields=['data', 'point_count'])
+                    written += len(points)
+        except Exception:
+            with self._lock:
+                for key, points in pending.items():
+                    self._pending.setdefault(key, [])[:0] = points
+            raise
+        return written
+
+    def pending_points(self, pk: int, start: datetime, end: datetime) -> List[TrackPoint]:
+        """Buffered points for one unit inside a window (not yet persisted)."""
+        with self._lock:
+            items = [
+                (hour_start, list(points))
+                for (unit, hour_start), points in self._pending.items()
+                if unit == pk and start - timedelta(hours=1) < hour_start <= end
+            ]
+        result = []
+        for hour_start, points in items:
+            for offset, lat, lng in points:
+                ts = hour_start + timedelta(seconds=offset)
+                if start <= ts <= end:
+                    result.append((ts, lat / MICRODEGREES, lng / MICRODEGREES))
+        return result
+
+
+def get_track(pk: int, start: datetime, end: datetime, buffer: Optional[LocationHistoryBuffer] = None) -> List[TrackPoint]:
+    """Return the time-ordered raw track of one unit between ``start`` and ``end``."""
+    from .models import AmbulanceLocationBlock
+
+    blocks = AmbulanceLocationBlock.objects.filter(
+        ambulance_id=pk,
+        hour_start__gt=start - timedelta(hours=1),
+        hour_start__lte=end,
+    ).values_list('hour_start', 'data')
+
+    points: List[TrackPoint] = []
+    for hour_start, data in blocks:
+        points.extend(p for p in unpack_block(hour_start, data) if start <= p[0] <= end)
+    if buffer is not None:
+        points.extend(buffer.pending_points(pk, start, end))
+    points.sort(key=lambda p: p[0])
+    return points
+
+
+location_history = LocationHistoryBuffer()
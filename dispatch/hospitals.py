@@ -0,0 +1,202 @@
+"""
+Hospital destination ranking.
+
+Hospitals are cached in memory together with their serialized form and an
+inverted index from specialty keywords to hospital ids, parsed once from
+the free-text ``Hospital.specialties`` field. The cache is refreshed per
+hospital by the ``dispatch.signals`` receivers (capacity updates included),
+so ranking a call never re-parses text or queries the hospital table.
+"""
+import math
+import re
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, FrozenSet, List, Optional, Set
+
+from core.geo import haversine_km
+
+# Specialty keywords relevant to each EmergencyCall.emergency_type
+EMERGENCY_SPECIALTIES = {
+    'CARDIAC': {'cardiology', 'cardiac', 'cardiothoracic', 'heart'},
+    'STROKE': {'neurology', 'neurosurgery', 'stroke'},
+    'TRAUMA': {'trauma', 'orthopedics', 'orthopaedics', 'surgery'},
+    'RESPIRATORY': {'pulmonology', 'respiratory', 'pulmonary'},
+    'FIRE': {'burns', 'burn', 'trauma'},
+    'MEDICAL': {'emergency', 'internal', 'general'},
+    'OTHER': {'emergency', 'general'},
+}
+
+CAPACITY_SCORES = {
+    'LOW': 1.0,
+    'MODERATE': 0.7,
+    'HIGH': 0.35,
+    'FULL': 0.0,
+}
+
+# Relative weights of the score components (sum to 1)
+SCORE_WEIGHTS = {
+    'distance': 0.4,
+    'specialty': 0.3,
+    'beds': 0.15,
+    'capacity': 0.15,
+}
+
+# Distance at which the distance component has decayed to 1/e
+DISTANCE_SCALE_KM = 10.0
+
+_WORD_RE = re.compile(r'[a-z]+')
+
+
+def parse_specialties(text: str) -> Dict[str, FrozenSet[str]]:
+    """Split a comma-separated specialties string into {phrase: keywords}."""
+    result = {}
+    for phrase in (text or '').split(','):
+        phrase = ' '.join(phrase.split())
+        if phrase:
+            result[phrase] = frozenset(_WORD_RE.findall(phrase.lower()))
+    return result
+
+
+@dataclass
+class HospitalEntry:
+    pk: int
+    latitude: float
+    longitude: float
+    available_beds: int
+    total_beds: int
+    emergency_capacity: str
+    specialties: Dict[str, FrozenSet[str]]
+    data: Dict[str, Any]
+
+
+class HospitalRankingIndex:
+    """Cached hospitals plus a specialty keyword -> hospital id index."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._hospitals: Dict[int, HospitalEntry] = {}
+        self._by_keyword: Dict[str, Set[int]] = {}
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.rebuild()
+
+    def rebuild(self):
+        from .models import Hospital
+
+        hospitals = list(Hospital.objects.all())
+        with self._lock:
+            self._hospitals = {}
+            self._by_keyword = {}
+            for hospital in hospitals:
+                self._add(hospital)
+            self._loaded = True
+
+    def _add(self, hospital):
+        from .serializers import HospitalSerializer
+
+        entry = HospitalEntry(
+            pk=hospital.pk,
+            latitude=float(hospital.latitude),
+            longitude=float(hospital.longitude),
+            available_beds=hospital.available_beds,
+            total_beds=hospital.total_beds,
+            emergency_capacity=hospital.emergency_capacity,
+            specialties=parse_specialties(hospital.specialties),
+            data=HospitalSerializer(hospital).data,
+        )
+        self._hospitals[entry.pk] = entry
+        for keywords in entry.specialties.values():
+            for keyword in keywords:
+                self._by_keyword.setdefault(keyword, set()).add(entry.pk)
+
+    def _remove(self, pk: int):
+        entry = self._hospitals.pop(pk, None)
+        if entry is None:
+            return
+        for keywords in entry.specialties.values():
+            for keyword in keywords:
+                ids = self._by_keyword.get(keyword)
+                if ids is not None:
+                    ids.discard(pk)
+                    if not ids:
+                        del self._by_keyword[keyword]
+
+    def update(self, hospital):
+        """Refresh one hospital after it was saved."""
+        if not self._loaded:
+            return
+        with self._lock:
+            self._remove(hospital.pk)
+            self._add(hospital)
+
+    def remove(self, pk: int):
+        with self._lock:
+            self._remove(pk)
+
+    def rank(
+        self,
+        latitude: float,
+        longitude: float,
+        emergency_type: Optional[str] = None,
+        limit: int = 5,
+        include_full: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """
+        Score hospitals for a call location and emergency type, best first.
+
+        Each result holds the cached serialized hospital, the overall score,
+        its components, distance/ETA and the matching specialties.
+        """
+        self._ensure_loaded()
+        wanted = EMERGENCY_SPECIALTIES.get(emergency_type or '', set())
+
+        with self._lock:
+            specialists: Set[int] = set()
+            for keyword in wanted:
+                specialists |= self._by_keyword.get(keyword, set())
+            entries = list(self._hospitals.values())
+
+        results = []
+        for entry in entries:
+            if not include_full and (entry.emergency_capacity == 'FULL' or entry.available_beds <= 0):
+                continue
+            distance_km = haversine_km(latitude, longitude, entry.latitude, entry.longitude)
+            components = {
+                'distance': math.exp(-distance_km / DISTANCE_SCALE_KM),
+                'specialty': 1.0 if entry.pk in specialists else 0.0,
+                'beds': entry.available_beds / entry.total_beds if entry.total_beds > 0 else 0.0,
+                'capacity': CAPACITY_SCORES.get(entry.emergency_capacity, 0.5),
+            }
+            components['beds'] = max(0.0, min(1.0, components['beds']))
+            score = sum(SCORE_WEIGHTS[k] * v for k, v in components.items())
+            results.append({
+                'hospital': entry.data,
+                'score': round(score, 4),
+                'components': {k: round(v, 3) for k, v in components.items()},
+                'distance_km': round(distance_km, 3),
+                'eta_minutes': None,
+                'matched_specialties': [
+                    phrase for phrase, keywords in entry.specialties.items() if keywords & wanted
+                ],
+            })
+
+        results.sort(key=lambda r: (-r['score'], r['distance_km']))
+        results = results[:limit]
+
+        # Road travel time only for the hospitals actually returned
+        from .routing import travel_times_minutes
+        routed = [
+            (result, self._hospitals[result['hospital']['id']]) for result in results
+            if result['hospital']['id'] in self._hospitals
+        ]
+        etas = travel_times_minutes(latitude, longitude, [(e.latitude, e.longitude) for _, e in routed])
+        for (result, _), minutes in zip(routed, etas):
+            result['eta_minutes'] = round(minutes, 1)
+        return results
+
+
+hospital_index = HospitalRankingIndex()
@@ -0,0 +1,206 @@
+"""
+Write-behind store for the latest GPS fix of each ambulance.
+
+GPS updates are recorded here and broadcast immediately, while the
+``Ambulance`` table is only touched by a background flusher that writes
+all pending fixes in one ``bulk_update`` every
+``LIVE_POSITION_FLUSH_INTERVAL`` seconds. The number of DB writes per
+interval is therefore bounded by one batch regardless of fleet size or
+update rate.
+
+Every recorded fix is also appended to ``dispatch.history`` so the track
+can be replayed later.
+
+The store is per process. Readers in the same process see a fix as soon as
+it is recorded (``AmbulanceSerializer`` overlays it); other processes see it
+after the next flush.
+"""
+import atexit
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from .history import location_history
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL = 5.0
+
+
+@dataclass(frozen=True)
+class LiveFix:
+    """Latest known position of a unit."""
+
+    latitude: float
+    longitude: float
+    timestamp: datetime
+
+
+class LivePositionStore:
+    """Latest fix per ambulance with periodic batched persistence."""
+
+    def __init__(self, flush_interval: Optional[float] = None):
+        self._flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._fixes: Dict[int, LiveFix] = {}
+        self._dirty: Dict[int, LiveFix] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._listeners: List[Callable[[int, float, float], None]] = []
+
+    @property
+    def flush_interval(self) -> float:
+        if self._flush_interval is not None:
+            return self._flush_interval
+        return float(getattr(settings, 'LIVE_POSITION_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL))
+
+    def add_listener(self, callback: Callable[[int, float, float], None]):
+        """Call ``callback(pk, latitude, longitude)`` whenever a unit's current fix moves."""
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def record(
+        self, pk: int, latitude, longitude,
+        timestamp: Optional[datetime] = None, stored: Optional[datetime] = None,
+    ) -> Optional[LiveFix]:
+        """
+        Record a new fix for an ambulance and schedule it for persistence.
+
+        Every fix is appended to the unit's track history. Fixes that are not
+        newer than the one already held, or than ``stored`` (the row's
+        ``last_location_update``), only go to history: the current position,
+        the pending flush and the listeners are left alone, and the current
+        fix (None if none is held) is returned instead.
+        """
+        fix = LiveFix(
+            latitude=round(float(latitude), 6),
+            longitude=round(float(longitude), 6),
+            timestamp=timestamp or timezone.now(),
+        )
+        location_history.append(pk, fix.latitude, fix.longitude, fix.timestamp)
+        self._ensure_flusher()
+
+        if stored is not None and stored >= fix.timestamp:
+            return self._fixes.get(pk)
+        with self._lock:
+            current = self._fixes.get(pk)
+            if current is not None and current.timestamp > fix.timestamp:
+                return current
+            self._fixes[pk] = fix
+            self._dirty[pk] = fix
+
+        for callback in self._listeners:
+            try:
+                callback(pk, fix.latitude, fix.longitude)
+            except Exception as e:
+                logger.warning(f"Live position listener failed for ambulance {pk}: {e}", exc_info=True)
+        return fix
+
+    def get(self, pk: int) -> Optional[LiveFix]:
+        return self._fixes.get(pk)
+
+    def newer_than(self, ambulance) -> Optional[LiveFix]:
+        """The live fix of an ``Ambulance`` instance if it is newer than the instance's position."""
+        fix = self._fixes.get(ambulance.pk)
+        if fix is None:
+            return None
+        if ambulance.last_location_update and ambulance.last_location_update >= fix.timestamp:
+            return None
+        return fix
+
+    def apply(self, ambulance) -> bool:
+        """
+        Overlay the live fix onto an ``Ambulance`` instance if it is newer.
+
+        Returns True when the instance was changed.
+        """
+        fix = self.newer_than(ambulance)
+        if fix is None:
+            return False
+        ambulance.current_latitude = fix.latitude
+        ambulance.current_longitude = fix.longitude
+        ambulance.last_location_update = fix.timestamp
+        return True
+
+    def pending_count(self) -> int:
+        return len(self._dirty)
+
+    def flush(self) -> int:
+        """Persist all pending fixes in one batch; returns the row count written."""
+        from .models import Ambulance
+
+        with self._lock:
+            pending, self._dirty = self._dirty, {}
+        if not pending:
+            return 0
+
+        rows = [
+            Ambulance(
+                pk=pk,
+                current_latitude=fix.latitude,
+                current_longitude=fix.longitude,
+                last_location_update=fix.timestamp,
+            )
+            for pk, fix in pending.items()
+        ]
+        try:
+            Ambulance.objects.bulk_update(
+                rows,
+                ['current_latitude', 'current_longitude', 'last_location_update'],
+                batch_size=500,
+            )
+        except Exception:
+            # Put the fixes back unless a newer one arrived meanwhile
+            with self._lock:
+                for pk, fix in pending.items():
+                    self._dirty.setdefault(pk, fix)
+            raise
+        return len(rows)
+
+    def forget(self, pk: int):
+        """Drop any live state for a deleted ambulance."""
+        with self._lock:
+            self._fixes.pop(pk, None)
+            self._dirty.pop(pk, None)
+
+    def _ensure_flusher(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='live-position-flusher', daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        from django.db import close_old_connections
+
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+                location_history.flush()
+            except Exception as e:
+                logger.warning(f"Failed to flush live ambulance positions: {e}", exc_info=True)
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        """Stop the background flusher and write any pending fixes."""
+        self._stop.set()
+        try:
+            self.flush()
+            location_history.flush()
+        except Exception as e:
+            logger.warning(f"Failed to flush live ambulance positions on shutdown: {e}")
+
+
+live_positions = LivePositionStore()
+atexit.register(live_positions.stop)
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from dispatch.forecasting import build_demand_model
+from dispatch.matrix import np
+
+
+class Command(BaseCommand):
+    help = 'Fold new emergency calls into the hour-of-week demand forecast grids'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Discard the existing grids and rebuild from every call',
+        )
+
+    def handle(self, *args, **options):
+        if np is None:
+            raise CommandError('Demand forecasting requires NumPy')
+
+        result = build_demand_model(full=options['full'])
+        model = result['model']
+        if model is None:
+            self.stdout.write(self.style.WARNING('No calls with a location to build from.'))
+            return
+
+        self.stdout.write(
+            f"Processed {result['processed']} new call(s) into {len(result['hours_updated'])} hour-of-week grid(s) "
+            f"({model.rows}x{model.cols} cells of {model.cell_degrees:.4f} deg)."
+        )
+        if result['skipped']:
+            self.stdout.write(self.style.WARNING(
+                f"{result['skipped']} call(s) fell outside the grid; run with --full to re-derive the bounds."
+            ))
+        self.stdout.write(self.style.SUCCESS(f'Demand model current through call #{model.last_call_id}.'))
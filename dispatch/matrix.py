@@ -0,0 +1,250 @@
+"""
+Vectorized pending-call x available-unit distance matrix.
+
+Coordinates of pending (RECEIVED) calls and AVAILABLE ambulances are cached
+as NumPy arrays together with the haversine distance matrix between them.
+When a unit moves only its column is recomputed, and when a call arrives
+only its row is added, so keeping the board current costs O(calls + units)
+per event instead of O(calls x units).
+
+NumPy is an optional dependency; without it ``fleet_matrix.available`` is
+False and the API reports the service as unavailable.
+"""
+import threading
+from typing import Any, Dict, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+from core.geo import DEFAULT_SPEED_KMH, EARTH_RADIUS_KM, coerce_point
+
+
+def haversine_matrix(lat1, lng1, lat2, lng2):
+    """
+    Pairwise great-circle distances in km between two sets of points.
+
+    Inputs are 1-D arrays in radians; the result has shape (len(lat1), len(lat2)).
+    """
+    lat1 = lat1[:, None]
+    lng1 = lng1[:, None]
+    lat2 = lat2[None, :]
+    lng2 = lng2[None, :]
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class _PointSet:
+    """Ids plus parallel radian coordinate arrays with O(1) id lookup."""
+
+    def __init__(self):
+        self.ids: List[int] = []
+        self.index: Dict[int, int] = {}
+        self.lat = np.zeros(0)
+        self.lng = np.zeros(0)
+        self.meta: List[Any] = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def set_all(self, rows):
+        self.ids = [pk for pk, _, _, _ in rows]
+        self.index = {pk: i for i, pk in enumerate(self.ids)}
+        self.lat = np.radians(np.array([lat for _, lat, _, _ in rows], dtype=float))
+        self.lng = np.radians(np.array([lng for _, _, lng, _ in rows], dtype=float))
+        self.meta = [meta for _, _, _, meta in rows]
+
+    def append(self, pk, lat, lng, meta):
+        self.index[pk] = len(self.ids)
+        self.ids.append(pk)
+        self.lat = np.append(self.lat, np.radians(lat))
+        self.lng = np.append(self.lng, np.radians(lng))
+        self.meta.append(meta)
+        return self.index[pk]
+
+    def remove(self, pk) -> Optional[int]:
+        i = self.index.pop(pk, None)
+        if i is None:
+            return None
+        del self.ids[i]
+        del self.meta[i]
+        self.lat = np.delete(self.lat, i)
+        self.lng = np.delete(self.lng, i)
+        for j in range(i, len(self.ids)):
+            self.index[self.ids[j]] = j
+        return i
+
+
+class FleetDistanceMatrix:
+    """Incrementally maintained distance matrix between pending calls and available units."""
+
+    def __init__(self, speed_kmh: float = DEFAULT_SPEED_KMH):
+        self.speed_kmh = speed_kmh
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._calls: Optional[_PointSet] = None
+        self._units: Optional[_PointSet] = None
+        self._distances = None
+
+    @property
+    def available(self) -> bool:
+        return np is not None
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.rebuild()
+
+    def rebuild(self):
+        """Reload pending calls and available units and recompute the full matrix."""
+        from emergencies.models import EmergencyCall
+        from .models import Ambulance
+
+        calls = [
+            (pk, float(lat), float(lng), priority)
+            for pk, lat, lng, priority in EmergencyCall.objects.filter(
+                status='RECEIVED', latitude__isnull=False, longitude__isnull=False,
+            ).values_list('id', 'latitude', 'longitude', 'priority')
+        ]
+        units = [
+            (pk, float(lat), float(lng), unit_type)
+            for pk, lat, lng, unit_type in Ambulance.objects.filter(
+                status='AVAILABLE', current_latitude__isnull=False, current_longitude__isnull=False,
+            ).values_list('id', 'current_latitude', 'current_longitude', 'unit_type')
+        ]
+
+        from .live_positions import live_positions
+        for n, (pk, lat, lng, unit_type) in enumerate(units):
+            fix = live_positions.get(pk)
+            if fix is not None:
+                units[n] = (pk, fix.latitude, fix.longitude, unit_type)
+
+        with self._lock:
+            self._calls = _PointSet()
+            self._calls.set_all(calls)
+            self._units = _PointSet()
+            self._units.set_all(units)
+            self._distances = haversine_matrix(
+                self._calls.lat, self._calls.lng, self._units.lat, self._units.lng
+            )
+            self._loaded = True
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
+            self._calls = self._units = self._distances = None
+
+    # Incremental updates ------------------------------------------------
+
+    def _column_for(self, i):
+        return haversine_matrix(
+            self._calls.lat, self._calls.lng, self._units.lat[i:i + 1], self._units.lng[i:i + 1]
+        )[:, 0]
+
+    def _row_for(self, i):
+        return haversine_matrix(
+            self._calls.lat[i:i + 1], self._calls.lng[i:i + 1], self._units.lat, self._units.lng
+        )[0]
+
+    def update_unit(self, pk: int, status: str, unit_type: str, latitude, longitude):
+        """Insert, move or drop a unit column depending on status and position."""
+        if not self._loaded:
+            return
+        point = coerce_point(latitude, longitude)
+        with self._lock:
+            if status != 'AVAILABLE' or point is None:
+                self.remove_unit(pk)
+                return
+            i = self._units.index.get(pk)
+            if i is None:
+                i = self._units.append(pk, point[0], point[1], unit_type)
+                self._distances = np.hstack([self._distances, self._column_for(i)[:, None]])
+            else:
+                self._units.lat[i] = np.radians(point[0])
+                self._units.lng[i] = np.radians(point[1])
+                self._units.meta[i] = unit_type
+                self._distances[:, i] = self._column_for(i)
+
+    def move_unit(self, pk: int, latitude: float, longitude: float):
+        """Recompute one column for a unit that is already in the matrix."""
+        if not self._loaded:
+            return
+        with self._lock:
+            i = self._units.index.get(pk)
+            if i is None:
+                return
+            self._units.lat[i] = np.radians(latitude)
+            self._units.lng[i] = np.radians(longitude)
+            self._distances[:, i] = self._column_for(i)
+
+    def remove_unit(self, pk: int):
+        if not self._loaded:
+            return
+        with self._lock:
+            i = self._units.remove(pk)
+            if i is not None:
+                self._distances = np.delete(self._distances, i, axis=1)
+
+    def update_call(self, pk: int, status: str, priority: str, latitude, longitude):
+        """Insert, move or drop a call row depending on status and position."""
+        if not self._loaded:
+            return
+        point = coerce_point(latitude, longitude)
+        with self._lock:
+            if status != 'RECEIVED' or point is None:
+                self.remove_call(pk)
+                return
+            i = self._calls.index.get(pk)
+            if i is None:
+                i = self._calls.append(pk, point[0], point[1], priority)
+                self._distances = np.vstack([self._distances, self._row_for(i)[None, :]])
+            else:
+                self._calls.lat[i] = np.radians(point[0])
+                self._calls.lng[i] = np.radians(point[1])
+                self._calls.meta[i] = priority
+                self._distances[i, :] = self._row_for(i)
+
+    def remove_call(self, pk: int):
+        if not self._loaded:
+            return
+        with self._lock:
+            i = self._calls.remove(pk)
+            if i is not None:
+                self._distances = np.delete(self._distances, i, axis=0)
+
+    # Reads --------------------------------------------------------------
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Return copies of the current ids, metadata and distance matrix.
+
+        ``distances`` is a (calls x units) array in km.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            return {
+                'call_ids': list(self._calls.ids),
+                'call_priorities': list(self._calls.meta),
+                'ambulance_ids': list(self._units.ids),
+                'unit_types': list(self._units.meta),
+                'distances': self._distances.copy(),
+            }
+
+    def as_dict(self, decimals: int = 2) -> Dict[str, Any]:
+        """JSON-ready view of the matrix with distances and straight-line ETAs."""
+        snap = self.snapshot()
+        distances = snap['distances']
+        return {
+            'emergency_call_ids': snap['call_ids'],
+            'ambulance_ids': snap['ambulance_ids'],
+            'distance_km': np.round(distances, decimals).tolist(),
+            'eta_minutes': np.round(distances / self.speed_kmh * 60.0, 1).tolist(),
+        }
+
+
+fleet_matrix = FleetDistanceMatrix()
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispatch', '0003_alter_ambulance_current_latitude_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AmbulanceLocationBlock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour_start', models.DateTimeField()),
+                ('point_count', models.PositiveIntegerField(default=0)),
+                ('data', models.BinaryField(default=bytes)),
+                ('ambulance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='location_blocks', to='dispatch.ambulance')),
+            ],
+            options={
+                'verbose_name': 'Ambulance Location Block',
+                'verbose_name_plural': 'Ambulance Location Blocks',
+                'ordering': ['ambulance', 'hour_start'],
+                'unique_together': {('ambulance', 'hour_start')},
+            },
+        ),
+    ]
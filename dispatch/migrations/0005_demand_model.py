@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dispatch', '0004_ambulancelocationblock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DemandModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('south', models.FloatField()),
+                ('west', models.FloatField()),
+                ('north', models.FloatField()),
+                ('east', models.FloatField()),
+                ('cell_degrees', models.FloatField()),
+                ('rows', models.PositiveIntegerField()),
+                ('cols', models.PositiveIntegerField()),
+                ('last_call_id', models.BigIntegerField(default=0)),
+                ('first_call_at', models.DateTimeField(blank=True, null=True)),
+                ('last_call_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Demand Model',
+                'verbose_name_plural': 'Demand Models',
+            },
+        ),
+        migrations.CreateModel(
+            name='DemandGrid',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour_of_week', models.PositiveSmallIntegerField()),
+                ('call_count', models.PositiveIntegerField(default=0)),
+                ('counts', models.BinaryField(default=bytes)),
+                ('density', models.BinaryField(default=bytes)),
+                ('model', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='grids', to='dispatch.demandmodel')),
+            ],
+            options={
+                'verbose_name': 'Demand Grid',
+                'verbose_name_plural': 'Demand Grids',
+                'ordering': ['model', 'hour_of_week'],
+                'unique_together': {('model', 'hour_of_week')},
+            },
+        ),
+    ]
@@ -72,7 +72,7 @@ class Ambulance(models.Model):
         self.current_longitude = round(float(longitude), 6)
         from django.utils import timezone
         self.last_location_update = timezone.now()
-        self.save()
+        self.save(update_fields=['current_latitude', 'current_longitude', 'last_location_update', 'updated_at'])
     
     def assign_to_emergency(self, emergency_call, paramedic=None):
         """Assign this ambulance to an emergency call"""
@@ -125,3 +125,74 @@ class Hospital(models.Model):
     @property
     def location(self):
         return (float(self.latitude), float(self.longitude))
+
+
+class AmbulanceLocationBlock(models.Model):
+    """One hour of an ambulance's GPS track in packed form.
+
+    ``data`` holds consecutive (offset_seconds, lat_microdeg, lng_microdeg)
+    int32 triples, little-endian; see ``dispatch.history`` for the codec.
+    """
+
+    ambulance = models.ForeignKey(Ambulance, on_delete=models.CASCADE, related_name='location_blocks')
+    hour_start = models.DateTimeField()
+    point_count = models.PositiveIntegerField(default=0)
+    data = models.BinaryField(default=bytes)
+
+    class Meta:
+        ordering = ['ambulance', 'hour_start']
+        unique_together = [('ambulance', 'hour_start')]
+        verbose_name = 'Ambulance Location Block'
+        verbose_name_plural = 'Ambulance Location Blocks'
+
+    def __str__(self):
+        return f"Unit {self.ambulance_id} track @ {self.hour_start:%Y-%m-%d %H:00} ({self.point_count} pts)"
+
+
+class DemandModel(models.Model):
+    """Grid definition and build watermark for the hour-of-week demand forecast.
+
+    There is a single row; see ``dispatch.forecasting``.
+    """
+
+    south = models.FloatField()
+    west = models.FloatField()
+    north = models.FloatField()
+    east = models.FloatField()
+    cell_degrees = models.FloatField()
+    rows = models.PositiveIntegerField()
+    cols = models.PositiveIntegerField()
+    last_call_id = models.BigIntegerField(default=0)
+    first_call_at = models.DateTimeField(null=True, blank=True)
+    last_call_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Demand Model'
+        verbose_name_plural = 'Demand Models'
+
+    def __str__(self):
+        return f"Demand model {self.rows}x{self.cols} (calls up to #{self.last_call_id})"
+
+
+class DemandGrid(models.Model):
+    """Call counts and smoothed density for one hour of the week.
+
+    ``counts`` and ``density`` are row-major little-endian float32 arrays of
+    ``rows * cols`` cells.
+    """
+
+    model = models.ForeignKey(DemandModel, on_delete=models.CASCADE, related_name='grids')
+    hour_of_week = models.PositiveSmallIntegerField()
+    call_count = models.PositiveIntegerField(default=0)
+    counts = models.BinaryField(default=bytes)
+    density = models.BinaryField(default=bytes)
+
+    class Meta:
+        ordering = ['model', 'hour_of_week']
+        unique_together = [('model', 'hour_of_week')]
+        verbose_name = 'Demand Grid'
+        verbose_name_plural = 'Demand Grids'
+
+    def __str__(self):
+        return f"Demand grid h{self.hour_of_week} ({self.call_count} calls)"
@@ -0,0 +1,484 @@
+"""
+Offline road-network travel-time engine.
+
+Loads a road network exported as GeoJSON (``LineString`` /
+``MultiLineString`` features with OSM-style ``highway``, ``maxspeed`` and
+``oneway`` properties) from ``ROAD_NETWORK_PATH`` into a compact
+compressed-sparse-row graph whose edge weights are travel times in seconds.
+At load time a handful of landmarks are chosen and their shortest-path
+distances precomputed, so queries run as landmark A* (ALT), and recent
+origin/destination pairs are memoized. One-to-many queries (several units to
+one call, one call to several hospitals) share a single Dijkstra search.
+
+Loading a large network takes seconds, so it happens on a background thread
+started from ``DispatchConfig.ready()``; until it finishes every query uses
+the straight-line estimate.
+
+OSM PBF extracts need converting first, e.g.
+``osmium export extract.osm.pbf -o roads.geojson``.
+
+When no network is configured or a point cannot be routed,
+``travel_time_minutes`` falls back to the straight-line estimate so callers
+never have to special-case the engine.
+"""
+import heapq
+import json
+import logging
+import math
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from core.geo import eta_minutes, haversine_km
+
+logger = logging.getLogger(__name__)
+
+# Default speeds in km/h per OSM highway class
+HIGHWAY_SPEEDS_KMH = {
+    'motorway': 90, 'motorway_link': 60,
+    'trunk': 70, 'trunk_link': 50,
+    'primary': 50, 'primary_link': 40,
+    'secondary': 45, 'secondary_link': 35,
+    'tertiary': 40, 'tertiary_link': 30,
+    'unclassified': 30, 'residential': 25,
+    'living_street': 10, 'service': 15, 'track': 15,
+}
+DEFAULT_SPEED_KMH = 30
+
+NODE_PRECISION = 6          # decimal places used to merge shared vertices
+SNAP_CELL_DEGREES = 0.005   # grid cell for nearest-node lookup
+MAX_SNAP_KM = 2.0           # points further than this from any road are not routed
+LANDMARK_COUNT = 8
+CACHE_SIZE = 4096
+# A search gives up past this multiple of the straight-line time at
+# DEFAULT_SPEED_KMH (plus a floor for short trips), so unreachable targets
+# don't expand the whole graph; ROAD_ROUTE_MAX_SECONDS caps it
+DETOUR_FACTOR = 3.0
+DETOUR_FLOOR_SECONDS = 600.0
+DEFAULT_MAX_ROUTE_SECONDS = 3 * 3600
+
+
+def _parse_speed(value) -> Optional[float]:
+    if value is None:
+        return None
+    try:
+        text = str(value).split(';')[0].strip().lower()
+        if text.endswith('mph'):
+            return float(text[:-3].strip()) * 1.609
+        return float(text.replace('km/h', '').strip())
+    except ValueError:
+        return None
+
+
+class RoadNetwork:
+    """Directed road graph in CSR form with ALT landmark tables."""
+
+    def __init__(self):
+        self.lat = array('d')
+        self.lng = array('d')
+        self.offsets = array('l', [0])
+        self.targets = array('l')
+        self.weights = array('f')
+        self.rev_offsets = array('l', [0])
+        self.rev_targets = array('l')
+        self.rev_weights = array('f')
+        self.landmarks: List[int] = []
+        self._from_landmark: List[array] = []
+        self._to_landmark: List[array] = []
+        self._grid: Dict[Tuple[int, int], List[int]] = {}
+
+    def __len__(self):
+        return len(self.lat)
+
+    @classmethod
+    def from_geojson(cls, path) -> 'RoadNetwork':
+        with open(path, 'r', encoding='utf-8') as fh:
+            collection = json.load(fh)
+
+        node_ids: Dict[Tuple[float, float], int] = {}
+        lat: List[float] = []
+        lng: List[float] = []
+        edges: Dict[Tuple[int, int], float] = {}
+
+        def node_for(coord):
+            key = (round(coord[1], NODE_PRECISION), round(coord[0], NODE_PRECISION))
+            pk = node_ids.get(key)
+            if pk is None:
+                pk = node_ids[key] = len(lat)
+                lat.append(key[0])
+                lng.append(key[1])
+            return pk
+
+        def add_edge(a, b, seconds):
+            if a != b and seconds < edges.get((a, b), math.inf):
+                edges[(a, b)] = seconds
+
+        for feature in collection.get('features', []):
+            geometry = feature.get('geometry') or {}
+            props = feature.get('properties') or {}
+            if geometry.get('type') == 'LineString':
+                lines = [geometry.get('coordinates', [])]
+            elif geometry.get('type') == 'MultiLineString':
+                lines = geometry.get('coordinates', [])
+            else:
+                continue
+
+            speed = _parse_speed(props.get('maxspeed')) or HIGHWAY_SPEEDS_KMH.get(
+                props.get('highway'), DEFAULT_SPEED_KMH
+            )
+            oneway = str(props.get('oneway', 'no')).lower()
+            forward = oneway != '-1'
+            backward = oneway not in ('yes', 'true', '1') or oneway == '-1'
+
+            for line in lines:
+                for start, end in zip(line, line[1:]):
+                    a, b = node_for(start), node_for(end)
+                    seconds = haversine_km(lat[a], lng[a], lat[b], lng[b]) / speed * 3600.0
+                    if forward:
+                        add_edge(a, b, seconds)
+                    if backward:
+                        add_edge(b, a, seconds)
+
+        network = cls()
+        network.lat = array('d', lat)
+        network.lng = array('d', lng)
+        network._build_csr(edges)
+        network._build_grid()
+        network._build_landmarks()
+        return network
+
+    def _build_csr(self, edges):
+        n = len(self.lat)
+        forward = [[] for _ in range(n)]
+        backward = [[] for _ in range(n)]
+        for (a, b), seconds in edges.items():
+            forward[a].append((b, seconds))
+            backward[b].append((a, seconds))
+
+        for adjacency, offsets, targets, weights in (
+            (forward, self.offsets, self.targets, self.weights),
+            (backward, self.rev_offsets, self.rev_targets, self.rev_weights),
+        ):
+            for neighbours in adjacency:
+                for target, seconds in neighbours:
+                    targets.append(target)
+                    weights.append(seconds)
+                offsets.append(len(targets))
+
+    def _build_grid(self):
+        for pk in range(len(self.lat)):
+            cell = (math.floor(self.lat[pk] / SNAP_CELL_DEGREES), math.floor(self.lng[pk] / SNAP_CELL_DEGREES))
+            self._grid.setdefault(cell, []).append(pk)
+
+    def _dijkstra_all(self, source: int, reverse: bool = False) -> array:
+        offsets, targets, weights = (
+            (self.rev_offsets, self.rev_targets, self.rev_weights) if reverse
+            else (self.offsets, self.targets, self.weights)
+        )
+        dist = array('d', [math.inf]) * len(self.lat)
+        dist[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            for e in range(offsets[u], offsets[u + 1]):
+                v = targets[e]
+                nd = d + weights[e]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        return dist
+
+    def _build_landmarks(self, count: int = LANDMARK_COUNT):
+        """Pick landmarks by farthest-point selection and precompute their tables."""
+        if not len(self.lat):
+            return
+        candidate = 0
+        for _ in range(min(count, len(self.lat))):
+            from_l = self._dijkstra_all(candidate)
+            to_l = self._dijkstra_all(candidate, reverse=True)
+            self.landmarks.append(candidate)
+            self._from_landmark.append(from_l)
+            self._to_landmark.append(to_l)
+            # Next landmark: the reachable node furthest from all chosen so far
+            best, best_d = None, -1.0
+            for pk in range(len(self.lat)):
+                d = min(t[pk] for t in self._from_landmark)
+                if d != math.inf and d > best_d and pk not in self.landmarks:
+                    best, best_d = pk, d
+            if best is None:
+                break
+            candidate = best
+
+    def _heuristic(self, v: int, t: int) -> float:
+        h = 0.0
+        for from_l, to_l in zip(self._from_landmark, self._to_landmark):
+            # Triangle inequality on forward and backward landmark distances
+            a = from_l[t] - from_l[v]
+            b = to_l[v] - to_l[t]
+            if a > h and a != math.inf:
+                h = a
+            if b > h and b != math.inf:
+                h = b
+        return h
+
+    def nearest_node(self, latitude: float, longitude: float) -> Optional[int]:
+        ci = math.floor(latitude / SNAP_CELL_DEGREES)
+        cj = math.floor(longitude / SNAP_CELL_DEGREES)
+        max_ring = int(MAX_SNAP_KM / (SNAP_CELL_DEGREES * 111.0)) + 1
+        best, best_d = None, math.inf
+        for ring in range(max_ring + 1):
+            for di in range(-ring, ring + 1):
+                for dj in range(-ring, ring + 1):
+                    if max(abs(di), abs(dj)) != ring:
+                        continue
+                    for pk in self._grid.get((ci + di, cj + dj), ()):
+                        d = haversine_km(latitude, longitude, self.lat[pk], self.lng[pk])
+                        if d < best_d:
+                            best, best_d = pk, d
+            if best is not None and best_d < ring * SNAP_CELL_DEGREES * 111.0 * 0.5:
+                break
+        return best if best_d <= MAX_SNAP_KM else None
+
+    def travel_seconds(self, source: int, target: int, max_seconds: Optional[float] = None) -> Optional[float]:
+        """
+        Shortest travel time between two nodes using ALT A*, or None if it is
+        unreachable within ``search_limit``.
+        """
+        if source == target:
+            return 0.0
+        limit = self.search_limit(source, [target], max_seconds)
+        dist = {source: 0.0}
+        heap = [(self._heuristic(source, target), source)]
+        closed = set()
+        while heap:
+            estimate, u = heapq.heappop(heap)
+            if estimate > limit:
+                # Every remaining path is longer than the limit
+                return None
+            if u == target:
+                return dist[u]
+            if u in closed:
+                continue
+            closed.add(u)
+            du = dist[u]
+            for e in range(self.offsets[u], self.offsets[u + 1]):
+                v = self.targets[e]
+                nd = du + self.weights[e]
+                if nd < dist.get(v, math.inf):
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd + self._heuristic(v, target), v))
+        return None
+
+    def search_limit(self, source: int, targets, max_seconds: Optional[float] = None) -> float:
+        """Seconds after which a search from ``source`` for ``targets`` gives up."""
+        furthest = max(
+            (haversine_km(self.lat[source], self.lng[source], self.lat[t], self.lng[t]) for t in targets),
+            default=0.0,
+        )
+        limit = DETOUR_FLOOR_SECONDS + DETOUR_FACTOR * furthest / DEFAULT_SPEED_KMH * 3600.0
+        return limit if max_seconds is None else min(limit, max_seconds)
+
+    def travel_seconds_many(
+        self, source: int, targets, reverse: bool = False, max_seconds: Optional[float] = None
+    ) -> Dict[int, Optional[float]]:
+        """
+        Travel times from ``source`` to each of ``targets`` with one Dijkstra
+        search that stops once all of them are settled. With ``reverse`` the
+        search runs on the reversed graph, giving times from each target to
+        ``source`` instead. Targets not reached within ``search_limit`` are None.
+        """
+        offsets, edge_targets, weights = (
+            (self.rev_offsets, self.rev_targets, self.rev_weights) if reverse
+            else (self.offsets, self.targets, self.weights)
+        )
+        pending = set(targets)
+        result: Dict[int, Optional[float]] = dict.fromkeys(pending)
+        limit = self.search_limit(source, pending, max_seconds)
+        dist = {source: 0.0}
+        heap = [(0.0, source)]
+        closed = set()
+        while heap and pending:
+            du, u = heapq.heappop(heap)
+            if du > limit:
+                break
+            if u in closed:
+                continue
+            closed.add(u)
+            if u in pending:
+                result[u] = du
+                pending.discard(u)
+            for e in range(offsets[u], offsets[u + 1]):
+                v = edge_targets[e]
+                nd = du + weights[e]
+                if nd < dist.get(v, math.inf):
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        return result
+
+
+class RoutingEngine:
+    """Road network loaded in the background, with a memoized origin/destination cache."""
+
+    def __init__(self, path=None, cache_size: int = CACHE_SIZE):
+        self._path = path
+        self._lock = threading.Lock()
+        self._network: Optional[RoadNetwork] = None
+        self._loaded = False
+        self._loading = False
+        self._cache: 'OrderedDict[Tuple[int, int], Optional[float]]' = OrderedDict()
+        self._cache_size = cache_size
+
+    @property
+    def path(self):
+        return self._path if self._path is not None else getattr(settings, 'ROAD_NETWORK_PATH', None)
+
+    @property
+    def max_seconds(self) -> float:
+        return float(getattr(settings, 'ROAD_ROUTE_MAX_SECONDS', DEFAULT_MAX_ROUTE_SECONDS))
+
+    @property
+    def ready(self) -> bool:
+        return self._loaded
+
+    @property
+    def network(self) -> Optional[RoadNetwork]:
+        """The loaded network, or None while it is still loading (or not configured)."""
+        if not self._loaded:
+            self.warm()
+        return self._network
+
+    def warm(self):
+        """Start loading the network on a background thread (once)."""
+        with self._lock:
+            if self._loaded or self._loading:
+                return
+            if not self.path:
+                self._loaded = True
+                return
+            self._loading = True
+        threading.Thread(target=self._load_in_background, name='road-network-loader', daemon=True).start()
+
+    def _load_in_background(self):
+        network = self._load()
+        with self._lock:
+            self._network = network
+            self._loaded = True
+            self._loading = False
+
+    def _load(self) -> Optional[RoadNetwork]:
+        path = self.path
+        if not path:
+            return None
+        try:
+            network = RoadNetwork.from_geojson(path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to load road network from {path}: {e}")
+            return None
+        logger.info(f"Loaded road network from {path}: {len(network)} nodes, {len(network.targets)} edges")
+        return network
+
+    def reload(self):
+        """Drop the network and load it again in the background."""
+        with self._lock:
+            if self._loading:
+                return
+            self._loaded = False
+            self._network = None
+            self._cache.clear()
+        self.warm()
+
+    def route_seconds(self, lat1: float, lng1: float, lat2: float, lng2: float) -> Optional[float]:
+        """Road travel time in seconds, or None when it cannot be routed."""
+        network = self.network
+        if network is None:
+            return None
+        source = network.nearest_node(lat1, lng1)
+        target = network.nearest_node(lat2, lng2)
+        if source is None or target is None:
+            return None
+
+        key = (source, target)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        seconds = network.travel_seconds(source, target, self.max_seconds)
+        with self._lock:
+            self._cache[key] = seconds
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return seconds
+
+    def route_seconds_many(
+        self, latitude: float, longitude: float, points, to_point: bool = False
+    ) -> List[Optional[float]]:
+        """
+        Road travel times in seconds between one point and each of ``points``
+        ((lat, lng) pairs), None where a pair cannot be routed. Times run from
+        the point to each of ``points``, or from each of them to the point
+        with ``to_point``. Uncached pairs share one search.
+        """
+        network = self.network
+        if network is None:
+            return [None] * len(points)
+        anchor = network.nearest_node(latitude, longitude)
+        if anchor is None:
+            return [None] * len(points)
+
+        nodes = [network.nearest_node(lat, lng) for lat, lng in points]
+        seconds: Dict[int, Optional[float]] = {}
+        with self._lock:
+            for node in nodes:
+                key = (node, anchor) if to_point else (anchor, node)
+                if node is not None and key in self._cache:
+                    self._cache.move_to_end(key)
+                    seconds[node] = self._cache[key]
+
+        missing = {node for node in nodes if node is not None and node not in seconds}
+        if missing:
+            found = network.travel_seconds_many(anchor, missing, reverse=to_point, max_seconds=self.max_seconds)
+            seconds.update(found)
+            with self._lock:
+                for node, value in found.items():
+                    self._cache[(node, anchor) if to_point else (anchor, node)] = value
+                while len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+        return [None if node is None else seconds[node] for node in nodes]
+
+
+routing_engine = RoutingEngine()
+
+
+def travel_time_minutes(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """
+    Estimated travel time in minutes between two points.
+
+    Uses the road network when one is configured and both points can be
+    snapped to it, otherwise the straight-line estimate.
+    """
+    seconds = routing_engine.route_seconds(lat1, lng1, lat2, lng2)
+    if seconds is None:
+        return eta_minutes(haversine_km(lat1, lng1, lat2, lng2))
+    return seconds / 60.0
+
+
+def travel_times_minutes(
+    latitude: float, longitude: float, points, to_point: bool = False
+) -> List[float]:
+    """
+    ``travel_time_minutes`` between one point and each of ``points`` with a
+    single road search: from the point to each of them, or from each of
+    them to the point with ``to_point``.
+    """
+    points = list(points)
+    seconds = routing_engine.route_seconds_many(latitude, longitude, points, to_point=to_point)
+    return [
+        eta_minutes(haversine_km(latitude, longitude, lat, lng)) if value is None else value / 60.0
+        for (lat, lng), value in zip(points, seconds)
+    ]
@@ -22,6 +22,18 @@ class AmbulanceSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['created_at', 'updated_at', 'last_location_update']
 
+    def to_representation(self, instance):
+        # Serve the freshest GPS fix even before it has been flushed to the DB;
+        # only the output changes, so a later save() of the instance is unaffected
+        from .live_positions import live_positions
+        data = super().to_representation(instance)
+        fix = live_positions.newer_than(instance)
+        if fix is not None:
+            data['current_latitude'] = self.fields['current_latitude'].to_representation(fix.latitude)
+            data['current_longitude'] = self.fields['current_longitude'].to_representation(fix.longitude)
+            data['last_location_update'] = self.fields['last_location_update'].to_representation(fix.timestamp)
+        return data
+
 
 class AmbulanceLocationUpdateSerializer(serializers.ModelSerializer):
     """Serializer for updating ambulance location"""
@@ -44,6 +56,30 @@ class AmbulanceLocationUpdateSerializer(serializers.ModelSerializer):
         return data
 
 
+class LocationFixSerializer(serializers.Serializer):
+    """A single timestamped GPS fix within a batch upload"""
+
+    ambulance_id = serializers.IntegerField()
+    latitude = serializers.FloatField(min_value=-90, max_value=90)
+    longitude = serializers.FloatField(min_value=-180, max_value=180)
+    timestamp = serializers.DateTimeField()
+
+    def validate_timestamp(self, value):
+        """Reject fixes stamped in the future (allowing small clock skew)"""
+        from datetime import timedelta
+        from django.utils import timezone
+
+        if value > timezone.now() + timedelta(minutes=1):
+            raise serializers.ValidationError("Timestamp is in the future")
+        return value
+
+
+class LocationBatchSerializer(serializers.Serializer):
+    """Serializer for batched GPS uploads covering one or more units"""
+
+    fixes = LocationFixSerializer(many=True, allow_empty=False, max_length=1000)
+
+
 class HospitalSerializer(serializers.ModelSerializer):
     """Serializer for Hospital model"""
     
@@ -109,3 +145,120 @@ class DispatchSerializer(serializers.Serializer):
             except Hospital.DoesNotExist:
                 raise serializers.ValidationError("Hospital not found")
         return value
+
+
+class PlanAssignmentSerializer(serializers.Serializer):
+    """One call/unit pair of an assignment plan"""
+
+    emergency_call_id = serializers.IntegerField()
+    ambulance_id = serializers.IntegerField()
+
+
+class ApplyPlanSerializer(serializers.Serializer):
+    """Serializer for applying a batch assignment plan in one transaction"""
+
+    assignments = PlanAssignmentSerializer(many=True, allow_empty=False, max_length=500)
+
+    def validate_assignments(self, value):
+        """Each call and each unit may appear only once in a plan"""
+        call_ids = [a['emergency_call_id'] for a in value]
+        ambulance_ids = [a['ambulance_id'] for a in value]
+        if len(set(call_ids)) != len(call_ids):
+            raise serializers.ValidationError("An emergency call appears more than once")
+        if len(set(ambulance_ids)) != len(ambulance_ids):
+            raise serializers.ValidationError("An ambulance appears more than once")
+        return value
+
+
+class CallLocationQuerySerializer(serializers.Serializer):
+    """Query point given either as an emergency call or explicit coordinates"""
+
+    emergency_call_id = serializers.IntegerField(required=False)
+    latitude = serializers.FloatField(required=False, min_value=-90, max_value=90)
+    longitude = serializers.FloatField(required=False, min_value=-180, max_value=180)
+
+    def validate(self, data):
+        """Resolve the query point from an emergency call or explicit coordinates"""
+        call_id = data.get('emergency_call_id')
+        if call_id is not None:
+            from emergencies.models import EmergencyCall
+            try:
+                call = EmergencyCall.objects.only('latitude', 'longitude', 'emergency_type').get(id=call_id)
+            except EmergencyCall.DoesNotExist:
+                raise serializers.ValidationError({'emergency_call_id': 'Emergency call not found'})
+            if call.latitude is None or call.longitude is None:
+                raise serializers.ValidationError({'emergency_call_id': 'Emergency call has no location'})
+            data['latitude'] = float(call.latitude)
+            data['longitude'] = float(call.longitude)
+            data.setdefault('emergency_type', call.emergency_type)
+        elif data.get('latitude') is None or data.get('longitude') is None:
+            raise serializers.ValidationError("Provide emergency_call_id or latitude and longitude")
+        return data
+
+
+class NearestAmbulanceQuerySerializer(CallLocationQuerySerializer):
+    """Query parameters for nearest-available-ambulance recommendations"""
+
+    unit_type = serializers.CharField(required=False)
+    k = serializers.IntegerField(required=False, default=5, min_value=1, max_value=50)
+    max_distance_km = serializers.FloatField(required=False, min_value=0)
+
+    def validate_unit_type(self, value):
+        """Accept a comma-separated list of unit types"""
+        valid = {choice for choice, _ in Ambulance.UNIT_TYPE_CHOICES}
+        unit_types = [v.strip().upper() for v in value.split(',') if v.strip()]
+        invalid = [v for v in unit_types if v not in valid]
+        if invalid:
+            raise serializers.ValidationError(f"Unknown unit type(s): {', '.join(invalid)}")
+        return unit_types
+
+
+class HospitalRankingQuerySerializer(CallLocationQuerySerializer):
+    """Query parameters for hospital destination ranking"""
+
+    emergency_type = serializers.CharField(required=False)
+    limit = serializers.IntegerField(required=False, default=5, min_value=1, max_value=50)
+    include_full = serializers.BooleanField(required=False, default=False)
+
+    def validate_emergency_type(self, value):
+        from emergencies.models import EmergencyCall
+        value = value.strip().upper()
+        if value not in {choice for choice, _ in EmergencyCall.EMERGENCY_TYPE_CHOICES}:
+            raise serializers.ValidationError("Unknown emergency type")
+        return value
+
+
+class TrackQuerySerializer(serializers.Serializer):
+    """Query parameters for ambulance track playback"""
+
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+    tolerance_m = serializers.FloatField(required=False, default=10.0, min_value=0)
+    max_points = serializers.IntegerField(required=False, default=500, min_value=2, max_value=5000)
+
+    def validate(self, data):
+        """Default to the last 12 hours and cap the window at 7 days"""
+        from datetime import timedelta
+        from django.utils import timezone
+
+        end = data.get('end') or timezone.now()
+        start = data.get('start') or end - timedelta(hours=12)
+        if start >= end:
+            raise serializers.ValidationError("start must be before end")
+        if end - start > timedelta(days=7):
+            raise serializers.ValidationError("Time window cannot exceed 7 days")
+        data['start'] = start
+        data['end'] = end
+        return data
+
+
+class DemandQuerySerializer(serializers.Serializer):
+    """Query parameters for the hour-of-week demand forecast"""
+
+    hour_of_week = serializers.IntegerField(required=False, min_value=0, max_value=167)
+
+
+class StagingQuerySerializer(DemandQuerySerializer):
+    """Query parameters for staging position recommendations"""
+
+    count = serializers.IntegerField(required=False, min_value=1, max_value=100)
@@ -0,0 +1,79 @@
+"""
+Model signal receivers that keep dispatch's in-memory indexes in sync.
+"""
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from core.coalescing import location_coalescer
+from emergencies.models import EmergencyCall
+
+from .coverage import coverage_map
+from .hospitals import hospital_index
+from .live_positions import live_positions
+from .matrix import fleet_matrix
+from .models import Ambulance, Hospital
+from .spatial import ambulance_index
+from .utils import serialize_ambulances
+
+# GPS fixes recorded through the write-behind store bypass model saves
+live_positions.add_listener(ambulance_index.move)
+live_positions.add_listener(fleet_matrix.move_unit)
+live_positions.add_listener(coverage_map.move_unit)
+# Positions streamed by id are serialized in one query per location tick
+location_coalescer.set_loader(serialize_ambulances)
+
+
+@receiver(pre_save, sender=Ambulance)
+def apply_live_position(sender, instance, **kwargs):
+    """Never let a full save overwrite a newer fix held in the live store."""
+    if instance.pk is not None:
+        live_positions.apply(instance)
+
+
+@receiver(post_save, sender=Ambulance)
+def sync_ambulance_index(sender, instance, **kwargs):
+    """Re-index an ambulance whenever its status or position is saved."""
+    ambulance_index.update_from_instance(instance)
+    fleet_matrix.update_unit(
+        instance.pk, instance.status, instance.unit_type,
+        instance.current_latitude, instance.current_longitude,
+    )
+    coverage_map.update_unit(
+        instance.pk, instance.status,
+        instance.current_latitude, instance.current_longitude,
+    )
+
+
+@receiver(post_delete, sender=Ambulance)
+def drop_ambulance_from_index(sender, instance, **kwargs):
+    ambulance_index.remove(instance.pk)
+    fleet_matrix.remove_unit(instance.pk)
+    coverage_map.remove_unit(instance.pk)
+    live_positions.forget(instance.pk)
+
+
+@receiver(post_save, sender=EmergencyCall)
+def sync_call_matrix(sender, instance, **kwargs):
+    """Add, move or drop a pending call row in the distance matrix."""
+    fleet_matrix.update_call(
+        instance.pk, instance.status, instance.priority,
+        instance.latitude, instance.longitude,
+    )
+    if kwargs.get('created'):
+        coverage_map.record_call(instance.latitude, instance.longitude, instance.pk)
+
+
+@receiver(post_delete, sender=EmergencyCall)
+def drop_call_from_matrix(sender, instance, **kwargs):
+    fleet_matrix.remove_call(instance.pk)
+
+
+@receiver(post_save, sender=Hospital)
+def sync_hospital_index(sender, instance, **kwargs):
+    """Re-parse specialties and capacity of a saved hospital for ranking."""
+    hospital_index.update(instance)
+
+
+@receiver(post_delete, sender=Hospital)
+def drop_hospital_from_index(sender, instance, **kwargs):
+    hospital_index.remove(instance.pk)
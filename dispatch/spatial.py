@@ -0,0 +1,250 @@
+"""
+In-memory spatial index of available ambulances.
+
+Units are bucketed into a fixed-size lat/lng grid, one grid per unit type,
+so a nearest-unit query only inspects the cells around the call instead of
+scanning the whole fleet. The index is loaded lazily from the database on
+first use and kept current by the ``dispatch.signals`` receivers.
+
+Each worker process keeps its own copy; it is rebuilt from the database on
+first use after ``invalidate()``.
+"""
+import heapq
+import math
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from core.geo import coerce_point, haversine_km
+
+# Grid cell edge in degrees (~2.2 km at the equator)
+DEFAULT_CELL_DEGREES = 0.02
+
+KM_PER_DEGREE = 111.195
+
+Cell = Tuple[int, int]
+
+
+class AmbulanceSpatialIndex:
+    """Grid index of AVAILABLE ambulances keyed by unit type."""
+
+    def __init__(self, cell_degrees: float = DEFAULT_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self._lock = threading.RLock()
+        self._loaded = False
+        # unit_type -> cell -> set of ambulance ids
+        self._grids: Dict[str, Dict[Cell, Set[int]]] = {}
+        # ambulance id -> (lat, lng, unit_type, cell)
+        self._units: Dict[int, Tuple[float, float, str, Cell]] = {}
+        # unit_type -> number of indexed units
+        self._counts: Dict[str, int] = {}
+        # unit_type -> (min_i, max_i, min_j, max_j) of its populated cells;
+        # dropped when a removal may shrink it and recomputed on next query
+        self._bounds: Dict[str, Tuple[int, int, int, int]] = {}
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._units)
+
+    def _cell_for(self, lat: float, lng: float) -> Cell:
+        return (math.floor(lat / self.cell_degrees), math.floor(lng / self.cell_degrees))
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if not self._loaded:
+                self.rebuild()
+
+    def rebuild(self):
+        """Reload all AVAILABLE units with a known position from the database."""
+        from .models import Ambulance
+
+        rows = Ambulance.objects.filter(
+            status='AVAILABLE',
+            current_latitude__isnull=False,
+            current_longitude__isnull=False,
+        ).values_list('id', 'unit_type', 'current_latitude', 'current_longitude')
+
+        with self._lock:
+            self._grids = {}
+            self._units = {}
+            self._counts = {}
+            self._bounds = {}
+            for pk, unit_type, lat, lng in rows:
+                self._insert(pk, unit_type, float(lat), float(lng))
+            self._loaded = True
+
+    def invalidate(self):
+        """Drop the index; it is rebuilt from the database on next use."""
+        with self._lock:
+            self._grids = {}
+            self._units = {}
+            self._counts = {}
+            self._bounds = {}
+            self._loaded = False
+
+    def _insert(self, pk: int, unit_type: str, lat: float, lng: float):
+        cell = self._cell_for(lat, lng)
+        self._grids.setdefault(unit_type, {}).setdefault(cell, set()).add(pk)
+        self._units[pk] = (lat, lng, unit_type, cell)
+        self._counts[unit_type] = self._counts.get(unit_type, 0) + 1
+        bounds = self._bounds.get(unit_type)
+        if bounds is not None:
+            min_i, max_i, min_j, max_j = bounds
+            self._bounds[unit_type] = (
+                min(min_i, cell[0]), max(max_i, cell[0]),
+                min(min_j, cell[1]), max(max_j, cell[1]),
+            )
+
+    def _remove(self, pk: int):
+        entry = self._units.pop(pk, None)
+        if entry is None:
+            return
+        _, _, unit_type, cell = entry
+        self._counts[unit_type] -= 1
+        grid = self._grids.get(unit_type, {})
+        bucket = grid.get(cell)
+        if bucket is not None:
+            bucket.discard(pk)
+            if not bucket:
+                del grid[cell]
+                bounds = self._bounds.get(unit_type)
+                if bounds is not None and (cell[0] in bounds[:2] or cell[1] in bounds[2:]):
+                    # The cell was on the edge; the extent may have shrunk
+                    del self._bounds[unit_type]
+
+    def _bounds_for(self, unit_type: str) -> Optional[Tuple[int, int, int, int]]:
+        """Extent of the populated cells of a unit type (lock held)."""
+        bounds = self._bounds.get(unit_type)
+        if bounds is None:
+            cells = self._grids.get(unit_type)
+            if not cells:
+                return None
+            bounds = self._bounds[unit_type] = (
+                min(i for i, _ in cells), max(i for i, _ in cells),
+                min(j for _, j in cells), max(j for _, j in cells),
+            )
+        return bounds
+
+    def update(self, pk: int, status: str, unit_type: str, latitude, longitude):
+        """
+        Insert, move or drop a unit depending on its status and position.
+
+        Only AVAILABLE units with a valid position are kept in the index.
+        """
+        if not self._loaded:
+            # Nothing to keep in sync yet; first query loads the full fleet
+            return
+        point = coerce_point(latitude, longitude)
+        with self._lock:
+            self._remove(pk)
+            if status == 'AVAILABLE' and point is not None:
+                self._insert(pk, unit_type, point[0], point[1])
+
+    def update_from_instance(self, ambulance):
+        """Sync the index with a saved ``Ambulance`` instance."""
+        self.update(
+            ambulance.pk,
+            ambulance.status,
+            ambulance.unit_type,
+            ambulance.current_latitude,
+            ambulance.current_longitude,
+        )
+
+    def move(self, pk: int, latitude: float, longitude: float):
+        """Relocate a unit that is already indexed; other units are ignored."""
+        with self._lock:
+            entry = self._units.get(pk)
+            if entry is None:
+                return
+            unit_type = entry[2]
+            self._remove(pk)
+            self._insert(pk, unit_type, latitude, longitude)
+
+    def remove(self, pk: int):
+        with self._lock:
+            self._remove(pk)
+
+    def nearest(
+        self,
+        latitude: float,
+        longitude: float,
+        k: int = 5,
+        unit_types: Optional[Iterable[str]] = None,
+        max_distance_km: Optional[float] = None,
+    ) -> List[Tuple[int, float]]:
+        """
+        Return up to ``k`` (ambulance_id, distance_km) pairs nearest to a point.
+
+        Args:
+            latitude, longitude: Query point in decimal degrees
+            k: Maximum number of units to return
+            unit_types: Restrict to these unit types (all types when None)
+            max_distance_km: Optional search radius
+        """
+        self._ensure_loaded()
+        if k <= 0:
+            return []
+
+        with self._lock:
+            types = [
+                unit_type for unit_type, grid in self._grids.items()
+                if grid and (unit_types is None or unit_type in unit_types)
+            ]
+            if not types:
+                return []
+            grids = [self._grids[unit_type] for unit_type in types]
+            # Units that can match; the search stops once all were seen
+            remaining = sum(self._counts[unit_type] for unit_type in types)
+
+            ci, cj = self._cell_for(latitude, longitude)
+            # Furthest ring that can still contain a populated cell of these types
+            max_ring = 0
+            for unit_type in types:
+                min_i, max_i, min_j, max_j = self._bounds_for(unit_type)
+                max_ring = max(max_ring, abs(min_i - ci), abs(max_i - ci), abs(min_j - cj), abs(max_j - cj))
+
+            # Lower bound on distance covered by one ring, using the
+            # narrowest longitude spacing reachable within the search
+            lat_extent = min(89.9, abs(latitude) + (max_ring + 1) * self.cell_degrees)
+            ring_km = self.cell_degrees * KM_PER_DEGREE * math.cos(math.radians(lat_extent))
+
+            best: List[Tuple[float, int]] = []  # max-heap via negated distance
+            for ring in range(max_ring + 1):
+                if remaining <= 0:
+                    break
+                if len(best) >= k and (ring - 1) * ring_km > -best[0][0]:
+                    break
+                if max_distance_km is not None and (ring - 1) * ring_km > max_distance_km:
+                    break
+                for cell in self._ring_cells(ci, cj, ring):
+                    for grid in grids:
+                        for pk in grid.get(cell, ()):
+                            remaining -= 1
+                            lat, lng, _, _ = self._units[pk]
+                            dist = haversine_km(latitude, longitude, lat, lng)
+                            if max_distance_km is not None and dist > max_distance_km:
+                                continue
+                            if len(best) < k:
+                                heapq.heappush(best, (-dist, pk))
+                            elif dist < -best[0][0]:
+                                heapq.heapreplace(best, (-dist, pk))
+
+        return sorted(((pk, -neg) for neg, pk in best), key=lambda item: item[1])
+
+    @staticmethod
+    def _ring_cells(ci: int, cj: int, ring: int):
+        """Yield the cells at Chebyshev distance ``ring`` from (ci, cj)."""
+        if ring == 0:
+            yield (ci, cj)
+            return
+        for dj in range(-ring, ring + 1):
+            yield (ci - ring, cj + dj)
+            yield (ci + ring, cj + dj)
+        for di in range(-ring + 1, ring):
+            yield (ci + di, cj - ring)
+            yield (ci + di, cj + ring)
+
+
+# Process-wide index used by views and signal receivers
+ambulance_index = AmbulanceSpatialIndex()
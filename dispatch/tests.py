@@ -1,3 +1,266 @@
-from django.test import TestCase
+import itertools
+import json
+import math
+import os
+import random
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core.models import User
+
+from core.geo import haversine_km
+
+from .assignment import linear_sum_assignment
+from .history import location_history, pack_points, simplify_track, unpack_block
+from .live_positions import LivePositionStore, live_positions
+from .matrix import np
+from .models import Ambulance
+from .routing import RoadNetwork
+from .spatial import AmbulanceSpatialIndex
+
+
+class StaleFixTests(TestCase):
+    """Fixes older than the stored position go to history only."""
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.ambulance = Ambulance.objects.create(
+            unit_number='T-1',
+            current_latitude=-1.29,
+            current_longitude=36.82,
+            last_location_update=self.now,
+        )
+
+    def tearDown(self):
+        # Write buffered track points inside the test transaction
+        location_history.flush()
+
+    def test_record_ignores_fix_older_than_stored(self):
+        store = LivePositionStore(flush_interval=3600)
+        moved = []
+        store.add_listener(lambda pk, lat, lng: moved.append(pk))
+        with mock.patch.object(store, '_ensure_flusher'):
+            result = store.record(
+                self.ambulance.pk, -1.5, 36.8, self.now - timedelta(minutes=5),
+                stored=self.ambulance.last_location_update,
+            )
+        self.assertIsNone(result)
+        self.assertIsNone(store.get(self.ambulance.pk))
+        self.assertEqual(store.pending_count(), 0)
+        self.assertEqual(moved, [])
+        points = location_history.pending_points(
+            self.ambulance.pk, self.now - timedelta(minutes=10), self.now,
+        )
+        self.assertIn(-1.5, [lat for _, lat, _ in points])
+
+    def test_record_accepts_newer_fix(self):
+        store = LivePositionStore(flush_interval=3600)
+        with mock.patch.object(store, '_ensure_flusher'):
+            fix = store.record(
+                self.ambulance.pk, -1.3, 36.83, self.now + timedelta(seconds=5),
+                stored=self.ambulance.last_location_update,
+            )
+        self.assertEqual(store.get(self.ambulance.pk), fix)
+        self.assertEqual(store.pending_count(), 1)
+
+    def test_batch_upload_does_not_roll_back_stored_position(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('disp', password='x', role='dispatcher'))
+        stale = (self.now - timedelta(minutes=5)).isoformat()
+        with mock.patch.object(live_positions, '_ensure_flusher'):
+            response = client.post('/dispatch/api/ambulances/locations/batch/', {'fixes': [
+                {'ambulance_id': self.ambulance.pk, 'latitude': -1.5, 'longitude': 36.8, 'timestamp': stale},
+            ]}, format='json')
+            live_positions.flush()
+        self.assertEqual(response.status_code, 200)
+        self.ambulance.refresh_from_db()
+        self.assertAlmostEqual(float(self.ambulance.current_latitude), -1.29)
+        self.assertEqual(self.ambulance.last_location_update, self.now)
+
+
+class AmbulanceSerializerTests(TestCase):
+    def test_live_fix_overlays_output_not_instance(self):
+        from .serializers import AmbulanceSerializer
+
+        now = timezone.now()
+        ambulance = Ambulance.objects.create(
+            unit_number='T-2', current_latitude=-1.29, current_longitude=36.82,
+            last_location_update=now - timedelta(minutes=1),
+        )
+        with mock.patch.object(live_positions, '_ensure_flusher'):
+            live_positions.record(ambulance.pk, -1.3, 36.83, now)
+        try:
+            data = AmbulanceSerializer(ambulance).data
+            self.assertEqual(data['current_latitude'], '-1.300000')
+            self.assertEqual(data['current_longitude'], '36.830000')
+            self.assertAlmostEqual(float(ambulance.current_latitude), -1.29)
+            self.assertEqual(ambulance.last_location_update, now - timedelta(minutes=1))
+        finally:
+            live_positions.forget(ambulance.pk)
+            location_history.flush()
+
+
+class SpatialIndexTests(SimpleTestCase):
+    """Ring search returns the same units as a full scan."""
+
+    def setUp(self):
+        rng = random.Random(1)
+        self.index = AmbulanceSpatialIndex()
+        self.index._loaded = True  # fed by hand instead of from the database
+        self.units = {}
+        for pk in range(1, 501):
+            unit_type = 'ADVANCED' if pk % 10 == 0 else 'BASIC'
+            lat, lng = 6.4 + rng.random() * 0.4, 3.3 + rng.random() * 0.4
+            self.units[pk] = (unit_type, lat, lng)
+            self.index.update(pk, 'AVAILABLE', unit_type, lat, lng)
+        self.queries = [(6.4 + rng.random() * 0.4, 3.3 + rng.random() * 0.4) for _ in range(25)]
+
+    def brute_force(self, lat, lng, k, unit_types=None, max_distance_km=None):
+        found = sorted(
+            (haversine_km(lat, lng, u_lat, u_lng), pk) for pk, (unit_type, u_lat, u_lng) in self.units.items()
+            if unit_types is None or unit_type in unit_types
+        )
+        if max_distance_km is not None:
+            found = [item for item in found if item[0] <= max_distance_km]
+        return [round(d, 9) for d, _ in found[:k]]
+
+    def assertMatches(self, k, unit_types=None, max_distance_km=None):
+        for lat, lng in self.queries:
+            result = self.index.nearest(lat, lng, k, unit_types, max_distance_km)
+            self.assertEqual(
+                [round(d, 9) for _, d in result],
+                self.brute_force(lat, lng, k, unit_types, max_distance_km),
+            )
+
+    def test_nearest_matches_full_scan(self):
+        self.assertMatches(5)
+        self.assertMatches(5, max_distance_km=3)
+
+    def test_filtered_query_with_fewer_matches_than_k(self):
+        self.assertMatches(80, unit_types={'ADVANCED'})
+        self.assertEqual(self.index.nearest(6.5, 3.5, 5, unit_types={'CRITICAL'}), [])
+
+    def test_removal_and_outlier(self):
+        self.units[999] = ('BASIC', 40.0, 50.0)
+        self.index.update(999, 'AVAILABLE', 'BASIC', 40.0, 50.0)
+        self.assertMatches(3)
+        for pk in [999] + list(range(1, 501, 3)):
+            del self.units[pk]
+            self.index.remove(pk)
+        self.assertMatches(3)
+        self.assertMatches(10, unit_types={'ADVANCED'})
+
+
+@skipIf(np is None, 'NumPy is not installed')
+class AssignmentTests(SimpleTestCase):
+    """The Hungarian solver finds the minimum-cost assignment."""
+
+    def brute_force(self, cost):
+        n, m = cost.shape
+        if n <= m:
+            return min(sum(cost[i, j] for i, j in zip(range(n), cols)) for cols in itertools.permutations(range(m), n))
+        return min(sum(cost[i, j] for i, j in zip(rows, range(m))) for rows in itertools.permutations(range(n), m))
+
+    def test_optimal_on_square_and_rectangular_matrices(self):
+        rng = np.random.default_rng(7)
+        with mock.patch('dispatch.assignment._scipy_linear_sum_assignment', None):
+            for shape in [(1, 1), (4, 4), (6, 6), (3, 6), (6, 3), (5, 7)]:
+                for _ in range(5):
+                    cost = rng.integers(0, 50, size=shape).astype(float)
+                    rows, cols = linear_sum_assignment(cost)
+                    self.assertEqual(len(rows), min(shape))
+                    self.assertEqual(len(set(rows)), len(rows))
+                    self.assertEqual(len(set(cols)), len(cols))
+                    self.assertAlmostEqual(cost[rows, cols].sum(), self.brute_force(cost))
+
+    def test_empty_matrix(self):
+        self.assertEqual(linear_sum_assignment(np.zeros((0, 3))), ([], []))
+
+
+class RoadNetworkTests(SimpleTestCase):
+    """Landmark A* and the one-to-many search agree with plain Dijkstra."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        rng = random.Random(3)
+        features = []
+        size = 12
+        for i in range(size):
+            for j in range(size):
+                lat, lng = 6.4 + i * 0.004, 3.3 + j * 0.004
+                if j + 1 < size:
+                    features.append({
+                        'type': 'Feature',
+                        'geometry': {'type': 'LineString', 'coordinates': [[lng, lat], [lng + 0.004, lat]]},
+                        'properties': {'highway': rng.choice(['primary', 'residential']),
+                                       'oneway': rng.choice(['no', 'no', 'yes', '-1'])},
+                    })
+                if i + 1 < size:
+                    features.append({
+                        'type': 'Feature',
+                        'geometry': {'type': 'LineString', 'coordinates': [[lng, lat], [lng, lat + 0.004]]},
+                        'properties': {'highway': 'secondary', 'maxspeed': rng.choice(['30', '50', '20 mph'])},
+                    })
+        fd, path = tempfile.mkstemp(suffix='.geojson')
+        with os.fdopen(fd, 'w') as fh:
+            json.dump({'type': 'FeatureCollection', 'features': features}, fh)
+        try:
+            cls.network = RoadNetwork.from_geojson(path)
+        finally:
+            os.remove(path)
+
+    def test_alt_matches_dijkstra(self):
+        rng = random.Random(5)
+        for source in rng.sample(range(len(self.network)), 8):
+            expected = self.network._dijkstra_all(source)
+            for target in rng.sample(range(len(self.network)), 15):
+                seconds = self.network.travel_seconds(source, target)
+                if math.isinf(expected[target]):
+                    self.assertIsNone(seconds)
+                else:
+                    self.assertAlmostEqual(seconds, expected[target], places=3)
+
+    def test_one_to_many_matches_dijkstra_both_directions(self):
+        rng = random.Random(6)
+        source = rng.randrange(len(self.network))
+        targets = rng.sample(range(len(self.network)), 20)
+        for reverse in (False, True):
+            expected = self.network._dijkstra_all(source, reverse=reverse)
+            found = self.network.travel_seconds_many(source, targets, reverse=reverse)
+            for target in targets:
+                self.assertAlmostEqual(found[target], expected[target], places=3)
+
+    def test_search_limit_reports_unreachable(self):
+        source, target = 0, len(self.network) - 1
+        self.assertIsNone(self.network.travel_seconds(source, target, max_seconds=1.0))
+        self.assertEqual(self.network.travel_seconds_many(source, [target], max_seconds=1.0), {target: None})
+
+
+class TrackHistoryTests(SimpleTestCase):
+    def test_pack_unpack_round_trip(self):
+        hour = datetime(2026, 1, 5, 10, tzinfo=dt_timezone.utc)
+        points = [(0, -1290000, 36820000), (5, -1290123, 36820456), (3599, 89999999, -179999999)]
+        self.assertEqual(len(pack_points(points)), 12 * len(points))
+        self.assertEqual(unpack_block(hour, pack_points(points)), [
+            (hour, -1.29, 36.82),
+            (hour + timedelta(seconds=5), -1.290123, 36.820456),
+            (hour + timedelta(seconds=3599), 89.999999, -179.999999),
+        ])
+
+    def test_simplify_keeps_endpoints_and_corners(self):
+        start = datetime(2026, 1, 5, 10, tzinfo=dt_timezone.utc)
+        # East along a street, then north: only the corner is significant
+        points = [(start + timedelta(seconds=i), 6.5, 3.4 + i * 0.0001) for i in range(20)]
+        points += [(start + timedelta(seconds=20 + i), 6.5 + (i + 1) * 0.0001, 3.4019) for i in range(20)]
+        simplified = simplify_track(points, tolerance_m=5)
+        self.assertEqual(simplified[0], points[0])
+        self.assertEqual(simplified[-1], points[-1])
+        self.assertIn(points[19], simplified)
+        self.assertLessEqual(len(simplified), 4)
+        self.assertEqual(simplify_track(points, tolerance_m=0), points)
@@ -9,10 +9,20 @@ urlpatterns = [
     
     # API endpoints
     path('api/ambulances/', views.AmbulanceListCreateView.as_view(), name='ambulance_list'),
+    path('api/ambulances/locations/batch/', views.batch_update_ambulance_locations, name='batch_update_ambulance_locations'),
+    path('api/ambulances/nearest/', views.nearest_ambulances, name='nearest_ambulances'),
     path('api/ambulances/<int:pk>/', views.AmbulanceDetailView.as_view(), name='ambulance_detail'),
     path('api/ambulances/<int:pk>/location/', views.update_ambulance_location, name='update_ambulance_location'),
+    path('api/ambulances/<int:pk>/track/', views.ambulance_track, name='ambulance_track'),
+    path('api/hospitals/ranking/', views.hospital_ranking, name='hospital_ranking'),
     path('api/hospitals/<int:pk>/capacity/', views.update_hospital_capacity, name='update_hospital_capacity'),
     path('api/dispatch/', views.dispatch_ambulance, name='dispatch_ambulance'),
+    path('api/dispatch/plan/', views.assignment_plan, name='assignment_plan'),
+    path('api/dispatch/plan/apply/', views.apply_assignment_plan, name='apply_assignment_plan'),
+    path('api/distance-matrix/', views.distance_matrix, name='distance_matrix'),
+    path('api/coverage/', views.coverage, name='coverage'),
+    path('api/demand/', views.demand_forecast, name='demand_forecast'),
+    path('api/staging/', views.staging_plan, name='staging_plan'),
     path('api/hospitals/', views.HospitalListCreateView.as_view(), name='hospital_list'),
     path('api/hospitals/<int:pk>/', views.HospitalDetailView.as_view(), name='hospital_detail'),
 ]
@@ -0,0 +1,159 @@
+"""
+Shared helpers for recording and broadcasting ambulance GPS fixes.
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.db import transaction
+
+from core.coalescing import location_coalescer
+from core.presence import PARAMEDIC, presence
+from core.utils import send_ambulance_notification, send_emergency_notification
+
+from .live_positions import live_positions
+
+
+def publish_location_fix(
+    ambulance,
+    latitude: float,
+    longitude: float,
+    timestamp: Optional[datetime] = None
+) -> Dict[str, Any]:
+    """
+    Record a GPS fix for an ambulance and broadcast it to dispatchers.
+
+    Used by the HTTP location endpoint and the paramedic WebSocket so both
+    go through the same write-behind store and notification.
+
+    Args:
+        ambulance: The ``Ambulance`` instance the fix belongs to
+        latitude, longitude: Validated coordinates in decimal degrees
+        timestamp: When the fix was taken (defaults to now)
+
+    Returns:
+        The serialized ambulance as broadcast
+    """
+    from .serializers import AmbulanceSerializer
+
+    live_positions.record(
+        ambulance.pk, latitude, longitude, timestamp,
+        stored=ambulance.last_location_update,
+    )
+    ambulance_data = AmbulanceSerializer(ambulance).data
+    send_ambulance_notification(
+        event='LOCATION_UPDATE',
+        ambulance_data=ambulance_data
+    )
+    return ambulance_data
+
+
+def publish_unit_location(
+    pk: int,
+    latitude: float,
+    longitude: float,
+    timestamp: Optional[datetime] = None,
+    stored: Optional[datetime] = None
+):
+    """
+    Record a GPS fix for an ambulance known by id and broadcast it.
+
+    Unlike ``publish_location_fix`` the ambulance is not read here: the
+    broadcast is coalesced and its payload loaded with the other moved units
+    at the next location tick. When fixes are not coalesced it is read and
+    sent at once.
+
+    Args:
+        pk: The ambulance id
+        latitude, longitude: Validated coordinates in decimal degrees
+        timestamp: When the fix was taken (defaults to now)
+        stored: The row's ``last_location_update``, if known
+
+    Returns:
+        The unit's current ``LiveFix`` after recording (None if it has none)
+    """
+    from .models import Ambulance
+    from .serializers import AmbulanceSerializer
+
+    fix = live_positions.record(pk, latitude, longitude, timestamp, stored=stored)
+    if not location_coalescer.offer_unit(pk):
+        ambulance = Ambulance.objects.select_related(
+            'assigned_paramedic', 'current_emergency'
+        ).get(pk=pk)
+        send_ambulance_notification(
+            event='LOCATION_UPDATE',
+            ambulance_data=AmbulanceSerializer(ambulance).data
+        )
+    return fix
+
+
+def serialize_ambulances(pks) -> List[Dict[str, Any]]:
+    """Current payloads of the given ambulances, read in one query."""
+    from .models import Ambulance
+    from .serializers import AmbulanceSerializer
+
+    ambulances = Ambulance.objects.select_related(
+        'assigned_paramedic', 'current_emergency'
+    ).filter(pk__in=list(pks))
+    return AmbulanceSerializer(ambulances, many=True).data
+
+
+def _hold_for_paramedic(paramedic_id, message: Dict[str, Any]):
+    """Hold a message for an offline paramedic, delivering it if they connected meanwhile."""
+    from core.outbox import outbox
+
+    presence.hold(PARAMEDIC, paramedic_id, message)
+    # A connection that came up before the hold was written has already
+    # collected what was held; hand this one over through the group
+    if presence.is_online(PARAMEDIC, paramedic_id):
+        for held in presence.take_held(PARAMEDIC, paramedic_id):
+            outbox.enqueue(f'paramedic_{paramedic_id}', held)
+
+
+def notify_dispatch(ambulance, emergency_call) -> Tuple[Dict[str, Any], Dict[str, Any], Optional[str]]:
+    """
+    Broadcast the events for an ambulance being dispatched to a call.
+
+    Dispatchers get UNIT_DISPATCHED for the unit and STATUS_UPDATE for the
+    call; the assigned paramedic (if any) gets UNIT_DISPATCHED for the call.
+    The paramedic's group always gets the event. If they have no live
+    connection (see ``core.presence``) it is also held and delivered when
+    they next connect; clients drop the duplicate if both arrive.
+
+    Returns:
+        (ambulance_data, emergency_data, paramedic_delivery) where
+        paramedic_delivery is 'live', 'held' or None (no paramedic)
+    """
+    from emergencies.serializers import EmergencyCallSerializer
+    from .serializers import AmbulanceSerializer
+
+    # Notify dispatchers about ambulance dispatch
+    ambulance_data = AmbulanceSerializer(ambulance).data
+    send_ambulance_notification(
+        event='UNIT_DISPATCHED',
+        ambulance_data=ambulance_data
+    )
+
+    # Notify dispatchers about emergency status update
+    emergency_data = EmergencyCallSerializer(emergency_call).data
+    send_emergency_notification(
+        event='STATUS_UPDATE',
+        emergency_data=emergency_data,
+        paramedic_id=None  # Only send to dispatchers
+    )
+
+    # Notify assigned paramedic about dispatch (UNIT_DISPATCHED event)
+    paramedic_id = emergency_call.assigned_paramedic_id
+    paramedic_delivery = None
+    if paramedic_id:
+        online = presence.is_online(PARAMEDIC, paramedic_id)
+        send_emergency_notification(
+            event='UNIT_DISPATCHED',
+            emergency_data=emergency_data,
+            paramedic_id=paramedic_id
+        )
+        if not online:
+            held = {'type': 'emergency_update', 'event': 'UNIT_DISPATCHED', 'data': dict(emergency_data)}
+            transaction.on_commit(lambda: _hold_for_paramedic(paramedic_id, held), robust=True)
+        paramedic_delivery = 'live' if online else 'held'
+
+    return ambulance_data, emergency_data, paramedic_delivery
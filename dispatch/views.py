@@ -2,15 +2,33 @@ from rest_framework import generics, status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes
+from django.db import transaction
 from django.shortcuts import render
 from django.views.decorators.http import require_POST
 from .models import Ambulance, Hospital
 from .serializers import (
     AmbulanceSerializer,
     AmbulanceLocationUpdateSerializer,
+    LocationBatchSerializer,
     HospitalSerializer,
     DispatchSerializer,
+    NearestAmbulanceQuerySerializer,
+    ApplyPlanSerializer,
+    HospitalRankingQuerySerializer,
+    TrackQuerySerializer,
+    DemandQuerySerializer,
+    StagingQuerySerializer,
 )
+from .spatial import ambulance_index
+from .live_positions import live_positions
+from .history import downsample_track, get_track, location_history
+from .utils import notify_dispatch, publish_location_fix
+from .matrix import fleet_matrix
+from .coverage import coverage_map
+from .forecasting import forecast_as_dict, recommend_staging
+from .assignment import build_assignment_plan
+from .hospitals import hospital_index
+from .routing import travel_times_minutes
 from core.utils import send_ambulance_notification, send_emergency_notification, send_hospital_notification
 
 
@@ -64,18 +82,207 @@ def update_ambulance_location(request, pk):
     serializer = AmbulanceLocationUpdateSerializer(ambulance, data=request.data, partial=True)
     
     if serializer.is_valid():
-        ambulance = serializer.save()
-        
-        # Send real-time notification using optimized utility function
+        # Record in the write-behind store; the row is persisted in the next batch flush
+        live_positions.apply(ambulance)
+        latitude = serializer.validated_data.get('current_latitude', ambulance.current_latitude)
+        longitude = serializer.validated_data.get('current_longitude', ambulance.current_longitude)
+        if latitude is None or longitude is None:
+            return Response({'error': 'Both latitude and longitude are required'}, status=status.HTTP_400_BAD_REQUEST)
+        ambulance_data = publish_location_fix(ambulance, latitude, longitude)
+        return Response(ambulance_data)
+    
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def batch_update_ambulance_locations(request):
+    """API endpoint for uploading buffered GPS fixes for one or more ambulances"""
+
+    serializer = LocationBatchSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    fixes_by_unit = {}
+    for fix in serializer.validated_data['fixes']:
+        fixes_by_unit.setdefault(fix['ambulance_id'], []).append(fix)
+
+    ambulances = Ambulance.objects.select_related(
+        'assigned_paramedic', 'current_emergency'
+    ).in_bulk(list(fixes_by_unit))
+
+    missing = sorted(set(fixes_by_unit) - set(ambulances))
+    if missing:
+        return Response({'error': 'Ambulance not found', 'ambulance_ids': missing}, status=status.HTTP_404_NOT_FOUND)
+
+    # Check the user is assigned to every ambulance in the batch
+    if request.user.is_paramedic:
+        forbidden = sorted(pk for pk, amb in ambulances.items() if amb.assigned_paramedic_id != request.user.id)
+        if forbidden:
+            return Response(
+                {'error': 'Not authorized to update these ambulances', 'ambulance_ids': forbidden},
+                status=status.HTTP_403_FORBIDDEN,
+            )
+
+    results = []
+    for pk, fixes in fixes_by_unit.items():
+        # Oldest first so every fix lands in history and the newest becomes current
+        fixes.sort(key=lambda f: f['timestamp'])
+        ambulance = ambulances[pk]
+        for fix in fixes:
+            # Fixes older than the stored position only go to history
+            live_positions.record(
+                pk, fix['latitude'], fix['longitude'], fix['timestamp'],
+                stored=ambulance.last_location_update,
+            )
+
         ambulance_data = AmbulanceSerializer(ambulance).data
+        # One coalesced broadcast per unit regardless of batch size
         send_ambulance_notification(
             event='LOCATION_UPDATE',
             ambulance_data=ambulance_data
         )
-        
-        return Response(AmbulanceSerializer(ambulance).data)
-    
-    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        results.append(ambulance_data)
+
+    return Response({
+        'accepted': len(serializer.validated_data['fixes']),
+        'ambulances': results,
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def ambulance_track(request, pk):
+    """API endpoint returning a unit's simplified GPS track for a time window"""
+
+    if not Ambulance.objects.filter(pk=pk).exists():
+        return Response({'error': 'Ambulance not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    query = TrackQuerySerializer(data=request.query_params)
+    if not query.is_valid():
+        return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    params = query.validated_data
+    raw = get_track(pk, params['start'], params['end'], buffer=location_history)
+    points = downsample_track(raw, params['tolerance_m'], params['max_points'])
+
+    return Response({
+        'ambulance_id': pk,
+        'start': params['start'],
+        'end': params['end'],
+        'raw_count': len(raw),
+        'count': len(points),
+        'points': [
+            {'timestamp': ts, 'latitude': lat, 'longitude': lng}
+            for ts, lat, lng in points
+        ],
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def nearest_ambulances(request):
+    """API endpoint recommending the nearest AVAILABLE ambulances for a call or point"""
+
+    query = NearestAmbulanceQuerySerializer(data=request.query_params)
+    if not query.is_valid():
+        return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    params = query.validated_data
+    matches = ambulance_index.nearest(
+        params['latitude'],
+        params['longitude'],
+        k=params['k'],
+        unit_types=params.get('unit_type'),
+        max_distance_km=params.get('max_distance_km'),
+    )
+
+    ambulances = Ambulance.objects.select_related(
+        'assigned_paramedic', 'current_emergency'
+    ).in_bulk([pk for pk, _ in matches])
+
+    results = []
+    for pk, distance_km in matches:
+        ambulance = ambulances.get(pk)
+        if ambulance is None:
+            continue
+        results.append({
+            'ambulance': AmbulanceSerializer(ambulance).data,
+            'distance_km': round(distance_km, 3),
+        })
+
+    # One road search from the call covers every returned unit
+    etas = travel_times_minutes(params['latitude'], params['longitude'], [
+        (float(r['ambulance']['current_latitude']), float(r['ambulance']['current_longitude']))
+        for r in results
+    ], to_point=True)
+    for result, minutes in zip(results, etas):
+        result['eta_minutes'] = round(minutes, 1)
+
+    return Response({
+        'latitude': params['latitude'],
+        'longitude': params['longitude'],
+        'results': results,
+    })
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def distance_matrix(request):
+    """API endpoint returning the pending-calls x available-units distance/ETA matrix"""
+
+    if not fleet_matrix.available:
+        return Response({'error': 'Distance matrix requires NumPy'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    return Response(fleet_matrix.as_dict())
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def coverage(request):
+    """API endpoint returning the fleet coverage heat map and current coverage gaps"""
+
+    if not coverage_map.available:
+        return Response({'error': 'Coverage map requires NumPy'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    return Response(coverage_map.as_dict())
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def demand_forecast(request):
+    """API endpoint returning expected calls per grid cell for an hour of the week"""
+
+    if not fleet_matrix.available:
+        return Response({'error': 'Demand forecasting requires NumPy'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    query = DemandQuerySerializer(data=request.query_params)
+    if not query.is_valid():
+        return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    data = forecast_as_dict(query.validated_data.get('hour_of_week'))
+    if data is None:
+        return Response({'error': 'Demand model has not been built'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def staging_plan(request):
+    """API endpoint recommending staging positions for idle units"""
+
+    if not fleet_matrix.available:
+        return Response({'error': 'Demand forecasting requires NumPy'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    query = StagingQuerySerializer(data=request.query_params)
+    if not query.is_valid():
+        return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    params = query.validated_data
+    data = recommend_staging(params.get('hour_of_week'), params.get('count'))
+    if data is None:
+        return Response({'error': 'Demand model has not been built'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(data)
 
 
 @api_view(['POST'])
@@ -121,40 +328,90 @@ def dispatch_ambulance(request):
         emergency_call.update_status('DISPATCHED')
         
         # Send real-time notifications using optimized utility functions
-        from emergencies.serializers import EmergencyCallSerializer
-        
-        # Notify dispatchers about ambulance dispatch
-        ambulance_data = AmbulanceSerializer(ambulance).data
-        send_ambulance_notification(
-            event='UNIT_DISPATCHED',
-            ambulance_data=ambulance_data
-        )
-        
-        # Notify dispatchers about emergency status update
-        emergency_data = EmergencyCallSerializer(emergency_call).data
-        send_emergency_notification(
-            event='STATUS_UPDATE',
-            emergency_data=emergency_data,
-            paramedic_id=None  # Only send to dispatchers
-        )
-        
-        # Notify assigned paramedic about dispatch (UNIT_DISPATCHED event)
-        if emergency_call.assigned_paramedic_id:
-            send_emergency_notification(
-                event='UNIT_DISPATCHED',
-                emergency_data=emergency_data,
-                paramedic_id=emergency_call.assigned_paramedic_id
-            )
+        ambulance_data, emergency_data, paramedic_delivery = notify_dispatch(ambulance, emergency_call)
         
         return Response({
             'message': 'Ambulance dispatched successfully',
             'emergency_call': emergency_data,
-            'ambulance': ambulance_data
+            'ambulance': ambulance_data,
+            'paramedic_delivery': paramedic_delivery
         })
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def assignment_plan(request):
+    """API endpoint proposing a global assignment of AVAILABLE units to RECEIVED calls"""
+
+    if not request.user.is_dispatcher:
+        return Response({'error': 'Only dispatchers can plan dispatches'}, status=status.HTTP_403_FORBIDDEN)
+
+    if not fleet_matrix.available:
+        return Response({'error': 'Assignment planning requires NumPy'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    return Response(build_assignment_plan())
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def apply_assignment_plan(request):
+    """API endpoint dispatching every pair of a plan atomically"""
+
+    if not request.user.is_dispatcher:
+        return Response({'error': 'Only dispatchers can dispatch ambulances'}, status=status.HTTP_403_FORBIDDEN)
+
+    serializer = ApplyPlanSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    from emergencies.models import EmergencyCall
+
+    pairs = serializer.validated_data['assignments']
+    with transaction.atomic():
+        calls = EmergencyCall.objects.select_for_update().in_bulk([p['emergency_call_id'] for p in pairs])
+        ambulances = Ambulance.objects.select_for_update().in_bulk([p['ambulance_id'] for p in pairs])
+
+        # Validate the whole plan before touching anything
+        errors = []
+        for pair in pairs:
+            call = calls.get(pair['emergency_call_id'])
+            ambulance = ambulances.get(pair['ambulance_id'])
+            if call is None or call.status != 'RECEIVED':
+                errors.append({'emergency_call_id': pair['emergency_call_id'], 'error': 'Emergency call must be in RECEIVED status to dispatch'})
+            if ambulance is None or not ambulance.is_available:
+                errors.append({'ambulance_id': pair['ambulance_id'], 'error': 'Ambulance is not available for dispatch'})
+        if errors:
+            return Response({'error': 'Plan is no longer valid', 'details': errors}, status=status.HTTP_409_CONFLICT)
+
+        dispatched = []
+        for pair in pairs:
+            emergency_call = calls[pair['emergency_call_id']]
+            ambulance = ambulances[pair['ambulance_id']]
+            # The unit's current crew is assigned to the call
+            ambulance.assign_to_emergency(emergency_call)
+            emergency_call.assigned_ambulance = ambulance
+            emergency_call.assigned_paramedic_id = ambulance.assigned_paramedic_id
+            emergency_call.dispatcher = request.user
+            emergency_call.update_status('DISPATCHED')
+            dispatched.append((ambulance, emergency_call))
+
+    results = []
+    for ambulance, emergency_call in dispatched:
+        ambulance_data, emergency_data, paramedic_delivery = notify_dispatch(ambulance, emergency_call)
+        results.append({
+            'emergency_call': emergency_data,
+            'ambulance': ambulance_data,
+            'paramedic_delivery': paramedic_delivery,
+        })
+
+    return Response({
+        'message': f'{len(results)} ambulance(s) dispatched successfully',
+        'dispatched': results,
+    })
+
+
 class HospitalListCreateView(generics.ListCreateAPIView):
     """List hospitals and allow staff/admin to create new hospitals."""
 
@@ -203,6 +460,31 @@ class HospitalDetailView(generics.RetrieveUpdateDestroyAPIView):
         return super().destroy(request, *args, **kwargs)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def hospital_ranking(request):
+    """API endpoint ranking destination hospitals for a call or point"""
+
+    query = HospitalRankingQuerySerializer(data=request.query_params)
+    if not query.is_valid():
+        return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    params = query.validated_data
+    results = hospital_index.rank(
+        params['latitude'],
+        params['longitude'],
+        emergency_type=params.get('emergency_type'),
+        limit=params['limit'],
+        include_full=params['include_full'],
+    )
+    return Response({
+        'latitude': params['latitude'],
+        'longitude': params['longitude'],
+        'emergency_type': params.get('emergency_type'),
+        'results': results,
+    })
+
+
 def fleet_overview(request):
     """Fleet overview page"""
     if not request.user.is_authenticated:
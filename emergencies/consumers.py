@@ -1,14 +1,127 @@
-import json
+import asyncio
 import logging
+from collections import OrderedDict, deque
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
 
+from core import jsoncodec
+from core.deltas import entity_versions
+from core.presence import DISPATCHER, PARAMEDIC, presence
+from core.protocol import json_codec, negotiate, wire_message
+from core.regions import DISPATCH_GROUP, Subscription, tiles_in_bbox
+from core.streams import get_stream
+
+from .snapshot import board_snapshot
+
 logger = logging.getLogger(__name__)
 
+# Recent sequence numbers remembered to drop events that arrive via two tile groups
+SEEN_EVENTS = 256
+
+# Flow control: unacknowledged frames before a dispatcher socket is switched
+# to snapshots, and the seconds between snapshots while it lags
+DEFAULT_FLOW_WATERMARK = 200
+DEFAULT_FLOW_SNAPSHOT_INTERVAL = 2.0
+
+
+def parse_subscription(bbox=None, priorities=None):
+    """
+    Build a region subscription from ``[south, west, north, east]`` (or the same
+    comma-separated) and a list of call priorities; either may be empty.
+    
+    Raises ValueError with a message for the client on invalid input.
+    """
+    from .models import EmergencyCall
+    
+    tiles = None
+    if bbox:
+        if isinstance(bbox, str):
+            bbox = bbox.split(',')
+        try:
+            south, west, north, east = (float(v) for v in bbox)
+        except (TypeError, ValueError):
+            raise ValueError("Bounding box must be [south, west, north, east]")
+        tiles = frozenset(tiles_in_bbox(south, west, north, east))
+    
+    if priorities:
+        if isinstance(priorities, str):
+            priorities = priorities.split(',')
+        priorities = frozenset(str(p).strip().upper() for p in priorities)
+        if not priorities <= {choice for choice, _ in EmergencyCall.PRIORITY_CHOICES}:
+            raise ValueError("Unknown priority")
+    else:
+        priorities = None
+    return Subscription(tiles, priorities)
+
+
+class WireProtocolMixin:
+    """Frames in the wire format negotiated at connect (see core/protocol.py); JSON by default"""
+    codec = json_codec
+    
+    async def accept_negotiated(self):
+        subprotocol, self.codec = negotiate(self.scope.get('subprotocols', []))
+        await self.accept(subprotocol)
+        if self.codec.binary:
+            await self.send(bytes_data=self.codec.hello())
+    
+    async def send_frame(self, frame):
+        """Send an already encoded frame"""
+        if isinstance(frame, bytes):
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
+    
+    async def send_message(self, message):
+        await self.send_frame(self.codec.encode(message))
+    
+    def decode_frame(self, text_data=None, bytes_data=None):
+        """Decode a client frame; raises ValueError if it is malformed or not an object"""
+        if text_data is not None:
+            message = jsoncodec.loads(text_data)
+        else:
+            message = self.codec.decode(bytes_data)
+        if not isinstance(message, dict):
+            raise ValueError("Frame must be an object")
+        return message
+
 
-class DispatcherConsumer(AsyncWebsocketConsumer):
-    """WebSocket consumer for dispatcher dashboard real-time updates"""
+class PresenceMixin:
+    """Report this connection to the presence registry (core/presence.py) as ``presence_role``"""
+    presence_role = None
+    
+    async def presence_connect(self):
+        self.presence_user = self.scope['user'].id
+        await sync_to_async(presence.connect)(self.presence_role, self.presence_user, self.channel_name)
+    
+    async def presence_disconnect(self):
+        if getattr(self, 'presence_user', None) is not None:
+            await sync_to_async(presence.disconnect)(self.presence_role, self.presence_user, self.channel_name)
+    
+    async def presence_heartbeat(self):
+        """Any client frame counts as a heartbeat"""
+        if getattr(self, 'presence_user', None) is None:
+            return
+        if presence.heartbeat(self.presence_role, self.presence_user, self.channel_name):
+            await sync_to_async(presence.refresh)(self.presence_role, self.presence_user)
+
+
+class DispatcherConsumer(PresenceMixin, WireProtocolMixin, AsyncWebsocketConsumer):
+    """
+    WebSocket consumer for dispatcher dashboard real-time updates
+    
+    Flow control: a client that sends ``{"type": "ack", "seq": n}`` after
+    processing frames is tracked; once ``DISPATCH_FLOW_WATERMARK`` frames are
+    unacknowledged, events are no longer sent to it. Instead it gets the
+    board every ``DISPATCH_FLOW_SNAPSHOT_INTERVAL`` seconds (one unacknowledged
+    board at a time). When it has acknowledged everything, the events since the
+    last board are replayed and the live stream resumes.
+    """
+    presence_role = DISPATCHER
     
     async def connect(self):
         """Connect to dispatcher group"""
@@ -23,117 +136,334 @@ class DispatcherConsumer(AsyncWebsocketConsumer):
             await self.close(code=4001)  # Custom close code for unauthorized
             return
         
-        self.group_name = 'dispatchers'
+        self.group_name = DISPATCH_GROUP
+        self.groups = []
+        self.init_delivery()
         
-        # Join dispatcher group
-        await self.channel_layer.group_add(
-            self.group_name,
-            self.channel_name
-        )
+        # An optional region/priority scope can be given up front so a
+        # reconnecting client resumes with the same subscription
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        error = None
+        try:
+            self.subscription = parse_subscription(
+                query.get('bbox', [None])[0], query.get('priority', [None])[0]
+            )
+        except ValueError as e:
+            self.subscription, error = Subscription(), str(e)
         
-        await self.accept()
+        # Join the dispatcher group, or the groups of the subscribed region
+        await self.join_groups(self.subscription.groups)
         
-        # Send initial data
-        await self.send_initial_data()
+        await self.accept_negotiated()
+        await self.presence_connect()
+        if error:
+            await self.send_message({'type': 'error', 'message': error})
+        
+        # Replay missed events for a reconnecting client, otherwise send a snapshot
+        resume = query.get('resume')
+        if resume:
+            stream, _, last_seq = resume[0].partition(':')
+            await self.resume(stream, last_seq)
+        else:
+            await self.send_initial_data()
     
     async def disconnect(self, close_code):
-        """Leave dispatcher group"""
+        """Leave dispatcher groups"""
         logger.info(f"WebSocket disconnecting - Close code: {close_code}")
-        if hasattr(self, 'group_name'):
-            await self.channel_layer.group_discard(
-                self.group_name,
-                self.channel_name
-            )
+        if hasattr(self, 'groups'):
+            await self.join_groups([])
+        if getattr(self, '_lagging', None) is not None:
+            self._lagging.cancel()
+        await self.presence_disconnect()
+    
+    def init_delivery(self):
+        """Per-connection delivery state: duplicate filters and flow control"""
+        self._seen = OrderedDict()
+        self._tick_seen = (None, set())
+        # Events up to this seq are in a board or replay already sent
+        self._floor = 0
+        self._acks = False
+        self._inflight = deque()
+        self._lagging = None
+        self._skipped = 0
+        self._board_pending = None
+        self._lag_boards = 0
+    
+    async def join_groups(self, groups):
+        """Join ``groups`` and leave any other group joined before"""
+        for group in groups:
+            if group not in self.groups:
+                await self.channel_layer.group_add(group, self.channel_name)
+        for group in self.groups:
+            if group not in groups:
+                await self.channel_layer.group_discard(group, self.channel_name)
+        self.groups = list(groups)
     
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         """Receive message from WebSocket"""
+        await self.presence_heartbeat()
         try:
-            text_data_json = json.loads(text_data)
+            text_data_json = self.decode_frame(text_data, bytes_data)
             message_type = text_data_json.get('type')
             
             if message_type == 'ping':
-                await self.send(text_data=json.dumps({'type': 'pong'}))
+                await self.send_message({'type': 'pong'})
             elif message_type == 'get_initial_data':
                 await self.send_initial_data()
+            elif message_type == 'get_distance_matrix':
+                await self.send_distance_matrix()
+            elif message_type == 'resume':
+                await self.resume(text_data_json.get('stream'), text_data_json.get('last_seq'))
+            elif message_type == 'resync':
+                await self.send_entity(text_data_json.get('kind'), text_data_json.get('id'))
+            elif message_type == 'subscribe':
+                await self.subscribe(text_data_json.get('bbox'), text_data_json.get('priorities'))
+            elif message_type == 'ack':
+                await self.ack(text_data_json.get('seq'))
                 
-        except json.JSONDecodeError:
+        except ValueError:
             pass
     
+    def in_scope(self, event):
+        """Apply the region/priority subscription and drop events already sent via another tile"""
+        if not self.subscription.matches(event):
+            return False
+        seq = event.get('seq')
+        if self.subscription.tiles is None or seq is None:
+            return True
+        if seq in self._seen:
+            return False
+        self._seen[seq] = None
+        if len(self._seen) > SEEN_EVENTS:
+            self._seen.popitem(last=False)
+        return True
+    
+    def scoped_tick(self, event):
+        """The units of a LOCATIONS_TICK inside the subscribed region, each sent once"""
+        route = event.get('route')
+        if self.subscription.tiles is None or route is None:
+            return event['data']
+        seq, sent = self._tick_seen
+        if seq != event.get('seq'):
+            sent = set()
+            self._tick_seen = (event.get('seq'), sent)
+        units = []
+        for unit, tiles in zip(event['data']['units'], route['units']):
+            if unit['data']['id'] not in sent and self.subscription.in_tiles(tiles):
+                sent.add(unit['data']['id'])
+                units.append(unit)
+        if len(units) == len(event['data']['units']):
+            return event['data']
+        return {'units': units} if units else None
+    
+    async def forward(self, event, data=None):
+        """Send a group event, reusing the frame encoded once at publish time when possible"""
+        seq = event.get('seq')
+        if seq is not None and seq <= self._floor:
+            return
+        if self._lagging is not None:
+            self._skipped += 1
+            return
+        frames = event.get('frames')
+        if frames and (data is None or data is event['data']) and self.codec.name in frames:
+            await self.send_frame(frames[self.codec.name])
+        else:
+            await self.send_message(wire_message(event, data))
+        self.track(seq)
+    
+    @property
+    def flow_watermark(self):
+        return int(getattr(settings, 'DISPATCH_FLOW_WATERMARK', DEFAULT_FLOW_WATERMARK))
+    
+    def track(self, seq):
+        """Count a frame the client has to acknowledge; past the watermark, switch to snapshots"""
+        if not self._acks or seq is None:
+            return
+        self._inflight.append(seq)
+        if self._lagging is None and len(self._inflight) >= self.flow_watermark:
+            logger.info(f"Dispatcher socket lagging ({len(self._inflight)} unacknowledged frames); sending snapshots")
+            self._skipped = 0
+            self._lag_boards = 0
+            self._lagging = asyncio.ensure_future(self.send_snapshots())
+    
+    async def ack(self, seq):
+        """The client has processed every frame up to ``seq``"""
+        try:
+            seq = int(seq)
+        except (TypeError, ValueError, OverflowError):
+            return
+        self._acks = True
+        while self._inflight and self._inflight[0] <= seq:
+            self._inflight.popleft()
+        if self._board_pending is not None and seq >= self._board_pending:
+            self._board_pending = None
+        if self._lagging is None or self._inflight:
+            return
+        # Caught up: bring it up to date with a board first if none was sent while lagging
+        if self._skipped and not self._lag_boards:
+            await self.send_initial_data()
+        else:
+            await self.go_live()
+    
+    async def send_snapshots(self):
+        """While the client lags, send the board if it changed and the previous one was acknowledged"""
+        interval = float(getattr(settings, 'DISPATCH_FLOW_SNAPSHOT_INTERVAL', DEFAULT_FLOW_SNAPSHOT_INTERVAL))
+        while True:
+            await asyncio.sleep(interval)
+            if self._skipped and self._board_pending is None:
+                await self.send_initial_data()
+    
+    async def go_live(self):
+        """Leave snapshot mode, replaying the events skipped since the last board (or sending a new one)"""
+        self._lagging.cancel()
+        self._lagging = None
+        logger.info("Dispatcher socket caught up; back to live events")
+        if self._skipped >= self.flow_watermark:
+            await self.send_initial_data()
+        elif self._skipped:
+            self._skipped = 0
+            await self.resume(get_stream(self.group_name).epoch, self._floor)
+    
     async def emergency_update(self, event):
         """Handle emergency call updates"""
-        await self.send(text_data=json.dumps({
-            'type': 'emergency_update',
-            'event': event['event'],
-            'data': event['data']
-        }))
+        if self.in_scope(event):
+            await self.forward(event)
     
     async def ambulance_update(self, event):
         """Handle ambulance updates"""
-        await self.send(text_data=json.dumps({
-            'type': 'ambulance_update',
-            'event': event['event'],
-            'data': event['data']
-        }))
+        if event['event'] == 'LOCATIONS_TICK':
+            data = self.scoped_tick(event)
+            if data is not None:
+                await self.forward(event, data)
+        elif self.in_scope(event):
+            await self.forward(event)
+    
+    async def hospital_update(self, event):
+        """Handle hospital capacity updates"""
+        await self.forward(event)
+    
+    async def coverage_update(self, event):
+        """Handle fleet coverage gap alerts"""
+        await self.forward(event)
+    
+    async def subscribe(self, bbox, priorities):
+        """Switch to a region/priority scope (or back to the whole area) and resend the board"""
+        try:
+            subscription = parse_subscription(bbox, priorities)
+        except ValueError as e:
+            await self.send_message({'type': 'error', 'message': str(e)})
+            return
+        await self.join_groups(subscription.groups)
+        self.subscription = subscription
+        self._seen.clear()
+        await self.send_initial_data()
+    
+    async def resume(self, stream, last_seq):
+        """Replay the events a reconnecting client missed, or fall back to a snapshot"""
+        try:
+            missed = get_stream(self.group_name).since(stream, int(last_seq))
+        except (TypeError, ValueError, OverflowError):
+            missed = None
+        if missed is None:
+            await self.send_initial_data()
+            return
+        
+        for message in missed:
+            handler = getattr(self, message['type'], None)
+            if handler is not None:
+                await handler(message)
+        if missed:
+            # Don't send these again when they come through the channel layer
+            self._floor = max(self._floor, missed[-1]['seq'])
+        await self.send_message({
+            'type': 'resumed',
+            'stream': stream,
+            'replayed': len(missed)
+        })
     
     async def send_initial_data(self):
-        """Send initial data to the dispatcher"""
+        """Send the shared board snapshot, loading it from the database if needed"""
         try:
-            # Get active emergencies
-            emergencies = await self.get_active_emergencies()
-            
-            # Get ambulance fleet
-            ambulances = await self.get_ambulance_fleet()
-            
-            # Get hospitals
-            hospitals = await self.get_hospitals()
-            
-            await self.send(text_data=json.dumps({
-                'type': 'initial_data',
-                'data': {
-                    'emergencies': emergencies,
-                    'ambulances': ambulances,
-                    'hospitals': hospitals
-                }
-            }))
+            seq, frame = None, None
+            if board_snapshot.is_fresh():
+                seq, frame = board_snapshot.frame_with_seq(self.codec, self.subscription)
+            if frame is None:
+                await database_sync_to_async(board_snapshot.refresh)()
+                seq, frame = board_snapshot.frame_with_seq(self.codec, self.subscription)
+            await self.send_frame(frame)
         except Exception as e:
-            await self.send(text_data=json.dumps({
+            await self.send_message({
                 'type': 'error',
                 'message': str(e)
-            }))
-    
-    @database_sync_to_async
-    def get_active_emergencies(self):
-        """Get active emergency calls"""
-        from .models import EmergencyCall
-        from .serializers import EmergencyCallSerializer
-        
-        emergencies = EmergencyCall.objects.filter(
-            status__in=['RECEIVED', 'DISPATCHED', 'EN_ROUTE', 'ON_SCENE', 'TRANSPORTING']
-        ).order_by('-received_at')
-        
-        return EmergencyCallSerializer(emergencies, many=True).data
+            })
+            return
+        # Queued events up to ``seq`` are in the board
+        self._floor = max(self._floor, seq)
+        self._skipped = 0
+        self._board_pending = seq
+        if self._lagging is not None:
+            self._lag_boards += 1
+        self.track(seq)
     
-    @database_sync_to_async
-    def get_ambulance_fleet(self):
-        """Get ambulance fleet data"""
-        from dispatch.models import Ambulance
-        from dispatch.serializers import AmbulanceSerializer
-        
-        ambulances = Ambulance.objects.all()
-        return AmbulanceSerializer(ambulances, many=True).data
+    async def send_entity(self, kind, pk):
+        """Send one emergency or ambulance in full after a delta version gap"""
+        if kind not in ('emergency', 'ambulance'):
+            return
+        try:
+            pk = int(pk)
+        except (TypeError, ValueError, OverflowError):
+            return
+        version = entity_versions.version(kind, pk)
+        data = await self.get_entity(kind, pk)
+        if data is None:
+            return
+        data['version'] = version
+        data['epoch'] = entity_versions.epoch
+        await self.send_message({
+            'type': f'{kind}_update',
+            'event': 'RESYNC',
+            'data': data,
+            'delta': False
+        })
     
+    async def send_distance_matrix(self):
+        """Send the pending-calls x available-units distance/ETA matrix"""
+        from dispatch.matrix import fleet_matrix
+
+        if not fleet_matrix.available:
+            await self.send_message({
+                'type': 'error',
+                'message': 'Distance matrix requires NumPy'
+            })
+            return
+
+        data = await database_sync_to_async(fleet_matrix.as_dict)()
+        await self.send_message({
+            'type': 'distance_matrix',
+            'data': data
+        })
+
     @database_sync_to_async
-    def get_hospitals(self):
-        """Get hospital data"""
-        from dispatch.models import Hospital
-        from dispatch.serializers import HospitalSerializer
+    def get_entity(self, kind, pk):
+        """Serialize a single emergency call or ambulance, or None if it doesn't exist"""
+        if kind == 'emergency':
+            from .models import EmergencyCall as model
+            from .serializers import EmergencyCallSerializer as serializer_class
+        else:
+            from dispatch.models import Ambulance as model
+            from dispatch.serializers import AmbulanceSerializer as serializer_class
         
-        hospitals = Hospital.objects.all()
-        return HospitalSerializer(hospitals, many=True).data
+        try:
+            instance = model.objects.get(pk=pk)
+        except (model.DoesNotExist, ValueError, TypeError):
+            return None
+        return dict(serializer_class(instance).data)
 
 
-class ParamedicConsumer(AsyncWebsocketConsumer):
+class ParamedicConsumer(PresenceMixin, WireProtocolMixin, AsyncWebsocketConsumer):
     """WebSocket consumer for paramedic field interface updates"""
+    presence_role = PARAMEDIC
+    
     async def connect(self):
         user = self.scope.get("user", AnonymousUser())
         
@@ -146,25 +476,102 @@ class ParamedicConsumer(AsyncWebsocketConsumer):
             return
         self.group_name = f"paramedic_{user.id}"
         await self.channel_layer.group_add(self.group_name, self.channel_name)
-        await self.accept()
+        await self.accept_negotiated()
+        await self.presence_connect()
+        # Resolve the assigned ambulance once; GPS fixes then need no lookup
+        self.ambulance_id, self.location_floor = await self.get_assigned_ambulance()
+        
+        # Deliver what was held while this paramedic was offline (e.g. a dispatch)
+        for message in await sync_to_async(presence.take_held)(PARAMEDIC, user.id):
+            handler = getattr(self, message.get('type'), None)
+            if handler is not None:
+                await handler(message)
 
     async def disconnect(self, close_code):
         logger.info(f"Paramedic WebSocket disconnecting - Close code: {close_code}")
         if hasattr(self, 'group_name'):
             await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        await self.presence_disconnect()
 
-    async def receive(self, text_data):
-        # Paramedic client can ping to keepalive
+    async def receive(self, text_data=None, bytes_data=None):
+        # Paramedic client can ping to keepalive and stream GPS fixes
+        await self.presence_heartbeat()
         try:
-            data = json.loads(text_data)
+            data = self.decode_frame(text_data, bytes_data)
             if data.get('type') == 'ping':
-                await self.send(text_data=json.dumps({'type': 'pong'}))
+                await self.send_message({'type': 'pong'})
+            elif data.get('type') == 'location':
+                await self.handle_location(data)
         except Exception:
-            pass
+            logger.warning("Paramedic WebSocket message handling failed", exc_info=True)
+
+    async def handle_location(self, data):
+        """Record a GPS fix sent over the socket, authorized once per connection"""
+        from datetime import timedelta
+        from django.utils import timezone
+        from django.utils.dateparse import parse_datetime
+        from core.geo import coerce_point
+
+        point = coerce_point(data.get('latitude'), data.get('longitude'))
+        if point is None:
+            await self.send_message({'type': 'error', 'message': 'Invalid coordinates'})
+            return
+
+        timestamp = None
+        if data.get('timestamp'):
+            timestamp = parse_datetime(str(data['timestamp']))
+            if timestamp is None or timestamp.tzinfo is None or timestamp > timezone.now() + timedelta(minutes=1):
+                await self.send_message({'type': 'error', 'message': 'Invalid timestamp'})
+                return
+
+        requested = data.get('ambulance_id')
+        if requested is not None:
+            try:
+                requested = int(requested)
+            except (TypeError, ValueError):
+                await self.send_message({'type': 'error', 'message': 'Invalid ambulance_id'})
+                return
+
+        # The ambulance resolved at connect is reused for the rest of the connection;
+        # re-check only if there was none or the client names another unit
+        if getattr(self, 'ambulance_id', None) is None or (requested and requested != self.ambulance_id):
+            self.ambulance_id, self.location_floor = await self.get_assigned_ambulance(requested)
+        if self.ambulance_id is None:
+            await self.send_message({'type': 'error', 'message': 'Not authorized to update this ambulance'})
+            return
+
+        fix = await self.publish_location(self.ambulance_id, point[0], point[1], timestamp)
+        if fix is not None:
+            # Later fixes must be newer than the unit's current one
+            self.location_floor = fix.timestamp
+        await self.send_message({
+            'type': 'location_ack',
+            'ambulance_id': self.ambulance_id,
+            'timestamp': data.get('timestamp'),
+        })
+
+    @database_sync_to_async
+    def get_assigned_ambulance(self, requested=None):
+        """Return (id, last_location_update) of the ambulance assigned to this paramedic, or (None, None)"""
+        from dispatch.models import Ambulance
+
+        ambulances = Ambulance.objects.filter(assigned_paramedic_id=self.scope['user'].id)
+        if requested:
+            ambulances = ambulances.filter(pk=requested)
+        return ambulances.values_list('pk', 'last_location_update').first() or (None, None)
+
+    @database_sync_to_async
+    def publish_location(self, ambulance_id, latitude, longitude, timestamp):
+        """Feed the fix into the live store and the coalesced broadcast, without reading the unit"""
+        from dispatch.utils import publish_unit_location
+
+        return publish_unit_location(
+            ambulance_id, latitude, longitude, timestamp, stored=self.location_floor
+        )
 
     async def emergency_update(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'emergency_update',
             'event': event['event'],
             'data': event['data']
-        }))
\ No newline at end of file
+        })
\ No newline at end of file
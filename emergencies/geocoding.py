@@ -0,0 +1,208 @@
+"""
+Offline reverse geocoding for call intake.
+
+Places are loaded from a local gazetteer (``GAZETTEER_PATH``) into a
+lat/lng grid so a lookup only inspects the cells around the caller, and
+answers are memoized in an LRU cache keyed by coordinates rounded to
+``CACHE_PRECISION`` decimals (about 11 m), so repeated picks of the same
+spot never touch the index.
+
+Two file formats are accepted:
+
+* a GeoNames dump (``cities500.txt``, ``<CC>.txt``; tab-separated, no header)
+* a CSV with a header row containing ``name``, ``latitude``, ``longitude``
+  and optionally ``region`` and ``country``
+"""
+import csv
+import logging
+import math
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from core.geo import haversine_km
+
+logger = logging.getLogger(__name__)
+
+CELL_DEGREES = 0.05
+KM_PER_DEGREE = 111.195
+DEFAULT_MAX_DISTANCE_KM = 25.0
+# Beyond this distance the address is phrased as "Near <place>"
+NEAR_KM = 0.5
+CACHE_PRECISION = 4
+CACHE_SIZE = 10000
+
+# GeoNames column positions
+_GN_ASCIINAME, _GN_LAT, _GN_LNG, _GN_COUNTRY, _GN_ADMIN1 = 2, 4, 5, 8, 10
+
+
+@dataclass(frozen=True)
+class Place:
+    name: str
+    latitude: float
+    longitude: float
+    region: str = ''
+    country: str = ''
+
+
+def _read_geonames(fh) -> List[Place]:
+    places = []
+    for line in fh:
+        cols = line.rstrip('\n').split('\t')
+        if len(cols) <= _GN_ADMIN1:
+            continue
+        try:
+            places.append(Place(
+                name=cols[_GN_ASCIINAME] or cols[1],
+                latitude=float(cols[_GN_LAT]),
+                longitude=float(cols[_GN_LNG]),
+                region=cols[_GN_ADMIN1],
+                country=cols[_GN_COUNTRY],
+            ))
+        except ValueError:
+            continue
+    return places
+
+
+def _read_csv(fh) -> List[Place]:
+    places = []
+    for row in csv.DictReader(fh):
+        try:
+            places.append(Place(
+                name=(row.get('name') or '').strip(),
+                latitude=float(row['latitude']),
+                longitude=float(row['longitude']),
+                region=(row.get('region') or '').strip(),
+                country=(row.get('country') or '').strip(),
+            ))
+        except (KeyError, TypeError, ValueError):
+            continue
+    return [p for p in places if p.name]
+
+
+def format_address(place: Place, distance_km: float) -> str:
+    parts = [place.name] + [p for p in (place.region, place.country) if p and not p.isdigit()]
+    address = ', '.join(parts)
+    return f"Near {address}" if distance_km > NEAR_KM else address
+
+
+class ReverseGeocoder:
+    """Grid-indexed gazetteer with an LRU cache of recent lookups."""
+
+    def __init__(self, path=None, cache_size: int = CACHE_SIZE):
+        self._path = path
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._places: List[Place] = []
+        self._grid: Dict[Tuple[int, int], List[int]] = {}
+        self._cache: 'OrderedDict[Tuple[float, float], Optional[dict]]' = OrderedDict()
+        self._cache_size = cache_size
+
+    @property
+    def path(self):
+        return self._path if self._path is not None else getattr(settings, 'GAZETTEER_PATH', None)
+
+    @property
+    def max_distance_km(self) -> float:
+        return float(getattr(settings, 'GEOCODER_MAX_DISTANCE_KM', DEFAULT_MAX_DISTANCE_KM))
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._load()
+                    self._loaded = True
+
+    def _load(self):
+        self._places = []
+        self._grid = {}
+        path = self.path
+        if not path:
+            return
+        try:
+            with open(path, 'r', encoding='utf-8', newline='') as fh:
+                places = _read_csv(fh) if str(path).lower().endswith('.csv') else _read_geonames(fh)
+        except OSError as e:
+            logger.warning(f"Failed to load gazetteer from {path}: {e}")
+            return
+        for n, place in enumerate(places):
+            self._grid.setdefault(self._cell_for(place.latitude, place.longitude), []).append(n)
+        self._places = places
+        logger.info(f"Loaded gazetteer from {path}: {len(places)} places")
+
+    def reload(self):
+        with self._lock:
+            self._loaded = False
+            self._cache.clear()
+
+    @staticmethod
+    def _cell_for(lat: float, lng: float) -> Tuple[int, int]:
+        return (math.floor(lat / CELL_DEGREES), math.floor(lng / CELL_DEGREES))
+
+    def _nearest(self, latitude: float, longitude: float) -> Optional[Tuple[Place, float]]:
+        ci, cj = self._cell_for(latitude, longitude)
+        max_km = self.max_distance_km
+        # Longitude cells shrink with latitude, so search rings in that unit
+        km_per_ring = CELL_DEGREES * KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01)
+        max_ring = int(max_km / km_per_ring) + 1
+        best, best_d = None, math.inf
+        for ring in range(max_ring + 1):
+            for di in range(-ring, ring + 1):
+                for dj in range(-ring, ring + 1):
+                    if max(abs(di), abs(dj)) != ring:
+                        continue
+                    for n in self._grid.get((ci + di, cj + dj), ()):
+                        place = self._places[n]
+                        d = haversine_km(latitude, longitude, place.latitude, place.longitude)
+                        if d < best_d:
+                            best, best_d = place, d
+            # Everything in later rings is at least ``ring`` cells away
+            if best is not None and best_d <= ring * km_per_ring:
+                break
+        if best is None or best_d > max_km:
+            return None
+        return best, best_d
+
+    def reverse(self, latitude: float, longitude: float) -> Optional[dict]:
+        """
+        Nearest gazetteer place to a point as ``{address, name, region,
+        country, distance_km}``, or None when nothing is within range.
+        """
+        key = (round(latitude, CACHE_PRECISION), round(longitude, CACHE_PRECISION))
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        self._ensure_loaded()
+        found = self._nearest(*key)
+        result = None
+        if found is not None:
+            place, distance_km = found
+            result = {
+                'address': format_address(place, distance_km),
+                'name': place.name,
+                'region': place.region,
+                'country': place.country,
+                'distance_km': round(distance_km, 3),
+            }
+
+        with self._lock:
+            self._cache[key] = result
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+
+reverse_geocoder = ReverseGeocoder()
+
+
+def address_for(latitude: float, longitude: float) -> str:
+    """Address for a point, falling back to the coordinates themselves."""
+    result = reverse_geocoder.reverse(latitude, longitude)
+    if result is not None:
+        return result['address']
+    return f"{latitude:.6f}, {longitude:.6f}"
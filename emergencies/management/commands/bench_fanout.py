@@ -0,0 +1,105 @@
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from core.protocol import SUBPROTOCOLS, encode_frames, json_codec
+from core.regions import Subscription
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the CPU cost of delivering one dispatcher event to many sockets, '
+        'encoding per connection versus forwarding frames encoded once at publish time'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', default='10,100,1000', help='Comma-separated connection counts')
+        parser.add_argument('--events', type=int, default=20, help='Events delivered per measurement')
+        parser.add_argument(
+            '--format', default='json', choices=sorted({c.name for c in SUBPROTOCOLS.values()}),
+            help='Wire format negotiated by the simulated sockets'
+        )
+
+    def handle(self, *args, **options):
+        from dispatch.models import Ambulance
+        from dispatch.serializers import AmbulanceSerializer
+        from emergencies.models import EmergencyCall
+        from emergencies.serializers import EmergencyCallSerializer
+
+        try:
+            counts = [int(n) for n in options['connections'].split(',')]
+        except ValueError:
+            raise CommandError('--connections must be a comma-separated list of integers')
+        codec = next((c for c in SUBPROTOCOLS.values() if c.name == options['format']), json_codec)
+
+        call = EmergencyCall.objects.order_by('-received_at').first()
+        units = AmbulanceSerializer(Ambulance.objects.all()[:200], many=True).data
+        if call is None or not units:
+            raise CommandError('Needs at least one emergency call and one ambulance in the database')
+        events = [
+            ('emergency_update', {
+                'type': 'emergency_update', 'event': 'STATUS_UPDATE',
+                'data': dict(EmergencyCallSerializer(call).data), 'delta': False, 'seq': 1,
+            }),
+            (f'LOCATIONS_TICK ({len(units)} units)', {
+                'type': 'ambulance_update', 'event': 'LOCATIONS_TICK',
+                'data': {'units': [{'delta': False, 'data': dict(u)} for u in units]}, 'delta': False, 'seq': 2,
+            }),
+        ]
+
+        self.stdout.write(f"Format: {codec.name}, {options['events']} event(s) per measurement, CPU time per event")
+        self.stdout.write(
+            f"{'event':<28}{'sockets':>8}{'per-socket ms':>15}{'encode-once ms':>16}{'of which encode':>17}{'x':>7}"
+        )
+        for name, event in events:
+            for count in counts:
+                legacy, once, encode = asyncio.run(self.measure(event, count, codec, options['events']))
+                self.stdout.write(
+                    f'{name:<28}{count:>8}{legacy:>15.3f}{once:>16.3f}{encode:>17.3f}{legacy / once:>7.1f}'
+                )
+
+    @staticmethod
+    def make_sockets(count, codec):
+        """Dispatcher consumers as the channel layer would call them, writing into a byte counter"""
+        from emergencies.consumers import DispatcherConsumer
+
+        sent = [0]
+
+        async def send(text_data=None, bytes_data=None, close=False):
+            sent[0] += len(text_data if text_data is not None else bytes_data)
+
+        sockets = []
+        for _ in range(count):
+            consumer = DispatcherConsumer()
+            consumer.subscription = Subscription()
+            consumer.codec = codec
+            consumer.init_delivery()
+            consumer.send = send
+            sockets.append(consumer)
+        return sockets
+
+    async def measure(self, event, count, codec, repeat):
+        """CPU milliseconds per event: per-socket encoding, encode-once, and the encode-once encode step"""
+        sockets = self.make_sockets(count, codec)
+        handler = event['type']
+
+        start = time.process_time()
+        for _ in range(repeat):
+            for consumer in sockets:
+                await getattr(consumer, handler)(event)
+        legacy = time.process_time() - start
+
+        with override_settings(WS_PREENCODED_FORMATS=[codec.name]):
+            start = time.process_time()
+            encode = 0.0
+            for _ in range(repeat):
+                t = time.process_time()
+                message = {**event, 'frames': encode_frames(event)}
+                encode += time.process_time() - t
+                for consumer in sockets:
+                    await getattr(consumer, handler)(message)
+            once = time.process_time() - start
+
+        return legacy / repeat * 1000, once / repeat * 1000, encode / repeat * 1000
@@ -32,6 +32,9 @@ class EmergencyCallSerializer(serializers.ModelSerializer):
 class EmergencyCallCreateSerializer(serializers.ModelSerializer):
     """Serializer for creating new emergency calls (public API)"""
     
+    # Optional when coordinates are given; filled in by reverse geocoding
+    location_address = serializers.CharField(max_length=200, required=False, allow_blank=True)
+    
     class Meta:
         model = EmergencyCall
         fields = [
@@ -40,6 +43,11 @@ class EmergencyCallCreateSerializer(serializers.ModelSerializer):
         ]
     
     def validate(self, data):
+        # Fill in the address from GPS coordinates when the caller left it blank
+        if not data.get('location_address') and data.get('latitude') is not None and data.get('longitude') is not None:
+            from .geocoding import address_for
+            data['location_address'] = address_for(float(data['latitude']), float(data['longitude']))[:200]
+
         # Ensure required fields are present
         required_fields = ['caller_name', 'caller_phone', 'emergency_type', 'description', 'location_address']
         for field in required_fields:
@@ -93,3 +101,10 @@ class EmergencyCallStatusUpdateSerializer(serializers.ModelSerializer):
                     f"Cannot transition from {current_status} to {value}"
                 )
         return value
+
+
+class ReverseGeocodeQuerySerializer(serializers.Serializer):
+    """Query parameters for reverse geocoding"""
+
+    latitude = serializers.FloatField(min_value=-90, max_value=90)
+    longitude = serializers.FloatField(min_value=-180, max_value=180)
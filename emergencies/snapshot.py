@@ -0,0 +1,210 @@
+"""
+Shared initial-data snapshot for the dispatcher dashboard.
+
+Every dispatcher that connects (or reconnects past the replay buffer) needs
+the whole board: active calls, the fleet and hospitals. Instead of running
+those queries and serializing the result once per connection, one copy of
+the board is kept in process memory, built from the database on first use
+and then kept current by applying the same events that are broadcast to the
+``dispatchers`` stream. The encoded ``initial_data`` frame is cached (per
+wire format) and only re-encoded after the board changes, so a burst of connections costs a
+single encode and no queries.
+
+The snapshot is labelled with the stream ``seq`` of the last event applied,
+so a client can resume from it exactly as from a live event. It is rebuilt
+from the database after ``DISPATCH_SNAPSHOT_MAX_AGE`` seconds to pick up
+changes that don't produce an event (admin edits, new vehicles).
+"""
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from core.deltas import entity_versions
+from core.regions import DISPATCH_GROUP
+from core.streams import get_stream
+
+ACTIVE_STATUSES = ('RECEIVED', 'DISPATCHED', 'EN_ROUTE', 'ON_SCENE', 'TRANSPORTING')
+
+DEFAULT_MAX_AGE = 300
+
+
+def _merge(store: Dict[Any, Dict[str, Any]], data: Dict[str, Any], is_delta: bool) -> Optional[Dict[str, Any]]:
+    """Apply a full payload or a delta to ``store``; returns the updated entity."""
+    pk = data.get('id')
+    if pk is None:
+        return None
+    if not is_delta:
+        store[pk] = dict(data)
+        return store[pk]
+    current = store.get(pk)
+    if current is None:
+        return None
+    current.update((k, v) for k, v in data.items() if k != 'base_version')
+    return current
+
+
+class BoardSnapshot:
+    """The dispatcher board as of a stream sequence number, plus its encoded frame."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._loaded = False
+        self._loaded_at = 0.0
+        self._building = False
+        self._pending: List[Dict[str, Any]] = []
+        self._emergencies: Dict[Any, Dict[str, Any]] = {}
+        self._ambulances: Dict[Any, Dict[str, Any]] = {}
+        self._hospitals: Dict[Any, Dict[str, Any]] = {}
+        self._stream = ''
+        self._seq = 0
+        self._frames: Dict[str, Any] = {}
+        self.encodes = 0
+
+    @property
+    def max_age(self) -> float:
+        return float(getattr(settings, 'DISPATCH_SNAPSHOT_MAX_AGE', DEFAULT_MAX_AGE))
+
+    @property
+    def seq(self) -> int:
+        with self._lock:
+            return self._seq
+
+    def is_fresh(self) -> bool:
+        with self._lock:
+            return self._loaded and time.monotonic() - self._loaded_at < self.max_age
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
+            self._frames.clear()
+
+    def apply(self, message: Dict[str, Any]):
+        """Stream listener: fold a broadcast event into the board."""
+        with self._lock:
+            if self._building:
+                self._pending.append(message)
+            elif self._loaded:
+                self._apply(message)
+
+    def _apply(self, message: Dict[str, Any]):
+        message_type = message.get('type')
+        data = message.get('data') or {}
+        if message_type == 'emergency_update':
+            emergency = _merge(self._emergencies, data, message.get('delta', False))
+            if emergency is not None and emergency.get('status') not in ACTIVE_STATUSES:
+                self._emergencies.pop(emergency['id'], None)
+        elif message_type == 'ambulance_update':
+            if message.get('event') == 'LOCATIONS_TICK':
+                for unit in data.get('units', ()):
+                    _merge(self._ambulances, unit['data'], unit['delta'])
+            else:
+                _merge(self._ambulances, data, message.get('delta', False))
+        elif message_type == 'hospital_update':
+            _merge(self._hospitals, data, False)
+        self._seq = max(self._seq, message.get('seq') or 0)
+        self._frames.clear()
+
+    def refresh(self):
+        """Rebuild unless another caller just did (connections arriving together share one load)."""
+        with self._build_lock:
+            if not self.is_fresh():
+                self.rebuild()
+
+    def rebuild(self):
+        """Reload the board from the database (sync; call off the event loop)."""
+        from dispatch.models import Ambulance, Hospital
+        from dispatch.serializers import AmbulanceSerializer, HospitalSerializer
+        from .models import EmergencyCall
+        from .serializers import EmergencyCallSerializer
+
+        with self._lock:
+            self._building = True
+            self._pending = []
+        try:
+            # Events up to this sequence number are reflected in the rows read
+            # below; versions are read first so a concurrent update can only
+            # make the snapshot newer than its label, never older
+            stream = get_stream(DISPATCH_GROUP)
+            seq = stream.last_seq
+            emergency_versions = entity_versions.versions('emergency')
+            ambulance_versions = entity_versions.versions('ambulance')
+
+            emergencies = EmergencyCallSerializer(
+                EmergencyCall.objects.filter(status__in=ACTIVE_STATUSES).order_by('-received_at'),
+                many=True
+            ).data
+            ambulances = AmbulanceSerializer(Ambulance.objects.all(), many=True).data
+            hospitals = HospitalSerializer(Hospital.objects.all(), many=True).data
+        except Exception:
+            with self._lock:
+                self._building = False
+                self._pending = []
+            raise
+
+        with self._lock:
+            self._emergencies = {
+                e['id']: entity_versions.label('emergency', dict(e), emergency_versions) for e in emergencies
+            }
+            self._ambulances = {
+                a['id']: entity_versions.label('ambulance', dict(a), ambulance_versions) for a in ambulances
+            }
+            self._hospitals = {h['id']: dict(h) for h in hospitals}
+            self._stream = stream.epoch
+            self._seq = seq
+            self._loaded = True
+            self._loaded_at = time.monotonic()
+            self._building = False
+            # Events that arrived while the rows were being read
+            pending, self._pending = self._pending, []
+            for message in pending:
+                if (message.get('seq') or 0) > seq:
+                    self._apply(message)
+            self._frames.clear()
+
+    def _message(self, emergencies, ambulances, hospitals) -> Dict[str, Any]:
+        return {
+            'type': 'initial_data',
+            'stream': self._stream,
+            'seq': self._seq,
+            'data': {
+                'emergencies': sorted(emergencies, key=lambda e: e.get('received_at') or '', reverse=True),
+                'ambulances': list(ambulances),
+                'hospitals': list(hospitals)
+            }
+        }
+
+    def frame(self, codec, subscription=None):
+        """
+        The ``initial_data`` frame encoded with ``codec`` (see ``core.protocol``),
+        or None if the board isn't loaded.
+
+        With a region/priority ``subscription`` (see ``core.regions``) only the
+        calls and units it covers are included; that frame isn't cached.
+        """
+        return self.frame_with_seq(codec, subscription)[1]
+
+    def frame_with_seq(self, codec, subscription=None) -> Tuple[int, Any]:
+        """``(seq, frame)``: ``frame()`` and the stream sequence number it reflects."""
+        with self._lock:
+            if not self._loaded:
+                return self._seq, None
+            if subscription is not None and (subscription.tiles is not None or subscription.priorities is not None):
+                return self._seq, codec.encode(self._message(
+                    (e for e in self._emergencies.values() if subscription.covers('emergency', e)),
+                    (a for a in self._ambulances.values() if subscription.covers('ambulance', a)),
+                    self._hospitals.values()
+                ))
+            frame = self._frames.get(codec.name)
+            if frame is None:
+                frame = self._frames[codec.name] = codec.encode(self._message(
+                    self._emergencies.values(), self._ambulances.values(), self._hospitals.values()
+                ))
+                self.encodes += 1
+            return self._seq, frame
+
+
+board_snapshot = BoardSnapshot()
+get_stream(DISPATCH_GROUP).add_listener(board_snapshot.apply)
@@ -1,3 +1,31 @@
-from django.test import TestCase
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.test import TransactionTestCase
 
-# Create your tests here.
+from core.models import User
+
+from .consumers import DispatcherConsumer
+
+
+class DispatcherFrameTests(TransactionTestCase):
+    """Malformed client frames are ignored without closing the socket."""
+
+    def test_non_object_frames_and_bad_resync_ids(self):
+        user = User.objects.create_user('disp', password='x', role='dispatcher')
+
+        async def run():
+            communicator = WebsocketCommunicator(DispatcherConsumer.as_asgi(), '/ws/dispatchers/')
+            communicator.scope['user'] = user
+            connected, _ = await communicator.connect(timeout=10)
+            self.assertTrue(connected)
+            while not await communicator.receive_nothing(timeout=0.5):
+                await communicator.receive_from()
+
+            for frame in ('[1, 2]', '"x"', '3', '{"type": "resync", "kind": "ambulance", "id": [1]}',
+                          '{"type": "ack", "seq": {"a": 1}}'):
+                await communicator.send_to(text_data=frame)
+            await communicator.send_json_to({'type': 'ping'})
+            self.assertEqual(await communicator.receive_json_from(timeout=5), {'type': 'pong'})
+            await communicator.disconnect()
+
+        async_to_sync(run)()
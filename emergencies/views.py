@@ -1,6 +1,6 @@
 from rest_framework import generics, status
 from rest_framework.throttling import AnonRateThrottle
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from django.shortcuts import render
@@ -10,7 +10,13 @@ import logging
 import os
 import uuid
 from .models import EmergencyCall
-from .serializers import EmergencyCallSerializer, EmergencyCallCreateSerializer, EmergencyCallStatusUpdateSerializer
+from .serializers import (
+    EmergencyCallSerializer,
+    EmergencyCallCreateSerializer,
+    EmergencyCallStatusUpdateSerializer,
+    ReverseGeocodeQuerySerializer,
+)
+from .geocoding import reverse_geocoder
 from core.utils import send_emergency_notification
 
 
@@ -287,3 +293,24 @@ def upload_emergency_image(request):
     except Exception as e:
         return Response({'error': f'Failed to upload image: {str(e)}'}, 
                        status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class ReverseGeocodeThrottle(AnonRateThrottle):
+    """Separate budget so address lookups don't eat into call intake"""
+    scope = 'geocode'
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+@throttle_classes([ReverseGeocodeThrottle])
+def reverse_geocode(request):
+    """API endpoint resolving coordinates to an address from the local gazetteer"""
+    query = ReverseGeocodeQuerySerializer(data=request.query_params)
+    if not query.is_valid():
+        return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    params = query.validated_data
+    result = reverse_geocoder.reverse(params['latitude'], params['longitude'])
+    if result is None:
+        return Response({'error': 'No known place near these coordinates'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(result)